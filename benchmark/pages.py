@@ -0,0 +1,115 @@
+import struct
+import zlib
+
+# test/ のフィクスチャのうち，ベンチマークで取得するページ
+fixtures = {
+    'requests_page': '/test_requests_page.html',
+    'ctf_0ops': '/hacklu-ctf-2013-exp400-wannable-0ops.html',
+    'webfont': '/webfont.html',
+    'text_css': '/text_css.html',
+    'css_screen': '/test_css_screen.html',
+}
+
+_html = '<!DOCTYPE html><html lang="en"><head><meta charset="utf-8"><title>{title}</title>{head}</head>' \
+        '<body>{body}</body></html>'
+
+
+def html(title: str, body: str, head: str = '') -> tuple:
+    return 'text/html; charset=utf-8', _html.format(title=title, head=head, body=body).encode()
+
+
+def png(width: int, height: int, seed: int = 0) -> bytes:
+    """
+    seed ごとに模様の異なる RGB の PNG を作る
+    """
+    rows = [b'\x00' + bytes((x * 7 + y * 13 + seed * 31) % 256 for x in range(width * 3)) for y in range(height)]
+
+    def chunk(tag: bytes, data: bytes) -> bytes:
+        return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data) & 0xffffffff)
+
+    return b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)) + \
+        chunk(b'IDAT', zlib.compress(b''.join(rows))) + chunk(b'IEND', b'')
+
+
+def many_images(count: int = 200, size: int = 64) -> tuple:
+    """
+    count 枚の別々の画像を img で参照するページ
+    """
+    pages = {f'/many_images/img/{i}.png': ('image/png', png(size, size, i)) for i in range(count)}
+    body = ''.join(f'<img src="img/{i}.png" alt="{i}">' for i in range(count))
+    pages['/many_images/index.html'] = html('many images', body)
+    return '/many_images/index.html', pages
+
+
+def deep_import(depth: int = 20) -> tuple:
+    """
+    スタイルシートが depth 段の @import でつながり，各段が背景画像を参照するページ
+    """
+    pages = {}
+    for i in range(depth):
+        next_import = f'@import url("{i + 1}.css");\n' if i + 1 < depth else ''
+        css = f'{next_import}.level{i} {{ background: url("img/{i}.png"); padding: {i}px; }}\n'
+        pages[f'/deep_import/{i}.css'] = ('text/css', css.encode())
+        pages[f'/deep_import/img/{i}.png'] = ('image/png', png(16, 16, i))
+    body = ''.join(f'<div class="level{i}">{i}</div>' for i in range(depth))
+    pages['/deep_import/index.html'] = html('deep import', body, head='<link rel="stylesheet" href="0.css">')
+    return '/deep_import/index.html', pages
+
+
+def many_iframes(count: int = 30) -> tuple:
+    """
+    count 個の iframe を持ち，それぞれのフレームが画像とスタイルシートを参照するページ
+    """
+    pages = {'/many_iframes/frame.css': ('text/css', b'body { margin: 0; background: url("shared.png"); }')}
+    pages['/many_iframes/shared.png'] = ('image/png', png(32, 32))
+    for i in range(count):
+        pages[f'/many_iframes/img/{i}.png'] = ('image/png', png(24, 24, i))
+        pages[f'/many_iframes/frame/{i}.html'] = html(f'frame {i}', f'<p>frame {i}</p><img src="../img/{i}.png">',
+                                                     head='<link rel="stylesheet" href="../frame.css">')
+    body = ''.join(f'<iframe src="frame/{i}.html"></iframe>' for i in range(count))
+    pages['/many_iframes/index.html'] = html('many iframes', body)
+    return '/many_iframes/index.html', pages
+
+
+def huge_dom(rows: int = 5000) -> tuple:
+    """
+    rows 行の表と，インラインのスタイルとリンクを多数持つ大きな DOM のページ
+    """
+    cells = ''.join(f'<tr><td style="color: #{i % 4096:03x}">{i}</td><td><a href="item/{i}">item {i}</a></td>'
+                    f'<td><span class="c{i % 10}">{"text " * 5}</span></td></tr>' for i in range(rows))
+    style = '<style>' + ''.join(f'.c{i} {{ margin: {i}px; }}' for i in range(10)) + '</style>'
+    pages = {'/huge_dom/index.html': html('huge dom', f'<table>{cells}</table>', head=style)}
+    return '/huge_dom/index.html', pages
+
+
+# 合成したページ．(関数, 大きさの引数, scale = 1 の値)
+synthetic = {
+    'many_images': (many_images, 'count', 200),
+    'deep_import': (deep_import, 'depth', 20),
+    'many_iframes': (many_iframes, 'count', 30),
+    'huge_dom': (huge_dom, 'rows', 5000),
+}
+
+
+def build_scenarios(names=None, scale: float = 1.0) -> dict:
+    """
+    ベンチマークのページを作る
+
+    Args:
+        names: シナリオ名のリスト．None はすべて
+        scale (float): 合成したページの大きさ（画像の枚数，@import の深さなど）の倍率
+
+    Returns:
+        dict: シナリオ名をキーとし，(入口のパス, {パス: (Content-Type, 本体)}) を値とする辞書
+    """
+    names = list(names) if names else list(fixtures) + list(synthetic)
+    scenarios = {}
+    for name in names:
+        if name in fixtures:
+            scenarios[name] = (fixtures[name], {})
+        elif name in synthetic:
+            function, arg, default = synthetic[name]
+            scenarios[name] = function(**{arg: max(1, int(default * scale))})
+        else:
+            raise ValueError(f'unknown scenario: {name}')
+    return scenarios
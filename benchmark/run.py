@@ -0,0 +1,178 @@
+"""
+generate() のベンチマーク
+
+test/ のフィクスチャと合成したページ（pages.py）をローカルの HTTP サーバから，遅延と帯域の制限をつけて返し，
+ページごとに新しいプロセスで generate() を実行する．ブラウザを使わない render_mode='never-browser' が既定．
+
+    $ python -m benchmark.run --repeat=3 --latency_ms=50 --bandwidth_kbps=8000
+    $ python -m benchmark.run --baseline=benchmark/results/20200601T120000.json
+
+結果は JSON に保存し，baseline を指定した場合は比較して，遅くなった（大きくなった）シナリオを出力する．
+"""
+import json
+import os
+import resource
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+from .pages import build_scenarios
+from .server import BenchmarkServer
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURE_DIR = os.path.join(ROOT_DIR, 'test')
+# baseline と比べて，この割合より遅く（大きく）なったものを報告する
+default_threshold = 0.1
+# 比べる値
+compared_metrics = ('seconds', 'output_bytes', 'peak_rss_kb')
+
+
+def run_page(url: str, download_dir: str, options: dict) -> dict:
+    """
+    1 ページを generate() で保存する．新しいプロセスで実行し，キャッシュなどの共有状態を持ち越さない．
+
+    Returns:
+        dict: seconds，phases（段階ごとの秒数），page_bytes（埋め込んだ data URI のバイト数），
+              output_bytes（保存したファイルのバイト数），peak_rss_kb
+    """
+    from webpage2html import webpage2html
+
+    options = dict(options)
+    webpage2html.download_dir = download_dir
+    webpage2html.storage_format = options.pop('storage', 'plain')
+    start = time.perf_counter()
+    webpage2html.generate(url, verbose=False, **options)
+    seconds = time.perf_counter() - start
+    snapshot = webpage2html.get_catalog().latest(webpage2html.make_site_id(url))
+    with open(f"{download_dir}/report/{snapshot['site_id']}_{snapshot['getting_time']}.json") as f:
+        report = json.load(f)
+    return {
+        'seconds': seconds,
+        'phases': {phase: entry['seconds'] for phase, entry in report['timings']['phases'].items()},
+        'page_bytes': report['page_bytes'],
+        'output_bytes': os.path.getsize(snapshot['html_path']),
+        # Linux では KiB 単位
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+def summarize(runs: list) -> dict:
+    """
+    繰り返しの結果を中央値にまとめる
+    """
+    phases = sorted({phase for run in runs for phase in run['phases']})
+    seconds = statistics.median(run['seconds'] for run in runs)
+    return {
+        'runs': len(runs),
+        'seconds': round(seconds, 4),
+        'pages_per_sec': round(1 / seconds, 3) if seconds else None,
+        'phases': {phase: round(statistics.median(run['phases'].get(phase, 0.0) for run in runs), 4)
+                   for phase in phases},
+        'requests': statistics.median(run['requests'] for run in runs),
+        'bytes_fetched': statistics.median(run['bytes_fetched'] for run in runs),
+        'page_bytes': statistics.median(run['page_bytes'] for run in runs),
+        'output_bytes': statistics.median(run['output_bytes'] for run in runs),
+        'peak_rss_kb': max(run['peak_rss_kb'] for run in runs),
+    }
+
+
+def run_benchmark(scenarios=None, repeat: int = 3, latency_ms: float = 0, bandwidth_kbps: float = None,
+                  scale: float = 1.0, render_mode: str = 'never-browser', fetch_workers: int = 8,
+                  storage: str = 'plain', output_format: str = 'html') -> dict:
+    """
+    ベンチマークを実行する
+
+    Args:
+        scenarios: シナリオ名のリスト（pages.fixtures と pages.synthetic のキー）．None はすべて
+        repeat (int): シナリオごとの繰り返しの数．結果は中央値
+        latency_ms (float): リクエストごとの遅延（ミリ秒）
+        bandwidth_kbps (float): 接続ごとの帯域（kbit/s）．None は無制限
+        scale (float): 合成したページの大きさの倍率
+        render_mode (str): generate() の render_mode
+        fetch_workers (int): generate() の fetch_workers
+        storage (str): スナップショットの保存形式（webpage2html.storage_format）
+        output_format (str): generate() の output_format
+
+    Returns:
+        dict: 'config' と，シナリオ名をキーとする 'scenarios'
+    """
+    if isinstance(scenarios, str):
+        scenarios = scenarios.split(',')
+    config = {'repeat': repeat, 'latency_ms': latency_ms, 'bandwidth_kbps': bandwidth_kbps, 'scale': scale,
+              'render_mode': render_mode, 'fetch_workers': fetch_workers, 'storage': storage,
+              'output_format': output_format, 'python': sys.version.split()[0]}
+    options = {'render_mode': render_mode, 'fetch_workers': fetch_workers, 'storage': storage,
+               'output_format': output_format}
+    results = {}
+    bandwidth = bandwidth_kbps * 1000 / 8 if bandwidth_kbps else None
+    with BenchmarkServer(FIXTURE_DIR, latency=latency_ms / 1000, bandwidth=bandwidth) as server:
+        for name, (entry, pages) in build_scenarios(scenarios, scale=scale).items():
+            server.pages = pages
+            runs = []
+            for _ in range(repeat):
+                server.reset_stats()
+                with tempfile.TemporaryDirectory() as download_dir, \
+                        ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as executor:
+                    run = executor.submit(run_page, server.base_url + entry.lstrip('/'), download_dir,
+                                          options).result()
+                run.update(requests=server.stats['requests'], bytes_fetched=server.stats['bytes'])
+                runs.append(run)
+            results[name] = summarize(runs)
+            print(f"{name}: {results[name]['seconds']:.3f}s, {results[name]['requests']} requests, "
+                  f"{results[name]['bytes_fetched']} bytes fetched, {results[name]['output_bytes']} bytes written",
+                  file=sys.stderr)
+    return {'time': time.strftime('%Y%m%dT%H%M%S'), 'config': config, 'scenarios': results}
+
+
+def compare(results: dict, baseline: dict, threshold: float = default_threshold) -> list:
+    """
+    baseline と比べて，threshold の割合より大きくなった値を探す
+
+    Returns:
+        list: (シナリオ名, 値の名前, baseline の値, 今回の値) のリスト
+    """
+    regressions = []
+    for name, result in results['scenarios'].items():
+        base = baseline.get('scenarios', {}).get(name)
+        if not base:
+            continue
+        for metric in compared_metrics:
+            if base.get(metric) and result.get(metric) is not None and \
+                    result[metric] > base[metric] * (1 + threshold):
+                regressions.append((name, metric, base[metric], result[metric]))
+    return regressions
+
+
+def main(scenarios=None, repeat: int = 3, latency_ms: float = 0, bandwidth_kbps: float = None, scale: float = 1.0,
+         render_mode: str = 'never-browser', fetch_workers: int = 8, storage: str = 'plain',
+         output_format: str = 'html', output: str = None,
+         baseline: str = None, threshold: float = default_threshold) -> None:
+    """
+    ベンチマークを実行して output（省略時は benchmark/results/{時刻}.json）に保存する．
+    baseline の結果より threshold の割合を超えて悪くなった値があれば，終了コード 1 で終わる．
+    """
+    results = run_benchmark(scenarios, repeat=repeat, latency_ms=latency_ms, bandwidth_kbps=bandwidth_kbps,
+                            scale=scale, render_mode=render_mode, fetch_workers=fetch_workers, storage=storage,
+                            output_format=output_format)
+    if output is None:
+        os.makedirs(os.path.join(ROOT_DIR, 'benchmark', 'results'), exist_ok=True)
+        output = os.path.join(ROOT_DIR, 'benchmark', 'results', f"{results['time']}.json")
+    with open(output, 'w') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f'saved {output}', file=sys.stderr)
+    if baseline:
+        with open(baseline) as f:
+            regressions = compare(results, json.load(f), threshold)
+        for name, metric, before, after in regressions:
+            print(f'REGRESSION {name} {metric}: {before} -> {after}', file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    import fire
+
+    fire.Fire(main)
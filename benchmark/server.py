@@ -0,0 +1,110 @@
+import functools
+import threading
+import time
+from collections import Counter
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+
+class _Handler(SimpleHTTPRequestHandler):
+    """
+    合成したページ（server.pages）とディレクトリのファイルを，遅延と帯域の制限をつけて返す
+    """
+
+    server_version = 'webpage2html-benchmark'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _throttled_write(self, data: bytes) -> None:
+        server = self.server.benchmark
+        if not server.bandwidth:
+            self.wfile.write(data)
+        else:
+            chunk_size = max(1024, int(server.bandwidth / 20))
+            for i in range(0, len(data), chunk_size):
+                chunk = data[i:i + chunk_size]
+                self.wfile.write(chunk)
+                time.sleep(len(chunk) / server.bandwidth)
+        server.count('bytes', len(data))
+
+    def copyfile(self, source, outputfile):
+        while True:
+            data = source.read(64 * 1024)
+            if not data:
+                break
+            self._throttled_write(data)
+
+    def do_GET(self):
+        server = self.server.benchmark
+        server.count('requests')
+        if server.latency:
+            time.sleep(server.latency)
+        page = server.pages.get(urlsplit(self.path).path)
+        if page is None:
+            return super().do_GET()
+        content_type, body = page
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self._throttled_write(body)
+
+
+class BenchmarkServer(object):
+    """
+    ベンチマーク用のローカルの HTTP サーバ
+
+    root のファイル（test/ のフィクスチャなど）と，パスをキーとする合成したページを返す．
+    latency はリクエストごとの遅延（秒），bandwidth は接続ごとの帯域（バイト/秒，None は無制限）．
+    返したリクエストの数とバイト数を stats に数える．
+    """
+
+    def __init__(self, root: str, pages: dict = None, latency: float = 0.0, bandwidth: float = None):
+        self.root = root
+        self.pages = pages or {}
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.stats = Counter()
+        self._lock = threading.Lock()
+        self._httpd = None
+        self._thread = None
+
+    def count(self, key: str, value: int = 1) -> None:
+        with self._lock:
+            self.stats[key] += value
+
+    def reset_stats(self) -> None:
+        with self._lock:
+            self.stats = Counter()
+
+    @property
+    def base_url(self) -> str:
+        return f'http://127.0.0.1:{self._httpd.server_port}/'
+
+    def start(self) -> str:
+        """
+        サーバを別のスレッドで起動する
+
+        Returns:
+            str: ルートの URL
+        """
+        self._httpd = ThreadingHTTPServer(('127.0.0.1', 0), functools.partial(_Handler, directory=self.root))
+        self._httpd.daemon_threads = True
+        self._httpd.benchmark = self
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self.base_url
+
+    def stop(self) -> None:
+        if self._httpd is not None:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+            self._httpd = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
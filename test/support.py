@@ -0,0 +1,34 @@
+import importlib
+import tempfile
+from contextlib import contextmanager
+from unittest import mock
+
+
+@contextmanager
+def isolated_download_dir():
+    """
+    ダウンロードのディレクトリ（キャッシュ，索引，保存先）を一時ディレクトリにして，共有の状態を作り直す
+    """
+    module = importlib.import_module('webpage2html.webpage2html')
+    with tempfile.TemporaryDirectory() as download_dir, \
+            mock.patch.multiple(module, download_dir=download_dir, _download_prepared=False, asset_cache=None,
+                                css_engine=None, catalog=None, storage=None):
+        yield download_dir
+
+
+@contextmanager
+def offline():
+    """
+    リモートの URL を取得せず，埋め込めなかったものとして扱う．ローカルのファイルは従来通り読む．
+    ダウンロードのディレクトリは isolated_download_dir() と同じく一時ディレクトリにする．
+    """
+    module = importlib.import_module('webpage2html.webpage2html')
+    get_contents = module.get_contents
+
+    def local_contents(url=None, relpath=None, *args, **kwargs):
+        if (url or '').startswith('http') or (relpath or '').startswith('http'):
+            return '', None
+        return get_contents(url, relpath, *args, **kwargs)
+
+    with isolated_download_dir() as download_dir, mock.patch.object(module, 'get_contents', local_contents):
+        yield download_dir
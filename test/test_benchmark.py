@@ -0,0 +1,39 @@
+import time
+import unittest
+import urllib.request
+
+from benchmark.pages import build_scenarios
+from benchmark.run import FIXTURE_DIR, compare, run_benchmark
+from benchmark.server import BenchmarkServer
+
+
+class TestBenchmark(unittest.TestCase):
+    def test_server_latency_and_stats(self):
+        entry, pages = build_scenarios(['deep_import'], scale=0.1)['deep_import']
+        with BenchmarkServer(FIXTURE_DIR, pages, latency=0.05) as server:
+            start = time.monotonic()
+            body = urllib.request.urlopen(server.base_url + entry.lstrip('/')).read()
+            self.assertGreaterEqual(time.monotonic() - start, 0.05)
+            self.assertIn(b'0.css', body)
+            # test/ のフィクスチャも返す
+            urllib.request.urlopen(server.base_url + 'text_css.html').read()
+            self.assertEqual(server.stats['requests'], 2)
+            self.assertGreater(server.stats['bytes'], len(body))
+
+    def test_compare(self):
+        baseline = {'scenarios': {'a': {'seconds': 1.0, 'output_bytes': 100, 'peak_rss_kb': 1000}}}
+        results = {'scenarios': {'a': {'seconds': 1.5, 'output_bytes': 105, 'peak_rss_kb': 900},
+                                 'b': {'seconds': 9.0}}}
+        self.assertEqual(compare(results, baseline, threshold=0.1), [('a', 'seconds', 1.0, 1.5)])
+
+    def test_run(self):
+        results = run_benchmark(['deep_import'], repeat=1, scale=0.1)
+        result = results['scenarios']['deep_import']
+        # index.html，0.css，1.css と，それぞれの背景画像
+        self.assertEqual(result['requests'], 5)
+        self.assertGreater(result['output_bytes'], 0)
+        self.assertIn('rewrite', result['phases'])
+
+
+if __name__ == '__main__':
+    unittest.main()
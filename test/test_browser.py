@@ -0,0 +1,165 @@
+import unittest
+from unittest import mock
+
+from selenium.common.exceptions import TimeoutException, WebDriverException
+
+from support import isolated_download_dir
+from webpage2html import webpage2html
+from webpage2html.browser import BrowserPool, wait_for_page_ready, window_size
+from webpage2html.webpage2html import ArchiveJob, current_job, get_asset_cache, get_contents_by_selenium
+
+
+class FakeDriver(object):
+    def __init__(self, origins=('https://example.com', 'https://cdn.example.net')):
+        self.origins = list(origins)
+        self.calls = []
+        self.quit_called = False
+        self.broken = False
+
+    def execute_cdp_cmd(self, cmd, params):
+        if self.broken:
+            raise WebDriverException('chrome not reachable')
+        self.calls.append((cmd, params))
+
+    def execute_script(self, script, *args):
+        if self.broken:
+            raise WebDriverException('chrome not reachable')
+        return self.origins
+
+    def get(self, url):
+        self.calls.append(('get', url))
+
+    def set_page_load_timeout(self, timeout):
+        pass
+
+    @property
+    def page_source(self):
+        return '<html><body>rendered</body></html>'
+
+    def set_window_size(self, width, height):
+        self.calls.append(('set_window_size', (width, height)))
+
+    def quit(self):
+        self.quit_called = True
+
+
+class FakePool(BrowserPool):
+    driver_class = FakeDriver
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.drivers = []
+
+    def _launch(self):
+        driver = self.driver_class()
+        self.drivers.append(driver)
+        self._pages[id(driver)] = 0
+        self.launched += 1
+        return driver
+
+
+class TestBrowserPool(unittest.TestCase):
+    def test_reuse_and_reset(self):
+        pool = FakePool(max_pages=10)
+        with pool.lease() as first:
+            pass
+        with pool.lease() as second:
+            self.assertIs(second, first)
+        self.assertEqual(pool.launched, 1)
+        # 返却時に，開いたオリジンの保存データをすべて消す
+        cleared = [params['origin'] for cmd, params in first.calls if cmd == 'Storage.clearDataForOrigin']
+        self.assertEqual(cleared, ['https://example.com', 'https://cdn.example.net'] * 2)
+        self.assertIn(('Network.clearBrowserCookies', {}), first.calls)
+        self.assertIn(('set_window_size', window_size), first.calls)
+
+    def test_recycle_after_max_pages(self):
+        pool = FakePool(max_pages=2)
+        for _ in range(3):
+            with pool.lease():
+                pass
+        self.assertEqual(pool.launched, 2)
+        self.assertTrue(pool.drivers[0].quit_called)
+        self.assertFalse(pool.drivers[1].quit_called)
+
+    def test_crash(self):
+        pool = FakePool()
+        with self.assertRaises(WebDriverException):
+            with pool.lease():
+                raise WebDriverException('tab crashed')
+        self.assertTrue(pool.drivers[0].quit_called)
+        with pool.lease() as driver:
+            self.assertIs(driver, pool.drivers[1])
+
+    def test_not_reused_when_storage_cannot_be_cleared(self):
+        pool = FakePool()
+        with pool.lease() as driver:
+            driver.broken = True
+        self.assertTrue(driver.quit_called)
+        with pool.lease() as driver:
+            self.assertIs(driver, pool.drivers[1])
+
+
+class StatesDriver(object):
+    """
+    page_state() の結果を順に返す
+    """
+
+    def __init__(self, states):
+        self.states = list(states)
+
+    def execute_script(self, script, *args):
+        return self.states.pop(0) if len(self.states) > 1 else self.states[0]
+
+
+def state(now, pending=0, last_response=0):
+    return {'readyState': 'complete', 'now': now, 'lastMutation': 0, 'lastResponse': last_response,
+            'pendingRequests': pending}
+
+
+class TestWaitForPageReady(unittest.TestCase):
+    def test_pending_request(self):
+        # 遅い XHR が読み込み中の間は，Resource Timing が古くても落ち着いたとみなさない
+        driver = StatesDriver([state(5000, pending=1), state(5100, pending=1), state(5200)])
+        self.assertTrue(wait_for_page_ready(driver, timeout=1, poll=0))
+        self.assertEqual(driver.states, [state(5200)])
+        self.assertFalse(wait_for_page_ready(StatesDriver([state(5000, pending=1)]), timeout=0.05, poll=0.01))
+
+
+class TimeoutDriver(FakeDriver):
+    def execute_script(self, script, *args):
+        if 'userAgent' in script:
+            raise TimeoutException('script timeout')
+        return super().execute_script(script, *args)
+
+
+class TimeoutPool(FakePool):
+    driver_class = TimeoutDriver
+
+
+class TestGetContentsBySelenium(unittest.TestCase):
+    def get(self, pool):
+        url = 'https://example.com/page.html'
+        token = current_job.set(ArchiveJob(url))
+        try:
+            with mock.patch.object(webpage2html, 'get_browser_pool', lambda: pool):
+                html_text, _ = get_contents_by_selenium(url, verbose=False)
+            cached, _ = get_asset_cache().get(url)
+        finally:
+            current_job.reset(token)
+        return html_text, cached
+
+    def test_cache(self):
+        with isolated_download_dir():
+            html_text, cached = self.get(FakePool())
+        self.assertEqual(cached.decode(), html_text)
+
+    def test_timeout_not_cached(self):
+        # 描画がタイムアウトした仮の文書は返すだけで，キャッシュしない
+        with isolated_download_dir():
+            html_text, cached = self.get(TimeoutPool())
+        self.assertIn('No content', html_text)
+        self.assertIsNone(cached)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+import tempfile
+import unittest
+
+from webpage2html.cache import DiskCache, freshness_lifetime, normalize_url
+
+
+class TestDiskCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cache = DiskCache(self.tmp.name, max_bytes=100)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_normalize_url(self):
+        self.assertEqual(normalize_url('HTTP://Example.com:80/a?b=1#top'), 'http://example.com/a?b=1')
+        self.assertEqual(normalize_url('https://example.com'), 'https://example.com/')
+
+    def test_freshness_lifetime(self):
+        self.assertEqual(freshness_lifetime({'cache-control': 'public, max-age=60'}), 60)
+        self.assertIsNone(freshness_lifetime({'cache-control': 'no-store'}))
+        self.assertEqual(freshness_lifetime({'cache-control': 'no-cache, max-age=60'}), 0)
+        self.assertEqual(freshness_lifetime({}, default_ttl=30), 30)
+
+    def test_put_get(self):
+        self.assertTrue(self.cache.put('http://example.com/a.css', b'body{}', {'Cache-Control': 'max-age=60'}))
+        data, meta = self.cache.get('http://EXAMPLE.com/a.css#x')
+        self.assertEqual(data, b'body{}')
+        self.assertTrue(DiskCache.is_fresh(meta))
+        self.assertFalse(self.cache.put('http://example.com/b.css', b'', {'Cache-Control': 'no-store'}))
+        self.assertEqual(self.cache.get('http://example.com/b.css'), (None, None))
+
+    def test_revalidate(self):
+        self.cache.put('http://example.com/a.png', b'png', {'ETag': '"v1"', 'Cache-Control': 'no-cache'})
+        data, meta = self.cache.get('http://example.com/a.png')
+        self.assertFalse(DiskCache.is_fresh(meta))
+        self.assertEqual(DiskCache.conditional_headers(meta), {'if-none-match': '"v1"'})
+        meta = self.cache.refresh('http://example.com/a.png', meta, {'Cache-Control': 'max-age=60'})
+        self.assertTrue(DiskCache.is_fresh(meta))
+        self.assertTrue(DiskCache.is_fresh(self.cache.get('http://example.com/a.png')[1]))
+
+    def test_content_addressed(self):
+        self.cache.put('http://example.com/1.png', b'x' * 40, {'Cache-Control': 'max-age=60'})
+        self.cache.put('http://example.com/2.png', b'x' * 40, {'Cache-Control': 'max-age=60'})
+        self.assertEqual(len(list(self.cache.objects_dir.glob('*/*'))), 1)
+
+    def test_evict_lru(self):
+        self.cache.put('http://example.com/old', b'o' * 40, {'Cache-Control': 'max-age=60'})
+        self.cache.put('http://example.com/new', b'n' * 40, {'Cache-Control': 'max-age=60'})
+        self.cache.put('http://example.com/big', b'b' * 40, {'Cache-Control': 'max-age=60'})
+        self.assertLessEqual(self.cache.evict(target_bytes=80), 80)
+        self.assertEqual(self.cache.get('http://example.com/old'), (None, None))
+        self.assertIsNotNone(self.cache.get('http://example.com/big')[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+import os
+import tempfile
+import unittest
+from datetime import datetime
+
+from webpage2html.catalog import JST, Catalog
+
+SITE_ID = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ234567ABCDEFGHIJKLMNOPQRSTUV===='
+
+
+class TestCatalog(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.catalog = Catalog(os.path.join(self.tmp.name, 'catalog.sqlite3'))
+
+    def tearDown(self):
+        self.catalog.close()
+        self.tmp.cleanup()
+
+    def test_latest_and_freshness(self):
+        self.catalog.add(SITE_ID, 'https://example.com/', '20200601T120000JST', html_path='a.html')
+        self.catalog.add(SITE_ID, 'https://example.com/', '20200603T120000JST', html_path='b.html')
+        self.assertEqual(self.catalog.latest(SITE_ID)['html_path'], 'b.html')
+        self.assertEqual([s['getting_time'] for s in self.catalog.list_site(SITE_ID)],
+                         ['20200603T120000JST', '20200601T120000JST'])
+        self.assertEqual(len(self.catalog.list_url('https://example.com/')), 2)
+        now = datetime(2020, 6, 4, 11, 0, tzinfo=JST)
+        self.assertTrue(self.catalog.captured_within(SITE_ID, 24 * 60 * 60, now=now))
+        self.assertFalse(self.catalog.captured_within(SITE_ID, 60 * 60, now=now))
+        self.assertIsNone(self.catalog.latest('UNKNOWN'))
+
+    def test_import_download_dir(self):
+        root = self.tmp.name
+        for sub_dir, name in [('html', f'{SITE_ID}_20200601T120000JST.html'),
+                              ('link', f'{SITE_ID}_20200601T120000JST.txt'),
+                              ('image', f'{SITE_ID}_20200602T120000JST.png'),
+                              ('html', f'{SITE_ID}_0.html')]:
+            os.makedirs(os.path.join(root, sub_dir), exist_ok=True)
+            open(os.path.join(root, sub_dir, name), 'w').close()
+        with open(os.path.join(root, 'url_id_list.txt'), 'w') as f:
+            f.write(f'{SITE_ID}\thttps://example.com/\t20200601T120000JST\n')
+        self.assertEqual(self.catalog.import_download_dir(root), 2)
+        # 取り込みは一度だけ
+        self.assertEqual(self.catalog.import_download_dir(root), 0)
+        snapshots = self.catalog.list_site(SITE_ID)
+        self.assertEqual([(s['getting_time'], s['url']) for s in snapshots],
+                         [('20200602T120000JST', 'https://example.com/'), ('20200601T120000JST', 'https://example.com/')])
+        self.assertTrue(snapshots[1]['html_path'].endswith('.html'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+import unittest
+from urllib.parse import urljoin
+
+from webpage2html.css import CSSEngine, decode_css, iter_urls, tokenize
+
+
+class TestCSSEngine(unittest.TestCase):
+    def setUp(self):
+        self.sheets = {
+            'http://example.com/a.css': '@import "b.css"; .a{background:url(img/a.png)}',
+            'http://example.com/b.css': '@import url(a.css); .b{background:url("b.png")}',
+        }
+        self.fetched = []
+        self.budget = None
+        self.engine = CSSEngine(fetch=self.fetch, embed=self.embed, resolve=urljoin, charge=self.charge)
+
+    def fetch(self, base, src):
+        url = urljoin(base, src)
+        self.fetched.append(url)
+        return self.sheets.get(url, ''), None
+
+    def embed(self, base, src):
+        # missing.png は埋め込めなかったものとして URL を返す
+        url = urljoin(base, src)
+        return url if src == 'missing.png' else f'data:,{url}'
+
+    def charge(self, size):
+        return self.budget is None or size <= self.budget
+
+    def test_tokenize(self):
+        self.assertEqual(tokenize('@import "x.css";a{b:url( \'y.png\' )}'),
+                         ['', ('import', 'x.css'), ';a{b:', ('url', 'y.png'), '}'])
+        self.assertEqual(iter_urls(b'@import url(x.css); a{b:url(y.png)}'), [('x.css', True), ('y.png', False)])
+
+    def test_decode_charset(self):
+        self.assertEqual(decode_css('@charset "shift_jis"; /* あ */'.encode('shift_jis')), '@charset "shift_jis"; /* あ */')
+
+    def test_recursive_import_with_cycle(self):
+        css = self.engine.rewrite('http://example.com/a.css', self.sheets['http://example.com/a.css'],
+                                  name='http://example.com/a.css')
+        self.assertTrue(css.startswith('@import url("data:text/css;base64,'))
+        self.assertIn('url("data:,http://example.com/img/a.png")', css)
+        # a.css -> b.css の次の a.css で循環を検出して止まり，a.css を取得し直さない
+        self.assertEqual(self.fetched, ['http://example.com/b.css'])
+
+    def test_cycle_not_memoized(self):
+        a, b = 'http://example.com/a.css', 'http://example.com/b.css'
+        self.engine.rewrite(a, self.sheets[a], name=a)
+        # a.css からたどった b.css の結果（a.css を URL のまま残す）は，b.css だけを書き換える時に使わない
+        fresh = CSSEngine(fetch=self.fetch, embed=self.embed, resolve=urljoin).rewrite(b, self.sheets[b], name=b)
+        self.assertEqual(self.engine.rewrite(b, self.sheets[b], name=b), fresh)
+        self.assertTrue(fresh.startswith('@import url("data:text/css;base64,'))
+
+    def test_memoized(self):
+        first = self.engine.rewrite('http://example.com/', '.x{background:url(x.png)}', name='inline')
+        second = self.engine.rewrite('http://example.com/', '.x{background:url(x.png)}', name='inline')
+        self.assertEqual(first, second)
+        self.assertEqual([hit for _, _, _, hit in self.engine.timings], [False, True])
+
+    def test_memo_incomplete_or_over_budget(self):
+        for css in ['.x{background:url(missing.png)}', '.x{background:url(x.png)}']:
+            self.engine.rewrite('http://example.com/', css, name='inline')
+            # 予算が足りなければ，覚えていた結果は使わない
+            self.budget = 0
+            self.engine.rewrite('http://example.com/', css, name='inline')
+            self.budget = None
+        self.assertEqual([hit for _, _, _, hit in self.engine.timings], [False, False, False, False])
+
+    def test_import_charged(self):
+        charged = []
+
+        def charge(size):
+            if sum(charged) + size > self.budget:
+                return False
+            charged.append(size)
+            return True
+
+        engine = CSSEngine(fetch=self.fetch, embed=self.embed, resolve=urljoin, charge=charge)
+        self.budget = 10 ** 6
+        css = engine.rewrite('http://example.com/', '@import "b.css";', name='inline')
+        self.assertTrue(css.startswith('@import url("data:text/css;base64,'))
+        # 中の url() の data URI（embed が使う）を除いた分
+        self.assertTrue(0 < sum(charged) < len(css))
+        # 予算が足りなければ，@import は絶対 URL のまま残す
+        charged.clear()
+        self.budget = 10
+        self.assertEqual(engine.rewrite('http://example.com/', '@import "b.css";', name='inline'),
+                         '@import url("http://example.com/b.css");')
+
+
+if __name__ == '__main__':
+    unittest.main()
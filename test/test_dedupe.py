@@ -0,0 +1,53 @@
+import unittest
+
+from bs4 import BeautifulSoup
+
+from webpage2html.dedupe import ASSET_ATTRIBUTE, dedupe_assets
+
+PNG = 'data:image/png;base64,' + 'A' * 2000
+FONT = 'data:application/font-woff;base64,' + 'B' * 2000
+
+
+class TestDedupe(unittest.TestCase):
+    def test_shared_once(self):
+        soup = BeautifulSoup(f'''<html><head>
+            <style>.a{{background:url("{PNG}")}} .b{{background:url("{PNG}")}}</style></head>
+            <body><img src="{PNG}"><div style='background:url("{PNG}")'></div></body></html>''', 'html5lib')
+        report = dedupe_assets(soup)
+        self.assertEqual(report['assets'], 1)
+        self.assertEqual(report['references'], 4)
+        self.assertGreater(report['bytes_saved'], 2000 * 2)
+        html = str(soup)
+        self.assertEqual(html.count(PNG), 1)
+        self.assertEqual(soup.img[ASSET_ATTRIBUTE], '--webpage2html-asset-1')
+        self.assertIn('var(--webpage2html-asset-1)', soup.div['style'])
+
+    def test_without_script(self):
+        soup = BeautifulSoup(f'''<html><head><style>.a{{background:url("{PNG}")}} .b{{background:url("{PNG}")}}</style>
+            </head><body><img src="{PNG}"><img src="{PNG}"></body></html>''', 'html5lib')
+        report = dedupe_assets(soup, keep_script=False)
+        # スクリプトがなくても表示できるように，img の src は残す
+        self.assertEqual((report['assets'], report['references']), (1, 2))
+        self.assertTrue(all(img.get('src') == PNG for img in soup('img')))
+        self.assertIsNone(soup.find('script'))
+
+    def test_font_face_and_single_use(self):
+        css = f'@font-face{{src:url("{FONT}")}} @font-face{{src:url("{FONT}")}} .a{{background:url("{PNG}")}}'
+        soup = BeautifulSoup(f'<html><head><style>{css}</style></head><body></body></html>', 'html5lib')
+        self.assertEqual(dedupe_assets(soup)['assets'], 0)
+        self.assertEqual(soup.style.string, css)
+
+    def test_import(self):
+        sheet = 'data:text/css;base64,' + 'C' * 2000
+        css = f'@import url("{sheet}"); .a{{background:url("{PNG}")}}'
+        soup = BeautifulSoup(f'<html><head><style>{css}</style><style>{css}</style></head><body></body></html>',
+                             'html5lib')
+        report = dedupe_assets(soup)
+        # 背景画像だけを共有し，@import はそのまま残す
+        self.assertEqual((report['assets'], report['references']), (1, 2))
+        for style in soup('style')[1:]:
+            self.assertTrue(style.string.startswith(f'@import url("{sheet}");'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+import socket
+import unittest
+
+import requests
+from urllib3.exceptions import MaxRetryError, NewConnectionError, ProtocolError
+
+from webpage2html import health
+from webpage2html.health import HostRegistry
+
+
+class TestHostRegistry(unittest.TestCase):
+    def test_circuit(self):
+        registry = HostRegistry(threshold=2, cooldown_seconds=60)
+        registry.record_failure('a.example', 'HTTP 503')
+        self.assertTrue(registry.allow('a.example'))
+        registry.record_failure('a.example', 'HTTP 503')
+        # 続けて失敗したので遮断する
+        self.assertFalse(registry.allow('a.example'))
+        self.assertTrue(registry.allow('b.example'))
+        report = registry.report()['a.example']
+        self.assertEqual((report['state'], report['failure'], report['skipped'], report['opened']), ('open', 2, 1, 1))
+
+    def test_half_open(self):
+        registry = HostRegistry(threshold=1, cooldown_seconds=0)
+        registry.record_failure('a.example', 'timeout')
+        # cooldown を過ぎたら 1 回だけ試しに通す
+        self.assertTrue(registry.allow('a.example'))
+        self.assertEqual(registry.report()['a.example']['state'], 'half-open')
+        registry.record_success('a.example')
+        self.assertEqual(registry.report()['a.example']['state'], 'closed')
+
+    def test_backoff(self):
+        self.assertEqual(health.backoff_delay(0, retry_after='3'), 3)
+        self.assertLessEqual(health.backoff_delay(10), health.backoff_max)
+
+    def test_transient(self):
+        self.assertTrue(health.is_transient(requests.ConnectTimeout()))
+        self.assertTrue(health.is_transient(requests.ReadTimeout()))
+        reset = ProtocolError('Connection aborted.', ConnectionResetError(104, 'Connection reset by peer'))
+        self.assertTrue(health.is_transient(requests.ConnectionError(reset)))
+        # 証明書のエラー，名前解決の失敗，接続の拒否は再試行しない
+        self.assertFalse(health.is_transient(requests.exceptions.SSLError('certificate verify failed')))
+        resolve = NewConnectionError(None, 'Failed to resolve')
+        resolve.__cause__ = socket.gaierror(-2, 'Name or service not known')
+        self.assertFalse(health.is_transient(requests.ConnectionError(MaxRetryError(None, '/', resolve))))
+        self.assertFalse(health.is_transient(requests.ConnectionError(ConnectionRefusedError(111, 'refused'))))
+
+
+if __name__ == '__main__':
+    unittest.main()
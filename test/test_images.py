@@ -0,0 +1,70 @@
+import io
+import unittest
+
+from webpage2html import images
+from webpage2html.images import ImageOptimizer, choose_srcset_candidate, parse_srcset, slot_width, sniff_mime_type
+
+
+class TestImages(unittest.TestCase):
+    def test_sniff(self):
+        self.assertEqual(sniff_mime_type(b'\x89PNG\r\n\x1a\n....'), 'image/png')
+        self.assertEqual(sniff_mime_type(b'\xff\xd8\xff\xe0....'), 'image/jpeg')
+        self.assertEqual(sniff_mime_type(b'RIFF\x00\x00\x00\x00WEBPVP8 '), 'image/webp')
+        self.assertEqual(sniff_mime_type(b'<?xml version="1.0"?>\n<svg xmlns="...">'), 'image/svg+xml')
+        self.assertEqual(sniff_mime_type(b'wOF2....'), 'application/font-woff2')
+        self.assertIsNone(sniff_mime_type(b'body { color: red }'))
+
+    def test_parse_srcset(self):
+        self.assertEqual(parse_srcset('a.jpg, b.jpg 2x,c.jpg 640w'),
+                         [('a.jpg', 'x', 1.0), ('b.jpg', 'x', 2.0), ('c.jpg', 'w', 640.0)])
+
+    def test_choose_candidate(self):
+        srcset = 'small.jpg 480w, medium.jpg 1024w, large.jpg 4000w'
+        self.assertEqual(choose_srcset_candidate('src.jpg', srcset, 1000), 'medium.jpg')
+        self.assertEqual(choose_srcset_candidate('src.jpg', srcset, 1000, sizes='(min-width: 800px) 50vw, 400px'),
+                         'medium.jpg')
+        self.assertEqual(choose_srcset_candidate('src.jpg', srcset, 600, sizes='(min-width: 800px) 50vw, 400px'),
+                         'small.jpg')
+        self.assertEqual(choose_srcset_candidate('src.jpg', srcset, 8000), 'large.jpg')
+        # 密度の記述子では，src が 1x の候補になる
+        self.assertEqual(choose_srcset_candidate('src.jpg', 'hi.jpg 2x', 1000), 'src.jpg')
+        self.assertEqual(choose_srcset_candidate('src.jpg', 'hi.jpg 2x', 1000, pixel_ratio=2), 'hi.jpg')
+
+    @unittest.skipIf(images.load_pillow() is None, 'Pillow is not installed')
+    def test_optimize(self):
+        out = io.BytesIO()
+        images.load_pillow().new('RGB', (3000, 1500), (200, 100, 50)).save(out, 'PNG')
+        data, mime = ImageOptimizer(max_width=1000, max_height=1000).optimize(out.getvalue(), 'image/png')
+        self.assertEqual(mime, 'image/png')
+        self.assertEqual(images.load_pillow().open(io.BytesIO(data)).size, (1000, 500))
+
+    def test_slot_width(self):
+        self.assertEqual(slot_width('(max-width: 600px) 100vw, (min-width: 1200px) 800px, 50vw', 500), 500)
+        self.assertEqual(slot_width('(max-width: 600px) 100vw, (min-width: 1200px) 800px, 50vw', 1400), 800)
+        self.assertEqual(slot_width('(max-width: 600px) 100vw, (min-width: 1200px) 800px, 50vw', 1000), 500)
+        # 評価できない条件は満たさないものとし，どれも満たさなければ最後の値を使う
+        self.assertEqual(slot_width('(orientation: portrait) 100vw, 300px', 1000), 300)
+        self.assertEqual(slot_width('(max-width: 600px) 100vw', 1000), 1000)
+        self.assertEqual(slot_width(None, 1000), 1000)
+
+    @unittest.skipIf(images.load_pillow() is None, 'Pillow is not installed')
+    def test_optimize_orientation(self):
+        from PIL import ImageCms
+
+        Image = images.load_pillow()
+        icc_profile = ImageCms.ImageCmsProfile(ImageCms.createProfile('sRGB')).tobytes()
+        exif = Image.Exif()
+        # 6: 表示する時に時計回りに 90 度回す
+        exif[0x0112] = 6
+        out = io.BytesIO()
+        Image.linear_gradient('L').resize((3000, 1500)).convert('RGB').save(
+            out, 'JPEG', quality=95, exif=exif, icc_profile=icc_profile)
+        data, mime = ImageOptimizer(max_width=1000, max_height=1000).optimize(out.getvalue(), 'image/jpeg')
+        image = Image.open(io.BytesIO(data))
+        self.assertEqual(image.size, (500, 1000))
+        self.assertNotEqual(image.getexif().get(0x0112), 6)
+        self.assertEqual(image.info.get('icc_profile'), icc_profile)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,38 @@
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# import にかかる時間の上限（秒）．重い依存を import 時に読み込むようになったら超える
+IMPORT_TIME_BUDGET = 0.5
+HEAVY_MODULES = ('selenium', 'chromedriver_binary', 'bs4', 'requests', 'fire', 'lxml', 'html5lib', 'PIL')
+
+SCRIPT = f"""
+import sys
+import webpage2html
+print(webpage2html.make_site_id('https://example.com/'))
+print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))
+"""
+
+
+class TestImport(unittest.TestCase):
+    def test_import_is_light(self):
+        with tempfile.TemporaryDirectory() as cwd:
+            env = dict(os.environ, PYTHONPATH=ROOT_DIR)
+            result = subprocess.run([sys.executable, '-X', 'importtime', '-c', SCRIPT], cwd=cwd, env=env,
+                                    capture_output=True, text=True, check=True)
+            # import しただけでは download/ を作らない
+            self.assertEqual(os.listdir(cwd), [])
+        site_id, loaded = result.stdout.splitlines()
+        self.assertEqual(len(site_id), 56)
+        self.assertEqual(loaded, '')
+        # -X importtime の最後の行: "import time: self [us] | cumulative | webpage2html"
+        cumulative = int(result.stderr.strip().splitlines()[-1].split('|')[1])
+        print(f'import webpage2html: {cumulative / 1e6:.3f}s', file=sys.stderr)
+        self.assertLess(cumulative / 1e6, IMPORT_TIME_BUDGET)
+
+
+if __name__ == '__main__':
+    unittest.main()
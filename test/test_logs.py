@@ -0,0 +1,49 @@
+import io
+import json
+import unittest
+
+from webpage2html import logs
+
+
+class Expensive(object):
+    def __init__(self):
+        self.formatted = 0
+
+    def __str__(self):
+        self.formatted += 1
+        return 'expensive'
+
+
+class TestLogs(unittest.TestCase):
+    def setUp(self):
+        self.saved = (logs.log_level, logs.log_format, logs.stream)
+        logs.stream = io.StringIO()
+
+    def tearDown(self):
+        logs.log_level, logs.log_format, logs.stream = self.saved
+
+    def test_disabled_level_is_not_formatted(self):
+        logs.configure('info', 'text')
+        value = Expensive()
+        logs.debug('GET', '%s', value)
+        self.assertEqual((value.formatted, logs.stream.getvalue()), (0, ''))
+        logs.warn('WARN', '%s - %s', value, 'url', size=10)
+        self.assertEqual(value.formatted, 1)
+        self.assertEqual(logs.stream.getvalue(), '[ WARN ] expensive - url size=10\n')
+
+    def test_json(self):
+        logs.configure('debug', 'json')
+        token = logs.bind(site_id='SITE')
+        try:
+            logs.debug('GET', '%d - %s', 200, 'http://example.com/')
+        finally:
+            logs.unbind(token)
+        record = json.loads(logs.stream.getvalue())
+        self.assertEqual((record['level'], record['tag'], record['msg'], record['site_id']),
+                         ('DEBUG', 'GET', '200 - http://example.com/', 'SITE'))
+        with self.assertRaises(ValueError):
+            logs.configure('verbose')
+
+
+if __name__ == '__main__':
+    unittest.main()
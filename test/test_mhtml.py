@@ -0,0 +1,74 @@
+import email
+import email.policy
+import glob
+import io
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from benchmark.pages import build_scenarios
+from benchmark.run import FIXTURE_DIR, ROOT_DIR
+from benchmark.server import BenchmarkServer
+from webpage2html.mhtml import MHTMLWriter
+
+PNG = bytes(range(256)) * 64 + b'\r\n--\r\n\x00'
+RUN_PAGE = 'import sys; from benchmark.run import run_page; ' \
+           'run_page(sys.argv[1], sys.argv[2], {"render_mode": "never-browser", "output_format": "mhtml"})'
+
+
+def parse(data: bytes) -> list:
+    message = email.message_from_bytes(data, policy=email.policy.default)
+    return [(part['Content-Location'], part.get_content_type(), part.get_payload(decode=True))
+            for part in message.iter_parts()]
+
+
+class TestMHTML(unittest.TestCase):
+    def test_round_trip(self):
+        writer = MHTMLWriter()
+        location = writer.add_part('http://example.com/a.png', 'image/png', PNG)
+        writer.add_part('http://example.com/a.png', 'image/png', b'duplicate')
+        writer.add_part('http://example.com/a.css', 'text/css;charset=utf-8', 'p { content: "日本語"; }'.encode())
+        out = io.BytesIO()
+        writer.write(out, 'http://example.com/', lambda f: f.write(f'<img src="{location}"><p>日本語</p>'),
+                     title='題名')
+        writer.close()
+
+        parts = parse(out.getvalue())
+        self.assertEqual([(url, content_type) for url, content_type, _ in parts],
+                         [('http://example.com/', 'text/html'), ('http://example.com/a.png', 'image/png'),
+                          ('http://example.com/a.css', 'text/css')])
+        self.assertEqual(parts[0][2].decode(), '<img src="http://example.com/a.png"><p>日本語</p>')
+        # バイナリのパートは base64 にせず，同じバイト列のまま保存する
+        self.assertEqual(parts[1][2], PNG)
+        self.assertEqual(writer.stats['parts'], 2)
+        self.assertLess(len(out.getvalue()), len(PNG) * 4 / 3)
+
+    def test_boundary_in_data(self):
+        writer = MHTMLWriter()
+        with self.assertRaises(ValueError):
+            writer.add_part('http://example.com/a.txt', 'text/plain', f'--{writer.boundary}'.encode())
+        writer.close()
+
+    def test_generate(self):
+        entry, pages = build_scenarios(['many_iframes'], scale=0.1)['many_iframes']
+        with BenchmarkServer(FIXTURE_DIR, pages) as server, tempfile.TemporaryDirectory() as download_dir:
+            url = server.base_url + entry.lstrip('/')
+            base = server.base_url + 'many_iframes/'
+            subprocess.run([sys.executable, '-c', RUN_PAGE, url, download_dir], cwd=ROOT_DIR, check=True)
+            paths = glob.glob(os.path.join(download_dir, 'html', '*.mhtml'))
+            self.assertEqual(len(paths), 1)
+            with open(paths[0], 'rb') as f:
+                parts = {location: (content_type, body) for location, content_type, body in parse(f.read())}
+
+        # ページ，3 つのフレーム，フレームの画像と，スタイルシートの背景画像（1 つにまとめる）
+        self.assertEqual(len(parts), 8)
+        self.assertEqual(parts[base + 'shared.png'], ('image/png', pages['/many_iframes/shared.png'][1]))
+        self.assertIn(f'src="{base}frame/0.html"', parts[url][1].decode())
+        self.assertIn(f'{base}img/0.png', parts[base + 'frame/0.html'][1].decode())
+        self.assertNotIn('base64', parts[url][1].decode())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+import os
+import time
+import unittest
+
+from bs4 import BeautifulSoup, Doctype, NavigableString, Tag
+
+from support import offline
+from webpage2html.webpage2html import ArchiveJob, RewriteContext, choose_parser, current_job, rewrite_document
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+FIXTURES = ['another_dir/test_full_url.html', 'hacklu-ctf-2013-exp400-wannable-0ops.html', 'test_css_screen.html',
+            'test_no_script.html', 'test_pre_formatting.html', 'test_requests_page.html', 'text_css.html',
+            'webfont.html']
+BACKENDS = ['html5lib', 'lxml']
+# パーサが補う要素（属性がなければ比較しない）
+IMPLIED_TAGS = {'html', 'head', 'body', 'tbody'}
+
+
+def normalize(soup):
+    """
+    パーサによる違い（補われた要素，文字列の型，空白）を除いた DOM の要素と文字列の列
+    """
+    nodes = []
+    for node in soup.descendants:
+        if isinstance(node, Tag):
+            if node.name in IMPLIED_TAGS and not node.attrs:
+                continue
+            attrs = sorted((k, ' '.join(v) if isinstance(v, list) else v) for k, v in node.attrs.items())
+            nodes.append((node.name, attrs))
+        elif isinstance(node, NavigableString) and not isinstance(node, Doctype):
+            text = ' '.join(node.split())
+            if text:
+                nodes.append(text)
+    return nodes
+
+
+class TestParserBackends(unittest.TestCase):
+    timings = {}
+
+    def setUp(self):
+        # フィクスチャが参照するリモートのアセットは取得しない
+        self.offline = offline()
+        self.offline.__enter__()
+        self.addCleanup(self.offline.__exit__, None, None, None)
+
+    @classmethod
+    def tearDownClass(cls):
+        for backend in BACKENDS:
+            print(f'\nparse {backend}: {sum(cls.timings.get(backend, [])) * 1000:.1f} ms')
+
+    def generate(self, path, parser):
+        with open(path, 'rb') as f:
+            html_doc = f.read()
+        start = time.perf_counter()
+        soup = BeautifulSoup(html_doc, parser)
+        self.timings.setdefault(parser, []).append(time.perf_counter() - start)
+        token = current_job.set(ArchiveJob(path))
+        try:
+            rewrite_document(RewriteContext(soup, path, verbose=False, frame_document=lambda src: ''))
+        finally:
+            current_job.reset(token)
+        return soup
+
+    def test_equivalent_output(self):
+        for name in FIXTURES:
+            path = os.path.join(TEST_DIR, name)
+            expected = normalize(self.generate(path, 'html5lib'))
+            for backend in BACKENDS[1:]:
+                with self.subTest(name=name, backend=backend):
+                    self.assertEqual(normalize(self.generate(path, backend)), expected)
+
+    def test_choose_parser(self):
+        self.assertEqual(choose_parser(rendered=True), 'lxml')
+        # HTTP で取得したままのページやローカルファイル
+        self.assertEqual(choose_parser(rendered=False), 'html5lib')
+        self.assertEqual(choose_parser('html.parser', rendered=True), 'html.parser')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+import os
+import unittest
+from unittest import mock
+
+from benchmark.run import FIXTURE_DIR
+from benchmark.server import BenchmarkServer
+from support import isolated_download_dir
+from webpage2html import webpage2html
+from webpage2html.render import needs_browser
+from webpage2html.webpage2html import decode_page, get_page_html
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+TEXT = '<p>' + 'server rendered text. ' * 20 + '</p>'
+PAGE = '<html><head><meta charset="utf-8"><title>日本語のページ</title></head><body>本文</body></html>'
+
+
+class TestNeedsBrowser(unittest.TestCase):
+    def test_static(self):
+        self.assertIsNone(needs_browser('<html><body><p>short page without scripts</p></body></html>'))
+        self.assertIsNone(needs_browser(f'<html><body>{TEXT}<script src="a.js"></script></body></html>'))
+
+    def test_javascript_pages(self):
+        self.assertEqual(needs_browser(''), 'empty_document')
+        self.assertEqual(needs_browser('<body><div id="root"></div><script src="main.js"></script></body>'),
+                         'spa_root')
+        self.assertEqual(needs_browser(f'<body>{TEXT}<noscript>Please enable JavaScript to continue.</noscript>'
+                                       f'<script src="app.js"></script></body>'), 'noscript_gate')
+        self.assertEqual(needs_browser('<body><h1>Loading...</h1><script src="app.js"></script></body>'),
+                         'little_text')
+        # 本文がなく script だけのページ
+        with open(os.path.join(TEST_DIR, 'test_no_script.html')) as f:
+            self.assertEqual(needs_browser(f.read()), 'little_text')
+
+
+class TestDecodePage(unittest.TestCase):
+    def test_meta_charset(self):
+        # charset のない Content-Type は，requests が ISO-8859-1 で復号している
+        latin1 = PAGE.encode('utf-8').decode('iso-8859-1')
+        self.assertEqual(decode_page(latin1, 'text/html'), PAGE)
+        self.assertEqual(decode_page(PAGE.replace('utf-8', 'shift_jis').encode('shift_jis').decode('iso-8859-1'),
+                                     'text/html'), PAGE.replace('utf-8', 'shift_jis'))
+        # Content-Type の charset は優先する
+        self.assertEqual(decode_page(latin1, 'text/html; charset=iso-8859-1'), latin1)
+        self.assertEqual(decode_page(PAGE.encode('utf-8'), 'application/xhtml+xml'), PAGE)
+
+    def test_static_page_without_charset(self):
+        pages = {'/charset/index.html': ('text/html', PAGE.encode('utf-8'))}
+        with isolated_download_dir(), BenchmarkServer(FIXTURE_DIR, pages) as server:
+            html_doc, extra_data = get_page_html(server.base_url + 'charset/index.html', render_mode='never-browser',
+                                                 verbose=False)
+        self.assertEqual(extra_data['render'], 'static')
+        self.assertIn('<title>日本語のページ</title>', html_doc)
+
+
+class TestFrameOptions(unittest.TestCase):
+    def test_static_frame(self):
+        # ブラウザを使わずに取得したフレームも，ページと同じ設定で生成する
+        pages = {'/frames/index.html': ('text/html', b'<html><body><iframe src="frame.html"></iframe></body></html>'),
+                 '/frames/frame.html': ('text/html', b'<html><body><p>frame</p></body></html>')}
+        with isolated_download_dir(), BenchmarkServer(FIXTURE_DIR, pages) as server, \
+                mock.patch.object(webpage2html, 'generate', wraps=webpage2html.generate) as generate:
+            base_url = server.base_url
+            generate(base_url + 'frames/index.html', verbose=False, render_mode='never-browser',
+                     fetch_workers=1, traversal='multi', parser='html5lib', dedupe=True, viewport_width=800)
+        frame_call = generate.call_args_list[1]
+        self.assertEqual(frame_call.args, (base_url + 'frames/frame.html',))
+        options = ('level', 'render_mode', 'fetch_workers', 'traversal', 'parser', 'dedupe', 'viewport_width')
+        self.assertEqual({key: frame_call.kwargs[key] for key in options},
+                         {'level': 2, 'render_mode': 'never-browser', 'fetch_workers': 1, 'traversal': 'multi',
+                          'parser': 'html5lib', 'dedupe': True, 'viewport_width': 800})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+import os
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from bs4 import BeautifulSoup
+
+from support import offline
+from webpage2html.webpage2html import ArchiveJob, RewriteContext, current_job, get_contents, get_job, rewrite_document
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+FIXTURES = ['hacklu-ctf-2013-exp400-wannable-0ops.html', 'test_css_screen.html', 'test_no_script.html',
+            'test_pre_formatting.html', 'text_css.html', 'webfont.html']
+
+
+def rewrite(path, traversal, keep_script):
+    token = current_job.set(ArchiveJob(path))
+    try:
+        soup = BeautifulSoup(open(path, 'rb').read(), 'html5lib')
+        rewrite_document(RewriteContext(soup, path, verbose=False, keep_script=keep_script,
+                                        frame_document=lambda src: ''),
+                         traversal=traversal)
+        return soup.decode(formatter='html5'), sorted(get_job().external_links)
+    finally:
+        current_job.reset(token)
+
+
+class TestRewrite(unittest.TestCase):
+    def setUp(self):
+        # フィクスチャが参照するリモートのアセットは取得しない
+        self.offline = offline()
+        self.offline.__enter__()
+        self.addCleanup(self.offline.__exit__, None, None, None)
+
+    def test_single_pass_matches_multi_pass(self):
+        for name in FIXTURES:
+            path = os.path.join(TEST_DIR, name)
+            for keep_script in (False, True):
+                with self.subTest(name=name, keep_script=keep_script):
+                    self.assertEqual(rewrite(path, 'single', keep_script), rewrite(path, 'multi', keep_script))
+
+    def test_concurrent_jobs(self):
+        # 別々のスレッドのジョブは，リンクなどの状態を共有しない
+        paths = [os.path.join(TEST_DIR, name) for name in FIXTURES] * 2
+        expected = [rewrite(path, 'single', False) for path in paths]
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            results = list(executor.map(lambda path: rewrite(path, 'single', False), paths))
+        self.assertEqual(results, expected)
+
+    def test_timings(self):
+        job = ArchiveJob('text_css.html')
+        token = current_job.set(job)
+        try:
+            path = os.path.join(TEST_DIR, 'text_css.html')
+            soup = BeautifulSoup(open(path, 'rb').read(), 'html5lib')
+            rewrite_document(RewriteContext(soup, path, verbose=False), traversal='single')
+        finally:
+            current_job.reset(token)
+        phases = job.timing_report()['phases']
+        self.assertEqual(phases['rewrite']['count'], 1)
+        self.assertGreaterEqual(phases['css']['count'], 1)
+
+    def test_stylesheet_charged(self):
+        path = os.path.join(TEST_DIR, 'text_css.html')
+        for budget in (None, 10):
+            job = ArchiveJob(path)
+            token = current_job.set(job)
+            try:
+                soup = BeautifulSoup(open(path, 'rb').read(), 'html5lib')
+                with mock.patch('webpage2html.webpage2html.max_page_bytes', budget):
+                    rewrite_document(RewriteContext(soup, path, verbose=False))
+            finally:
+                current_job.reset(token)
+            if budget is None:
+                # スタイルシートの本文と @import した data URI を数える
+                sheets = [os.path.join(TEST_DIR, 'text_css', name) for name in ('style.css', 'blah.css')]
+                self.assertGreater(job.page_bytes, sum(os.path.getsize(sheet) for sheet in sheets))
+                self.assertIsNotNone(soup.find('style'))
+            else:
+                # 予算を超えるスタイルシートはリンクのまま残す
+                self.assertEqual(soup.find('link')['href'], os.path.join(TEST_DIR, './text_css/style.css'))
+                self.assertEqual(job.skipped_assets[0]['reason'], 'max_page_bytes')
+
+    def test_prefetched_released(self):
+        job = ArchiveJob('http://example.com/')
+        job.prefetched['http://example.com/a.css'] = ('.a{}', {'content-type': 'text/css'})
+        token = current_job.set(job)
+        try:
+            self.assertEqual(get_contents('http://example.com/', 'a.css', verbose=False)[0], '.a{}')
+        finally:
+            current_job.reset(token)
+        # 使った本体はジョブに残さない
+        self.assertEqual(job.prefetched, {})
+
+    def test_unknown_traversal(self):
+        soup = BeautifulSoup('<p>x</p>', 'html5lib')
+        with self.assertRaises(ValueError):
+            rewrite_document(RewriteContext(soup, 'index.html'), traversal='bogus')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from webpage2html import scheduler as scheduler_module
+from webpage2html.scheduler import CrawlScheduler
+
+
+class TestCrawlScheduler(unittest.TestCase):
+    def setUp(self):
+        self.lock = threading.Lock()
+        self.running = {}
+        self.max_running = {}
+        self.order = []
+
+    def task(self, url):
+        host = url.split('/')[2]
+        with self.lock:
+            self.order.append(url)
+            self.running[host] = self.running.get(host, 0) + 1
+            self.max_running[host] = max(self.max_running.get(host, 0), self.running[host])
+        time.sleep(0.02)
+        with self.lock:
+            self.running[host] -= 1
+        if url.endswith('skip'):
+            return False
+        if url.endswith('fail'):
+            raise RuntimeError('broken page')
+
+    def test_limits_and_priority(self):
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            scheduler = CrawlScheduler(executor, self.task, workers=4, per_host=1, delay=0)
+            for i in range(4):
+                scheduler.add(f'http://a.example/{i}')
+                scheduler.add(f'http://b.example/{i}')
+            scheduler.add('http://c.example/first', priority=10)
+            scheduler.add('http://c.example/skip')
+            stats = scheduler.run()
+        self.assertEqual(self.order[0], 'http://c.example/first')
+        self.assertEqual(self.max_running, {'a.example': 1, 'b.example': 1, 'c.example': 1})
+        self.assertEqual((stats['done'], stats['skipped'], stats['pending']), (9, 1, 0))
+        self.assertGreater(stats['pages_per_min'], 0)
+
+    def test_resume(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            state_path = os.path.join(tmp, 'state.json')
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                scheduler = CrawlScheduler(executor, self.task, workers=1, delay=0, state_path=state_path)
+                scheduler.add('http://a.example/1')
+                scheduler.run()
+                # 完了したページは，再開しても取り直さない
+                scheduler = CrawlScheduler(executor, self.task, workers=1, delay=0, state_path=state_path)
+                scheduler.add('http://a.example/1')
+                scheduler.add('http://a.example/2')
+                scheduler.run()
+        self.assertEqual(self.order, ['http://a.example/1', 'http://a.example/2'])
+
+    def test_resume_keeps_failed(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            state_path = os.path.join(tmp, 'state.json')
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                scheduler = CrawlScheduler(executor, self.task, workers=1, delay=0, state_path=state_path)
+                scheduler.add('http://a.example/fail')
+                self.assertEqual(scheduler.run()['failed'], 1)
+                scheduler = CrawlScheduler(executor, self.task, workers=1, delay=0, state_path=state_path)
+                scheduler.add('http://a.example/fail')
+                scheduler.add('http://a.example/2')
+                stats = scheduler.run()
+        self.assertEqual((stats['done'], stats['failed'], stats['pending']), (1, 1, 0))
+        # 取り直す回数（2 回）を使い切ったページは，再開しても取り直さない
+        self.assertEqual(self.order.count('http://a.example/fail'), 2)
+
+    def test_progress_during_long_page(self):
+        logs = []
+
+        def slow(url):
+            time.sleep(0.3)
+
+        with ThreadPoolExecutor(max_workers=1) as executor, \
+                mock.patch.object(scheduler_module, 'progress_interval', 0.1):
+            scheduler = CrawlScheduler(executor, slow, workers=1, delay=0, log=logs.append)
+            scheduler.add('http://a.example/slow')
+            scheduler.run()
+        # ページが終わるのを待たずに，実行中の進捗を出力する
+        self.assertGreaterEqual(len([line for line in logs if 'running 1' in line]), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+import io
+import os
+import unittest
+
+from bs4 import BeautifulSoup
+
+from support import offline
+from webpage2html.serializer import fix_data_urls, write_document
+from webpage2html.webpage2html import ArchiveJob, RewriteContext, current_job, rewrite_document
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+FIXTURES = ['another_dir/test_full_url.html', 'hacklu-ctf-2013-exp400-wannable-0ops.html', 'test_css_screen.html',
+            'test_no_script.html', 'test_pre_formatting.html', 'test_requests_page.html', 'text_css.html',
+            'webfont.html']
+BACKENDS = ['html5lib', 'lxml']
+
+
+def serialize(soup) -> str:
+    out = io.StringIO()
+    write_document(soup, out, formatter='html5')
+    return out.getvalue()
+
+
+class TestSerializer(unittest.TestCase):
+    def test_matches_decode(self):
+        with offline():
+            for name in FIXTURES:
+                path = os.path.join(TEST_DIR, name)
+                for parser in BACKENDS:
+                    with self.subTest(name=name, parser=parser):
+                        with open(path, 'rb') as f:
+                            soup = BeautifulSoup(f.read(), parser)
+                        self.assertEqual(serialize(soup), fix_data_urls(soup.decode(formatter='html5')))
+                        # 書き換え後の（data URI を含む）DOM
+                        token = current_job.set(ArchiveJob(path))
+                        try:
+                            rewrite_document(RewriteContext(soup, path, verbose=False, frame_document=lambda src: ''))
+                        finally:
+                            current_job.reset(token)
+                        self.assertEqual(serialize(soup), fix_data_urls(soup.decode(formatter='html5')))
+
+
+if __name__ == '__main__':
+    unittest.main()
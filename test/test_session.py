@@ -0,0 +1,48 @@
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from webpage2html import service, session
+from webpage2html.service import _configure_worker
+
+
+class TestSession(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.multiple(session, pool_connections=session.pool_connections,
+                                      pool_maxsize=session.pool_maxsize, default_headers=dict(session.default_headers),
+                                      _session=None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(session.close_session)
+
+    def test_shared_pool(self):
+        # すべてのスレッドが同じセッション（接続プール）を使う
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            sessions = list(executor.map(lambda _: session.get_session(), range(8)))
+        self.assertTrue(all(s is sessions[0] for s in sessions))
+        adapter = sessions[0].get_adapter('https://example.com/')
+        self.assertIs(adapter, sessions[0].get_adapter('http://example.com/'))
+        self.assertEqual(adapter._pool_maxsize, 6)
+        self.assertTrue(adapter._pool_block)
+
+    def test_configure(self):
+        first = session.get_session()
+        session.configure_session(connections=4, maxsize=2, headers={'x-test': '1'})
+        second = session.get_session()
+        # 設定を変えると，セッションを作り直す
+        self.assertIsNot(first, second)
+        adapter = second.get_adapter('https://example.com/')
+        self.assertEqual((adapter._pool_connections, adapter._pool_maxsize), (4, 2))
+        self.assertEqual(second.headers['x-test'], '1')
+        self.assertIn('accept-language', second.headers)
+        # 認証情報はセッションに持たせない
+        self.assertIsNone(second.auth)
+
+    def test_configure_worker(self):
+        with mock.patch.object(service, 'configure_browser_pool'):
+            _configure_worker(1, 50, 3)
+        self.assertEqual(session.get_session().get_adapter('https://example.com/')._pool_maxsize, 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
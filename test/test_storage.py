@@ -0,0 +1,54 @@
+import base64
+import os
+import tempfile
+import unittest
+
+from webpage2html.storage import export_snapshot, load_snapshot, load_zstandard, open_storage
+
+FONT = base64.b64encode(bytes(range(256)) * 16).decode()
+CSS = base64.b64encode(b'body { color: red; }' * 100).decode()
+HTML = ('<html><head><style>@font-face { src: url("data:application/font-woff;base64,' + FONT + '"); }</style>'
+        '<link href="data:text/css;base64,' + CSS + '"></head>'
+        '<body><img src="data:image/png;base64,iVBORw0KGgo="><p>日本語</p></body></html>')
+
+
+class TestStorage(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_round_trip(self):
+        formats = ['plain', 'gzip', 'pack'] + (['zstd'] if load_zstandard() else [])
+        for fmt in formats:
+            with self.subTest(fmt=fmt):
+                info = open_storage(self.tmp.name, fmt).save(f'SITE_{fmt}', lambda f: f.write(HTML))
+                self.assertEqual(load_snapshot(info['path']), HTML)
+                output = export_snapshot(info['path'], os.path.join(self.tmp.name, f'{fmt}.html'))
+                with open(output, encoding='utf-8') as f:
+                    self.assertEqual(f.read(), HTML)
+
+    def test_pack_shares_assets(self):
+        storage = open_storage(self.tmp.name, 'pack')
+        first = storage.save('SITE_20200601T120000JST', lambda f: f.write(HTML))
+        second = storage.save('SITE_20200602T120000JST', lambda f: f.write(HTML))
+        # 小さい data URI は HTML に残し，フォントとスタイルシートだけを一度保存する
+        self.assertEqual((first['objects'], first['objects_written']), (2, 2))
+        self.assertEqual((second['objects'], second['objects_written']), (2, 0))
+        self.assertLess(second['bytes'], len(HTML) / 10)
+        self.assertEqual(load_snapshot(second['path']), HTML)
+
+    def test_pack_media_type_parameters(self):
+        html = f'<link href="data:text/css;charset=utf-8;base64,{CSS}">'
+        info = open_storage(self.tmp.name, 'pack').save('SITE_20200601T120000JST', lambda f: f.write(html))
+        self.assertEqual(info['objects'], 1)
+        self.assertEqual(load_snapshot(info['path']), html)
+
+    def test_unknown_format(self):
+        with self.assertRaises(ValueError):
+            open_storage(self.tmp.name, 'bzip2')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,345 @@
+import atexit
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+# 同時に起動しておくブラウザの数
+pool_size = 1
+# この数のページを開いたブラウザは終了し，新しく起動し直す
+max_pages_per_browser = 50
+window_size = (1920, 1080)
+# driver.get() でページの読み込みを待つ最大の秒数
+page_load_timeout = 60
+# ページの準備ができるまで待つ最大の秒数
+ready_timeout = 15
+# この時間，読み込み中の fetch / XHR がなく，新しいリソースの読み込みが終わらなければネットワークが落ち着いたとみなす
+network_idle_ms = 500
+# この時間，DOM が変化しなければ描画が落ち着いたとみなす
+dom_idle_ms = 500
+
+# 読み込み中の fetch / XHR を数える．Resource Timing には終わったリクエストしか現れないため，
+# ブラウザの起動時に Page.addScriptToEvaluateOnNewDocument で，すべてのページのスクリプトより先に実行する
+_pending_requests_script = """
+(function () {
+  var state = window.__webpage2htmlRequests = {pending: 0, lastChange: performance.now()};
+  function start() { state.pending++; state.lastChange = performance.now(); }
+  function end() { state.pending = Math.max(0, state.pending - 1); state.lastChange = performance.now(); }
+  if (window.fetch) {
+    var fetch = window.fetch;
+    window.fetch = function () {
+      start();
+      return fetch.apply(this, arguments).then(function (r) { end(); return r; }, function (e) { end(); throw e; });
+    };
+  }
+  if (window.XMLHttpRequest) {
+    var send = XMLHttpRequest.prototype.send;
+    XMLHttpRequest.prototype.send = function () {
+      start();
+      this.addEventListener('loadend', end);
+      return send.apply(this, arguments);
+    };
+  }
+})();
+"""
+
+# MutationObserver，Resource Timing と読み込み中のリクエストの数でページの状態を調べる
+_ready_state_script = """
+if (!window.__webpage2html) {
+  window.__webpage2html = {lastMutation: performance.now()};
+  if (performance.setResourceTimingBufferSize) { performance.setResourceTimingBufferSize(100000); }
+  new MutationObserver(function () { window.__webpage2html.lastMutation = performance.now(); })
+    .observe(document, {childList: true, subtree: true, attributes: true, characterData: true});
+}
+var lastResponse = 0;
+performance.getEntriesByType('resource').forEach(function (e) {
+  if (e.responseEnd > lastResponse) { lastResponse = e.responseEnd; }
+});
+var requests = window.__webpage2htmlRequests || {pending: 0, lastChange: 0};
+return {
+  readyState: document.readyState,
+  now: performance.now(),
+  lastMutation: window.__webpage2html.lastMutation,
+  lastResponse: Math.max(lastResponse, requests.lastChange),
+  pendingRequests: requests.pending,
+  scrollY: window.scrollY,
+  innerHeight: window.innerHeight,
+  scrollHeight: document.documentElement.scrollHeight
+};
+"""
+
+# 開いているページと，読み込んだリソース（iframe を含む）のオリジン．
+# sessionStorage はオリジンではなくタブに属するので，ここで消す
+_origins_script = """
+try { sessionStorage.clear(); } catch (err) {}
+var origins = {};
+origins[location.origin] = true;
+performance.getEntriesByType('resource').forEach(function (e) {
+  try { origins[new URL(e.name).origin] = true; } catch (err) {}
+});
+return Object.keys(origins);
+"""
+
+
+def chrome_options():
+    from selenium import webdriver
+
+    options = webdriver.ChromeOptions()
+    options.add_argument('--headless')
+    options.add_argument("--incognito")
+    options.add_argument("--hide-scrollbars")
+    options.add_argument("--test-type")
+    return options
+
+
+def page_state(driver) -> dict:
+    """
+    readyState，最後の DOM の変化，最後のリソースの読み込み完了時刻（ms），読み込み中の fetch / XHR の数などを取得する
+    """
+    return driver.execute_script(_ready_state_script)
+
+
+def wait_for_page_ready(driver, timeout: float = None, poll: float = 0.1) -> bool:
+    """
+    document.readyState が complete になり，読み込み中の fetch / XHR がなくなって，ネットワークと DOM の変化が落ち着くまで待つ
+
+    Args:
+        driver: WebDriver
+        timeout (float): 最大の待ち時間（秒）．省略時は ready_timeout
+        poll (float): 状態を調べる間隔（秒）
+
+    Returns:
+        bool: 時間内に落ち着いた場合は True
+    """
+    deadline = time.monotonic() + (ready_timeout if timeout is None else timeout)
+    while True:
+        state = page_state(driver)
+        if state['readyState'] == 'complete' \
+                and not state.get('pendingRequests') \
+                and state['now'] - state['lastResponse'] >= network_idle_ms \
+                and state['now'] - state['lastMutation'] >= dom_idle_ms:
+            return True
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(poll)
+
+
+def scroll_through_page(driver, timeout: float = None) -> bool:
+    """
+    遅延読み込みの画像などを読み込ませるため，1 画面ずつ最後までスクロールする．
+    スクロールするたびに，ページが落ち着くのを待つ．
+
+    Args:
+        driver: WebDriver
+        timeout (float): 最大の待ち時間（秒）．省略時は ready_timeout
+
+    Returns:
+        bool: 時間内に最後までスクロールできた場合は True
+    """
+    deadline = time.monotonic() + (ready_timeout if timeout is None else timeout)
+    last_scroll_y = None
+    while True:
+        state = page_state(driver)
+        # 最後まで来たか，スクロールできない（overflow: hidden など）場合は終わり
+        if state['scrollY'] + state['innerHeight'] >= state['scrollHeight'] or state['scrollY'] == last_scroll_y:
+            return True
+        last_scroll_y = state['scrollY']
+        driver.execute_script("window.scrollBy(0, window.innerHeight)")
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        wait_for_page_ready(driver, timeout=remaining)
+
+
+def capture_frames(driver, max_depth: int = 3, depth: int = 1) -> dict:
+    """
+    開いているページの iframe / frame に切り替えて，描画済みの DOM を取得する．
+    フレームの中のフレームも max_depth まで取得する．
+
+    Args:
+        driver: WebDriver
+        max_depth (int): 取得するフレームの深さ
+        depth (int): 現在の深さ
+
+    Returns:
+        dict: src 属性の値をキーとし，{'url': フレームの URL, 'html': DOM, 'frames': 子フレーム} を値とする辞書
+    """
+    from selenium.common.exceptions import WebDriverException
+
+    frames = {}
+    if depth > max_depth:
+        return frames
+    for element in driver.find_elements_by_css_selector('iframe[src], frame[src]'):
+        try:
+            src = driver.execute_script("return arguments[0].getAttribute('src');", element)
+            if not src or src in frames:
+                continue
+            driver.switch_to.frame(element)
+        except WebDriverException:
+            continue
+        try:
+            frames[src] = {
+                'url': driver.execute_script("return location.href;"),
+                'html': driver.page_source,
+                'frames': capture_frames(driver, max_depth=max_depth, depth=depth + 1),
+            }
+        except WebDriverException:
+            pass
+        finally:
+            driver.switch_to.parent_frame()
+    return frames
+
+
+class BrowserPool(object):
+    """
+    起動済みの headless Chrome を使い回すプール
+
+    lease() で借りたブラウザは，返却時に開いたページ数を数え，max_pages に達したもの，
+    または WebDriverException で壊れたものは終了して次回新しく起動する．
+    返却時には，開いたページのオリジンの保存データ（localStorage，sessionStorage，IndexedDB，
+    Service Worker，Cache Storage など）を消し，次に借りたページに前のサイトの状態を持ち越さない．
+    """
+
+    def __init__(self, size: int = 1, max_pages: int = 50):
+        self.size = size
+        self.max_pages = max_pages
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._pages = {}
+        self.launched = 0
+
+    def _launch(self):
+        # selenium と chromedriver（PATH に追加される）は，最初にブラウザを起動する時に読み込む
+        import chromedriver_binary  # noqa: F401
+        from selenium import webdriver
+
+        driver = webdriver.Chrome(options=chrome_options())
+        driver.execute_cdp_cmd('Page.addScriptToEvaluateOnNewDocument', {'source': _pending_requests_script})
+        self._pages[id(driver)] = 0
+        self.launched += 1
+        return driver
+
+    def _quit(self, driver) -> None:
+        self._pages.pop(id(driver), None)
+        try:
+            driver.quit()
+        except Exception:
+            pass
+
+    @staticmethod
+    def _reset(driver) -> None:
+        """
+        前のページの状態（Cookie，ウィンドウの大きさ，開いているページ）を消す
+        """
+        driver.execute_cdp_cmd('Network.clearBrowserCookies', {})
+        driver.get('about:blank')
+        driver.set_window_size(*window_size)
+
+    @staticmethod
+    def _clear_storage(driver) -> bool:
+        """
+        開いていたページと，そこで読み込んだリソースのオリジンの保存データをすべて消す
+
+        Returns:
+            bool: 消せた場合は True．False の場合，ブラウザは再利用しない
+        """
+        try:
+            origins = driver.execute_script(_origins_script) or []
+            driver.get('about:blank')
+            for origin in origins:
+                if origin.startswith('http'):
+                    driver.execute_cdp_cmd('Storage.clearDataForOrigin', {'origin': origin, 'storageTypes': 'all'})
+        except Exception:
+            return False
+        return True
+
+    @contextmanager
+    def lease(self):
+        """
+        ブラウザを一つ借りる．すべて使用中の場合は返却されるまで待つ．
+        """
+        from selenium.common.exceptions import WebDriverException
+
+        self._slots.acquire()
+        driver = None
+        try:
+            try:
+                driver = self._idle.get_nowait()
+            except queue.Empty:
+                driver = self._launch()
+            self._reset(driver)
+            yield driver
+            self._pages[id(driver)] += 1
+        except WebDriverException:
+            # クラッシュしたブラウザは再利用しない
+            if driver is not None:
+                self._quit(driver)
+                driver = None
+            raise
+        finally:
+            if driver is not None:
+                if self._pages.get(id(driver), 0) < self.max_pages and self._clear_storage(driver):
+                    self._idle.put(driver)
+                else:
+                    self._quit(driver)
+            self._slots.release()
+
+    def close(self) -> None:
+        """
+        待機中のブラウザをすべて終了する
+        """
+        while True:
+            try:
+                self._quit(self._idle.get_nowait())
+            except queue.Empty:
+                break
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def configure_browser_pool(size: int = None, max_pages: int = None) -> None:
+    """
+    ブラウザプールの大きさと，ブラウザを起動し直すまでのページ数を設定する．
+    設定が変わった場合は，既存のプールを閉じる．
+
+    Args:
+        size (int): 同時に起動しておくブラウザの数
+        max_pages (int): ブラウザを起動し直すまでのページ数
+    """
+    global pool_size
+    global max_pages_per_browser
+
+    changed = (size and size != pool_size) or (max_pages and max_pages != max_pages_per_browser)
+    pool_size = size or pool_size
+    max_pages_per_browser = max_pages or max_pages_per_browser
+    if changed:
+        close_browser_pool()
+
+
+def get_browser_pool() -> BrowserPool:
+    """
+    プロセスで共有するブラウザプールを取得する
+    """
+    global _pool
+
+    with _pool_lock:
+        if _pool is None:
+            _pool = BrowserPool(size=pool_size, max_pages=max_pages_per_browser)
+        return _pool
+
+
+def close_browser_pool() -> None:
+    """
+    共有のブラウザプールを閉じる
+    """
+    global _pool
+
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+
+
+atexit.register(close_browser_pool)
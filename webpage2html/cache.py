@@ -0,0 +1,309 @@
+import email.utils
+import hashlib
+import json
+import os
+import tempfile
+import time
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+from urllib.parse import urlsplit, urlunsplit
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None
+
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+# Last-Modified からの推測による有効期限の上限（RFC 7234 4.2.2）
+HEURISTIC_MAX_TTL = 24 * 60 * 60
+
+
+def normalize_url(url: str) -> str:
+    """
+    キャッシュのキーに使うために URL を正規化する
+
+    Args:
+        url (str): URL
+
+    Returns:
+        str: scheme と host を小文字にし，既定ポートとフラグメントを除いた URL
+    """
+    parts = urlsplit(url)
+    scheme = parts.scheme.lower()
+    netloc = parts.netloc.lower()
+    if (scheme == 'http' and netloc.endswith(':80')) or (scheme == 'https' and netloc.endswith(':443')):
+        netloc = netloc.rsplit(':', 1)[0]
+    return urlunsplit((scheme, netloc, parts.path or '/', parts.query, ''))
+
+
+def parse_cache_control(value: str) -> dict:
+    """
+    Cache-Control ヘッダを辞書に変換する
+
+    Args:
+        value (str): Cache-Control ヘッダの値
+
+    Returns:
+        dict: ディレクティブ名（小文字）と値
+    """
+    directives = {}
+    for item in (value or '').split(','):
+        item = item.strip()
+        if not item:
+            continue
+        name, _, arg = item.partition('=')
+        directives[name.strip().lower()] = arg.strip().strip('"') or None
+    return directives
+
+
+def _http_date(value: str):
+    if not value:
+        return None
+    try:
+        return email.utils.parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError, IndexError, OverflowError):
+        return None
+
+
+def freshness_lifetime(headers: dict, default_ttl: float = 0) -> float:
+    """
+    レスポンスヘッダから有効期間（秒）を求める
+
+    Args:
+        headers (dict): レスポンスヘッダ（キーは小文字）
+        default_ttl (float): 鮮度の情報がない場合の有効期間
+
+    Returns:
+        float: 有効期間．保存してはいけない場合は None
+    """
+    cache_control = parse_cache_control(headers.get('cache-control'))
+    if 'no-store' in cache_control:
+        return None
+    if 'no-cache' in cache_control:
+        return 0
+    for name in ('s-maxage', 'max-age'):
+        if cache_control.get(name):
+            try:
+                return max(0, int(cache_control[name]))
+            except ValueError:
+                pass
+    date = _http_date(headers.get('date')) or time.time()
+    expires = headers.get('expires')
+    if expires is not None:
+        expires_at = _http_date(expires)
+        return max(0, expires_at - date) if expires_at else 0
+    last_modified = _http_date(headers.get('last-modified'))
+    if last_modified:
+        return min(HEURISTIC_MAX_TTL, max(0, (date - last_modified) / 10))
+    return default_ttl
+
+
+class DiskCache(object):
+    """
+    URL をキーにした，コンテンツアドレス方式のディスクキャッシュ
+
+    root/entries に URL ごとのメタデータ（JSON）を，root/objects に本体を SHA-256 の名前で保存する．
+    同じ内容のアセットは一つのファイルを共有する．書き込みは一時ファイルからの rename で行い，
+    追い出しは排他ロックの下で行うので，複数のプロセスから同時に利用できる．
+    """
+
+    def __init__(self, root: str, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.entries_dir = self.root / 'entries'
+        self.objects_dir = self.root / 'objects'
+        self.tmp_dir = self.root / 'tmp'
+        for path in (self.entries_dir, self.objects_dir, self.tmp_dir):
+            path.mkdir(parents=True, exist_ok=True)
+        self.lock_path = self.root / 'lock'
+        self.lock_path.touch(exist_ok=True)
+        self._approx_size = self._objects_size()
+        # hit: 有効期限内のヒット，revalidated: 304 による再利用，fetched: 本体の取得
+        self.stats = Counter(hit=0, revalidated=0, fetched=0, revalidated_bytes=0)
+
+    @staticmethod
+    def _key(url: str) -> str:
+        return hashlib.sha256(normalize_url(url).encode()).hexdigest()
+
+    def _entry_path(self, url: str) -> Path:
+        key = self._key(url)
+        return self.entries_dir / key[:2] / f'{key}.json'
+
+    def _object_path(self, digest: str) -> Path:
+        return self.objects_dir / digest[:2] / digest
+
+    @contextmanager
+    def _lock(self, exclusive: bool = False):
+        if fcntl is None:
+            yield
+            return
+        with open(self.lock_path, 'rb') as f:
+            fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _atomic_write(self, path: Path, data: bytes) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=str(self.tmp_dir))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, str(path))
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+    def _objects_size(self) -> int:
+        return sum(p.stat().st_size for p in self.objects_dir.glob('*/*') if p.is_file())
+
+    def get(self, url: str):
+        """
+        キャッシュされたエントリを取得する
+
+        Args:
+            url (str): URL
+
+        Returns:
+            tuple: (本体の bytes, メタデータ)．エントリがない場合は (None, None)
+        """
+        entry_path = self._entry_path(url)
+        try:
+            meta = json.loads(entry_path.read_text())
+            data = self._object_path(meta['digest']).read_bytes()
+        except (OSError, ValueError, KeyError):
+            return None, None
+        try:
+            # 最終アクセス時刻を LRU の順序に使う
+            os.utime(str(entry_path))
+        except OSError:
+            pass
+        return data, meta
+
+    @staticmethod
+    def is_fresh(meta: dict) -> bool:
+        """
+        エントリが有効期限内かどうか
+        """
+        return bool(meta) and meta.get('expires', 0) > time.time()
+
+    def put(self, url: str, data: bytes, headers: dict = None, default_ttl: float = 0, **extra) -> bool:
+        """
+        エントリを保存する
+
+        Args:
+            url (str): URL
+            data (bytes): 本体
+            headers (dict): レスポンスヘッダ
+            default_ttl (float): 鮮度の情報がない場合の有効期間
+            **extra: メタデータに追加する値（content-type, encoding など）
+
+        Returns:
+            bool: 保存した場合は True
+        """
+        headers = {k.lower(): v for k, v in (headers or {}).items()}
+        ttl = freshness_lifetime(headers, default_ttl=default_ttl)
+        if ttl is None:
+            return False
+        digest = hashlib.sha256(data).hexdigest()
+        meta = {
+            'url': normalize_url(url),
+            'digest': digest,
+            'size': len(data),
+            'stored': time.time(),
+            'expires': time.time() + ttl,
+            'etag': headers.get('etag'),
+            'last-modified': headers.get('last-modified'),
+        }
+        meta.update(extra)
+        with self._lock():
+            object_path = self._object_path(digest)
+            if not object_path.exists():
+                self._atomic_write(object_path, data)
+                self._approx_size += len(data)
+            self._atomic_write(self._entry_path(url), json.dumps(meta).encode())
+        if self._approx_size > self.max_bytes:
+            self.evict()
+        return True
+
+    @staticmethod
+    def conditional_headers(meta: dict) -> dict:
+        """
+        再検証のための条件付きリクエストヘッダを作る
+
+        Args:
+            meta (dict): エントリのメタデータ
+
+        Returns:
+            dict: If-None-Match / If-Modified-Since．検証子がない場合は空
+        """
+        headers = {}
+        if meta and meta.get('etag'):
+            headers['if-none-match'] = meta['etag']
+        if meta and meta.get('last-modified'):
+            headers['if-modified-since'] = meta['last-modified']
+        return headers
+
+    def refresh(self, url: str, meta: dict, headers: dict = None, default_ttl: float = 0) -> dict:
+        """
+        304 Not Modified を受け取ったエントリの有効期限と検証子を更新する
+
+        Args:
+            url (str): URL
+            meta (dict): エントリのメタデータ
+            headers (dict): 304 レスポンスのヘッダ
+            default_ttl (float): 鮮度の情報がない場合の有効期間
+
+        Returns:
+            dict: 更新したメタデータ
+        """
+        merged = {'etag': meta.get('etag'), 'last-modified': meta.get('last-modified')}
+        merged.update({k.lower(): v for k, v in (headers or {}).items()})
+        ttl = freshness_lifetime(merged, default_ttl=default_ttl) or 0
+        meta = dict(meta, expires=time.time() + ttl, etag=merged.get('etag'),
+                    **{'last-modified': merged.get('last-modified')})
+        with self._lock():
+            self._atomic_write(self._entry_path(url), json.dumps(meta).encode())
+        return meta
+
+    def evict(self, target_bytes: int = None) -> int:
+        """
+        最近使われていないエントリから削除し，キャッシュの大きさを target_bytes 以下にする
+
+        Args:
+            target_bytes (int): 目標の大きさ．省略時は max_bytes の 90%
+
+        Returns:
+            int: 削除後の大きさ
+        """
+        if target_bytes is None:
+            target_bytes = int(self.max_bytes * 0.9)
+        with self._lock(exclusive=True):
+            entries = []
+            for path in self.entries_dir.glob('*/*.json'):
+                try:
+                    entries.append((path.stat().st_mtime, path, json.loads(path.read_text())))
+                except (OSError, ValueError):
+                    continue
+            entries.sort(key=lambda e: e[0], reverse=True)
+
+            kept = {}
+            total = 0
+            for _, path, meta in entries:
+                digest = meta.get('digest')
+                size = meta.get('size', 0)
+                if digest in kept:
+                    continue
+                if total + size <= target_bytes:
+                    kept[digest] = size
+                    total += size
+                else:
+                    path.unlink()
+            for path in self.objects_dir.glob('*/*'):
+                if path.name not in kept:
+                    path.unlink()
+            self._approx_size = total
+        return total
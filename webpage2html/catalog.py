@@ -0,0 +1,151 @@
+import re
+import sqlite3
+import threading
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+JST = timezone(timedelta(hours=+9), 'JST')
+# 保存したファイルの名前（{site_id}_{取得時刻}.拡張子）
+snapshot_file_re = re.compile(r'^([A-Z2-7=]+)_(\d{8}T\d{6}JST)\.')
+
+_schema = """
+CREATE TABLE IF NOT EXISTS snapshots (
+    site_id TEXT NOT NULL,
+    url TEXT NOT NULL,
+    getting_time TEXT NOT NULL,
+    captured_at INTEGER NOT NULL,
+    html_path TEXT,
+    PRIMARY KEY (site_id, getting_time)
+);
+CREATE INDEX IF NOT EXISTS snapshots_site ON snapshots (site_id, captured_at);
+CREATE INDEX IF NOT EXISTS snapshots_url ON snapshots (url, captured_at);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+def parse_getting_time(getting_time: str):
+    """
+    取得時刻（%Y%m%dT%H%M%SJST）を datetime にする．形式が違う場合は None．
+    """
+    try:
+        return datetime.strptime(getting_time.replace('JST', '+0900'), '%Y%m%dT%H%M%S%z')
+    except (AttributeError, ValueError):
+        return None
+
+
+class Catalog(object):
+    """
+    取得したページ（スナップショット）の索引
+
+    site_id と URL ごとに取得時刻の索引を持つ SQLite のデータベースで，
+    「最近取得したか」「最新のスナップショット」「サイトのスナップショットの一覧」を，
+    ダウンロードのディレクトリを走査せずに調べる．複数のプロセスから使えるよう WAL で開く．
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript(_schema)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def add(self, site_id: str, url: str, getting_time: str, html_path: str = None) -> None:
+        """
+        スナップショットを登録する．同じ site_id と取得時刻のものは上書きする．
+        """
+        captured_at = parse_getting_time(getting_time)
+        if captured_at is None:
+            return
+        with self._lock:
+            self._conn.execute('INSERT OR REPLACE INTO snapshots VALUES (?, ?, ?, ?, ?)',
+                               (site_id, url, getting_time, int(captured_at.timestamp()), html_path))
+
+    def latest(self, site_id: str):
+        """
+        サイトの最新のスナップショット
+
+        Returns:
+            dict: site_id，url，getting_time，captured_at（UNIX 時刻），html_path．ない場合は None
+        """
+        with self._lock:
+            row = self._conn.execute('SELECT * FROM snapshots WHERE site_id = ? '
+                                     'ORDER BY captured_at DESC LIMIT 1', (site_id,)).fetchone()
+        return dict(row) if row else None
+
+    def captured_within(self, site_id: str, seconds: float, now: datetime = None) -> bool:
+        """
+        seconds 秒以内に取得したスナップショットがあるかどうか
+        """
+        now = now or datetime.now(JST)
+        with self._lock:
+            row = self._conn.execute('SELECT 1 FROM snapshots WHERE site_id = ? AND captured_at > ? LIMIT 1',
+                                     (site_id, now.timestamp() - seconds)).fetchone()
+        return row is not None
+
+    def list_site(self, site_id: str) -> list:
+        """
+        サイトのスナップショットを新しい順に返す
+        """
+        with self._lock:
+            rows = self._conn.execute('SELECT * FROM snapshots WHERE site_id = ? ORDER BY captured_at DESC',
+                                      (site_id,)).fetchall()
+        return [dict(row) for row in rows]
+
+    def list_url(self, url: str) -> list:
+        """
+        URL のスナップショットを新しい順に返す
+        """
+        with self._lock:
+            rows = self._conn.execute('SELECT * FROM snapshots WHERE url = ? ORDER BY captured_at DESC',
+                                      (url,)).fetchall()
+        return [dict(row) for row in rows]
+
+    def import_download_dir(self, download_dir: str) -> int:
+        """
+        既存のダウンロードのディレクトリ（html/，image/，link/，report/ と url_id_list.txt）を一度だけ取り込む
+
+        Returns:
+            int: 取り込んだスナップショットの数．取り込み済みの場合は 0
+        """
+        with self._lock:
+            if self._conn.execute("SELECT 1 FROM meta WHERE key = 'imported'").fetchone():
+                return 0
+        root = Path(download_dir)
+        urls = {}
+        url_id_list = root / 'url_id_list.txt'
+        if url_id_list.exists():
+            with open(url_id_list) as f:
+                for line in f:
+                    fields = line.rstrip('\n').split('\t')
+                    if len(fields) == 3:
+                        urls[fields[0]] = fields[1]
+        snapshots = {}
+        for sub_dir in ('html', 'image', 'link', 'report'):
+            if not (root / sub_dir).is_dir():
+                continue
+            for path in (root / sub_dir).iterdir():
+                m = snapshot_file_re.match(path.name)
+                if not m or parse_getting_time(m.group(2)) is None:
+                    continue
+                if sub_dir == 'html':
+                    snapshots[m.groups()] = str(path)
+                else:
+                    snapshots.setdefault(m.groups(), None)
+        rows = [(site_id, urls.get(site_id, ''), getting_time,
+                 int(parse_getting_time(getting_time).timestamp()), html_path)
+                for (site_id, getting_time), html_path in snapshots.items()]
+        with self._lock:
+            self._conn.execute('BEGIN')
+            self._conn.executemany('INSERT OR IGNORE INTO snapshots VALUES (?, ?, ?, ?, ?)', rows)
+            self._conn.execute("INSERT OR REPLACE INTO meta VALUES ('imported', ?)",
+                               (datetime.now(JST).isoformat(),))
+            self._conn.execute('COMMIT')
+        return len(rows)
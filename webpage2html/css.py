@@ -0,0 +1,205 @@
+import base64
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+
+from . import logs
+
+css_encoding_re = re.compile(r'''@charset\s+["']([-_a-zA-Z0-9]+)["'];''', re.I)
+# Watch out! how to handle urls which contain parentheses inside? Oh god, css does not support such kind of urls
+# I tested such url in css, and, unfortunately, the css rule is broken. LOL!
+# I have to say that, CSS is awesome!
+css_token_re = re.compile(r'''@import\s+url\s*\((?P<import_url>.+?)\)'''
+                          r'''|@import\s+(?P<quote>["'])(?P<import_str>.+?)(?P=quote)'''
+                          r'''|url\s*\((?P<url>.+?)\)''', re.I)
+
+
+def decode_css(css) -> str:
+    """
+    CSS を文字列にする．bytes の場合は @charset の文字コード（なければ UTF-8）で復号する．
+    """
+    if isinstance(css, str):
+        return css
+    mo = css_encoding_re.search(css[:1024].decode('latin-1'))
+    if mo:
+        try:
+            return css.decode(mo.group(1))
+        except (LookupError, UnicodeDecodeError):
+            pass
+    return css.decode('utf-8', errors='replace')
+
+
+def tokenize(css: str) -> list:
+    """
+    CSS を，そのまま出力する文字列と，URL の参照に分ける
+
+    Returns:
+        list: 文字列，または ('import' | 'url', URL) のタプルのリスト
+    """
+    tokens = []
+    pos = 0
+    for m in css_token_re.finditer(css):
+        tokens.append(css[pos:m.start()])
+        if m.group('url') is not None:
+            tokens.append(('url', m.group('url').strip(' \'"')))
+        else:
+            tokens.append(('import', (m.group('import_url') or m.group('import_str')).strip(' \'"')))
+        pos = m.end()
+    tokens.append(css[pos:])
+    return tokens
+
+
+def iter_urls(css) -> list:
+    """
+    CSS が参照する URL と，それが @import かどうかを返す
+    """
+    return [(src, kind == 'import') for kind, src in (t for t in tokenize(decode_css(css)) if isinstance(t, tuple))]
+
+
+class CSSEngine(object):
+    """
+    CSS の url() と @import を data URI に書き換える
+
+    トークン列は CSS の内容のハッシュごとに，書き換えた結果は（基準の URL，内容のハッシュ）ごとに
+    覚えておくので，複数のページやフレームが読み込む共通のスタイルシートは，一度だけ処理される．
+    @import したスタイルシートも再帰的に書き換えて埋め込み，循環している場合は絶対 URL のまま残す．
+    埋め込めなかった参照や，循環で止めた @import を含む結果は覚えず，次回は書き換え直す
+    （循環で止める位置は，どのスタイルシートからたどったかで変わる）．
+    覚えた結果は複数のスレッドのジョブで共有できる．
+    """
+
+    def __init__(self, fetch, embed, resolve, log=None, max_entries: int = 512, charge=None, variant=None):
+        """
+        Args:
+            fetch: fetch(base, src, **kwargs) -> (content, extra_data)．@import の取得に使う
+            embed: embed(base, src, **kwargs) -> str．url() の参照先を data URI にする
+            resolve: resolve(base, src) -> str．絶対 URL を求める
+            log: logs.event と同じ形の log(level, tag, msg, *args)．スタイルシートごとの処理時間を出力する
+            max_entries (int): 覚えておく結果と，処理時間（timings）の数
+            charge: charge(size) -> bool．@import したスタイルシートの data URI と，覚えていた結果を使う時に
+                    埋め込む data URI のバイト数をページの予算から使う．False の場合は URL のまま残すか書き換え直す
+            variant: variant() -> str．embed の埋め込み方（data URI か MHTML のパートか）．覚えた結果のキーに加え，
+                     埋め込み方の違う結果を使わない
+        """
+        self.fetch = fetch
+        self.embed = embed
+        self.resolve = resolve
+        self.log = log
+        self.max_entries = max_entries
+        self.charge = charge
+        self.variant = variant
+        self._tokens = OrderedDict()
+        self._rewritten = OrderedDict()
+        self._lock = threading.Lock()
+        # 最近のスタイルシートごとの (URL, 文字数, 秒, 覚えていた結果を使ったか)
+        self.timings = deque(maxlen=max_entries)
+
+    def _remember(self, memo: OrderedDict, key, value) -> None:
+        with self._lock:
+            memo[key] = value
+            memo.move_to_end(key)
+            while len(memo) > self.max_entries:
+                memo.popitem(last=False)
+
+    def _recall(self, memo: OrderedDict, key):
+        with self._lock:
+            value = memo.get(key)
+            if value is not None:
+                memo.move_to_end(key)
+            return value
+
+    def rewrite(self, base: str, css, name: str = None, stack: tuple = (), **kwargs) -> str:
+        """
+        CSS を書き換える
+
+        Args:
+            base (str): 相対 URL の基準になる URL
+            css (str | bytes): CSS
+            name (str): スタイルシートの URL．指定した場合は処理時間を記録し，循環の検出にも使う
+            stack (tuple): @import をたどっている途中のスタイルシートの URL（循環の検出に使う）．
+                           省略時は (name,)
+            **kwargs: fetch と embed に渡す引数
+
+        Returns:
+            str: 書き換えた CSS
+        """
+        if not css:
+            return css
+        if not stack and name:
+            stack = (name,)
+        return self._rewrite(base, css, name, stack, **kwargs)[0]
+
+    def _rewrite(self, base: str, css, name: str, stack: tuple, **kwargs) -> tuple:
+        """
+        Returns:
+            tuple: (書き換えた CSS, 埋め込んだ data URI のバイト数, すべて埋め込めたかどうか)
+        """
+        start = time.perf_counter()
+        css = decode_css(css)
+        digest = hashlib.sha1(css.encode('utf-8', errors='surrogatepass')).hexdigest()
+        key = (self.variant() if self.variant else None, base, digest)
+        entry = self._recall(self._rewritten, key)
+        memo_hit = entry is not None and (self.charge is None or self.charge(entry[1]))
+        if memo_hit:
+            result, embedded, complete = entry
+        else:
+            tokens = self._recall(self._tokens, digest)
+            if tokens is None:
+                tokens = tokenize(css)
+                self._remember(self._tokens, digest, tokens)
+            parts = []
+            embedded = 0
+            complete = True
+            for token in tokens:
+                if isinstance(token, str):
+                    parts.append(token)
+                    continue
+                if token[0] == 'import':
+                    data_uri, size, ok = self._import(base, token[1], stack, **kwargs)
+                    parts.append(f'@import url("{data_uri}")')
+                else:
+                    data_uri = self.embed(base, token[1], **kwargs)
+                    parts.append(f'url("{data_uri}")')
+                    ok = data_uri.startswith('data:')
+                    size = len(data_uri) if ok and not token[1].startswith('data:') else 0
+                embedded += size
+                complete = complete and ok
+            result = ''.join(parts)
+            if complete:
+                self._remember(self._rewritten, key, (result, embedded, complete))
+        if name:
+            elapsed = time.perf_counter() - start
+            self.timings.append((name, len(css), elapsed, memo_hit))
+            if self.log:
+                self.log(logs.DEBUG, 'CSS', '%.3fs %d chars%s - %s', elapsed, len(css),
+                         ' (memo)' if memo_hit else '', name)
+        return result, embedded, complete
+
+    def _import(self, base: str, src: str, stack: tuple, **kwargs) -> tuple:
+        """
+        @import するスタイルシートを書き換えて data URI にする
+
+        Returns:
+            tuple: (data URI または URL, 埋め込んだ data URI のバイト数, すべて埋め込めたかどうか)
+        """
+        if src.startswith('data:'):
+            return src, 0, True
+        url = self.resolve(base, src)
+        if url in stack:
+            if self.log:
+                self.log(logs.WARN, 'WARN', 'circular @import - %s', url)
+            return url, 0, False
+        content, _ = self.fetch(base, src, **kwargs)
+        if not content:
+            return url, 0, False
+        rewritten, embedded, complete = self._rewrite(url, content, url, stack + (url,), **kwargs)
+        data_uri = f'data:text/css;base64,{base64.b64encode(rewritten.encode()).decode("utf-8")}'
+        # 中で埋め込んだ data URI は使用済みなので，残りのバイト数をページの予算から使う．
+        # 足りない場合は絶対 URL のまま残す
+        if self.charge is not None and not self.charge(max(0, len(data_uri) - embedded)):
+            if self.log:
+                self.log(logs.WARN, 'WARN', 'not embedded (max_page_bytes), left as URL - %s', url)
+            return url, embedded, False
+        return data_uri, max(len(data_uri), embedded), complete
@@ -0,0 +1,130 @@
+import re
+from collections import Counter
+
+# CSS 中の url(data:...)．data URI にはクオートや括弧，空白は含まれない．
+css_data_url_re = re.compile(r'''url\(\s*(["']?)(data:[^"')\s]+)\1\s*\)''')
+# @font-face の記述子には var() が使えないので，この中の data URI は共有しない
+font_face_re = re.compile(r'@font-face\s*\{[^}]*\}', re.I)
+# @import も var() では書けない（スタイルシートが読み込まれなくなる）ので，共有しない
+import_re = re.compile(r'@import\s*$', re.I)
+
+ASSET_ATTRIBUTE = 'data-webpage2html-asset'
+
+# 共有した画像を，CSS のカスタムプロパティから Blob URL にして img に設定する
+_bootstrap_script = """
+(function () {
+  var style = getComputedStyle(document.documentElement);
+  var urls = {};
+  document.querySelectorAll('img[ATTR]').forEach(function (img) {
+    var name = img.getAttribute('ATTR');
+    if (!urls[name]) {
+      var value = style.getPropertyValue(name).trim().replace(/^url\\(["']?/, '').replace(/["']?\\)$/, '');
+      urls[name] = fetch(value).then(function (r) { return r.blob(); }).then(URL.createObjectURL);
+    }
+    urls[name].then(function (url) { img.src = url; });
+  });
+})();
+""".replace('ATTR', ASSET_ATTRIBUTE)
+
+
+def _shareable(css: str):
+    """
+    url(data:...) が共有できる（@font-face の中や @import の参照ではない）かどうかを判定する関数を返す
+    """
+    font_faces = [m.span() for m in font_face_re.finditer(css)]
+
+    def shareable(m) -> bool:
+        if import_re.search(css, max(0, m.start() - 32), m.start()):
+            return False
+        return not any(start <= m.start() < end for start, end in font_faces)
+
+    return shareable
+
+
+def _css_targets(soup):
+    """
+    CSS を含む（タグ，属性名）を返す．属性名が None の場合はタグの文字列．
+    """
+    for tag in soup.find_all(True):
+        if tag.get('style'):
+            yield tag, 'style'
+        if tag.name == 'style' and tag.string:
+            yield tag, None
+
+
+def dedupe_assets(soup, min_length: int = 1024, keep_script: bool = True) -> dict:
+    """
+    複数回埋め込まれている data URI を一つにまとめる
+
+    2 回以上使われている min_length 文字以上の data URI を，head の先頭に置いた style の
+    カスタムプロパティ（:root { --webpage2html-asset-N: url("data:...") }）に一度だけ書き出す．
+    CSS からは var(--webpage2html-asset-N) で参照し，img は小さなスクリプトで Blob URL を設定する．
+    スクリプトを残さない場合は，img の src はそのままにして CSS の参照だけを共有する．
+
+    Args:
+        soup: 書き換え済みの BeautifulSoup
+        min_length (int): 共有する data URI の最小の長さ
+        keep_script (bool): img の共有に使うスクリプトを埋め込めるかどうか
+
+    Returns:
+        dict: assets（共有した data URI の数），references（置き換えた参照の数），bytes_saved（削減したバイト数）
+    """
+    counts = Counter()
+    images = [img for img in soup('img') if (img.get('src') or '').startswith('data:')] if keep_script else []
+    for img in images:
+        counts[img['src']] += 1
+    for tag, attr in _css_targets(soup):
+        css = tag[attr] if attr else tag.string
+        outside = _shareable(css)
+        counts.update(m.group(2) for m in css_data_url_re.finditer(css) if outside(m))
+
+    names = {}
+    for uri, count in counts.items():
+        if count >= 2 and len(uri) >= min_length:
+            names[uri] = f'--webpage2html-asset-{len(names) + 1}'
+    report = {'assets': len(names), 'references': 0, 'bytes_saved': 0}
+    if not names:
+        return report
+
+    def rewrite_css(css):
+        outside = _shareable(css)
+
+        def repl(m):
+            name = names.get(m.group(2))
+            if name is None or not outside(m):
+                return m.group(0)
+            replacement = f'var({name})'
+            report['references'] += 1
+            report['bytes_saved'] += len(m.group(0)) - len(replacement)
+            return replacement
+
+        return css_data_url_re.sub(repl, css)
+
+    for tag, attr in list(_css_targets(soup)):
+        if attr:
+            tag[attr] = rewrite_css(tag[attr])
+        else:
+            tag.string = rewrite_css(tag.string)
+
+    shared_images = False
+    for img in images:
+        name = names.get(img['src'])
+        if name is not None:
+            report['references'] += 1
+            report['bytes_saved'] += len(img['src']) - len(name) - len(ASSET_ATTRIBUTE)
+            img[ASSET_ATTRIBUTE] = name
+            del img['src']
+            shared_images = True
+
+    # 共有した data URI は一度だけ書き出す
+    declarations = ''.join(f'{name}:url("{uri}");' for uri, name in names.items())
+    style = soup.new_tag('style', id='webpage2html-assets')
+    style.string = f':root{{{declarations}}}'
+    (soup.head or soup.html or soup).insert(0, style)
+    report['bytes_saved'] -= len(style.string)
+    if shared_images:
+        script = soup.new_tag('script', id='webpage2html-assets-bootstrap')
+        script.string = _bootstrap_script
+        (soup.body or soup.html or soup).append(script)
+        report['bytes_saved'] -= len(_bootstrap_script)
+    return report
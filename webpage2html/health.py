@@ -0,0 +1,164 @@
+import random
+import threading
+import time
+from collections import Counter
+
+# 一時的なエラーを再試行する回数
+max_retries = 2
+# 再試行までの待ち時間（秒）．試行ごとに倍にし，backoff_max で打ち切る
+backoff_base = 0.5
+backoff_max = 8.0
+# 一時的なエラーとみなす HTTP のステータス
+retry_statuses = {429, 500, 502, 503, 504}
+# この回数続けて失敗したホストは，cooldown 秒の間は接続せずに諦める（サーキットブレーカー）
+failure_threshold = 5
+cooldown = 60.0
+
+
+def backoff_delay(attempt: int, retry_after: str = None) -> float:
+    """
+    attempt 回目（0 から）の再試行までの待ち時間．Retry-After が秒数なら，backoff_max までそれに従う．
+    """
+    if retry_after and retry_after.strip().isdigit():
+        return min(backoff_max, float(retry_after))
+    return min(backoff_max, backoff_base * 2 ** attempt) * random.uniform(0.5, 1.0)
+
+
+def _causes(error: BaseException) -> list:
+    """
+    例外と，その原因としてつながっている例外（args，reason，__cause__，__context__）のリスト
+    """
+    causes = []
+    stack = [error]
+    while stack:
+        error = stack.pop()
+        if not isinstance(error, BaseException) or any(error is cause for cause in causes):
+            continue
+        causes.append(error)
+        stack.extend(error.args)
+        stack.extend([getattr(error, 'reason', None), error.__cause__, error.__context__])
+    return causes
+
+
+def is_transient(error: BaseException) -> bool:
+    """
+    通信のエラーが一時的（再試行する価値がある）かどうか．接続・読み込みのタイムアウトと接続のリセットだけを再試行し，
+    証明書のエラーや名前解決の失敗，接続の拒否は何度試しても変わらないので再試行しない．
+    """
+    import requests
+
+    if isinstance(error, requests.exceptions.SSLError):
+        return False
+    if isinstance(error, requests.Timeout):
+        return True
+    return any(isinstance(cause, ConnectionResetError) for cause in _causes(error))
+
+
+class HostHealth(object):
+    """
+    1 つのホストの状態．state は 'closed'（通常），'open'（遮断中），'half-open'（試しに 1 回だけ通す）．
+    """
+
+    def __init__(self):
+        self.state = 'closed'
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.stats = Counter()
+        self.last_error = None
+
+
+class HostRegistry(object):
+    """
+    ホストごとの成功・失敗を記録し，失敗が続くホストへの接続を一定時間止める
+
+    プロセス内のすべてのページで共有するので，落ちている広告サーバや CDN のために
+    ページごとにタイムアウトを待つことがなくなる．
+    """
+
+    def __init__(self, threshold: int = None, cooldown_seconds: float = None):
+        self.threshold = threshold or failure_threshold
+        self.cooldown = cooldown if cooldown_seconds is None else cooldown_seconds
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def _get(self, host: str) -> HostHealth:
+        health = self._hosts.get(host)
+        if health is None:
+            health = self._hosts[host] = HostHealth()
+        return health
+
+    def allow(self, host: str) -> bool:
+        """
+        host に接続してよいかどうか．遮断中でも cooldown を過ぎていれば，1 回だけ試しに通す．
+        """
+        with self._lock:
+            health = self._get(host)
+            if health.state == 'closed':
+                return True
+            if time.monotonic() - health.opened_at >= self.cooldown:
+                health.state = 'half-open'
+                health.opened_at = time.monotonic()
+                return True
+            health.stats['skipped'] += 1
+            return False
+
+    def record_success(self, host: str, elapsed: float = 0.0) -> None:
+        with self._lock:
+            health = self._get(host)
+            health.state = 'closed'
+            health.consecutive_failures = 0
+            health.stats['success'] += 1
+            health.stats['elapsed_ms'] += int(elapsed * 1000)
+
+    def record_failure(self, host: str, error) -> None:
+        """
+        失敗を記録する．threshold 回続いたか，試しに通した接続が失敗した場合は遮断する．
+        """
+        with self._lock:
+            health = self._get(host)
+            health.consecutive_failures += 1
+            health.stats['failure'] += 1
+            health.last_error = str(error)
+            if health.state == 'half-open' or \
+                    (health.state == 'closed' and health.consecutive_failures >= self.threshold):
+                health.state = 'open'
+                health.opened_at = time.monotonic()
+                health.stats['opened'] += 1
+
+    def record_retry(self, host: str) -> None:
+        with self._lock:
+            self._get(host).stats['retry'] += 1
+
+    def report(self) -> dict:
+        """
+        ホストごとの状態と統計
+
+        Returns:
+            dict: ホストをキーとし，{'state', 'success', 'failure', 'retry', 'skipped', 'opened', 'elapsed_ms',
+                  'last_error'} を値とする辞書
+        """
+        with self._lock:
+            result = {}
+            for host, health in sorted(self._hosts.items()):
+                entry = {'state': health.state}
+                entry.update({key: health.stats[key]
+                              for key in ('success', 'failure', 'retry', 'skipped', 'opened', 'elapsed_ms')})
+                entry['last_error'] = health.last_error
+                result[host] = entry
+            return result
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_host_registry() -> HostRegistry:
+    """
+    プロセスで共有するホストの状態を取得する
+    """
+    global _registry
+
+    with _registry_lock:
+        if _registry is None:
+            _registry = HostRegistry()
+        return _registry
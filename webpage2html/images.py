@@ -0,0 +1,234 @@
+import io
+import re
+from collections import Counter
+
+# Pillow の Image モジュール．load_pillow() が最初に使う時に読み込む
+_pil_image = False
+
+# 縮小後の最大の幅と高さ（px）
+max_image_width = 1920
+max_image_height = 4096
+# JPEG / WebP の品質．max_image_bytes に収まらない場合は min_image_quality まで下げる
+image_quality = 82
+min_image_quality = 50
+# 1 枚の画像のバイト数の目安．超える場合は品質を下げ，さらに縮小する
+max_image_bytes = 512 * 1024
+
+# 先頭のバイト列と MIME タイプ
+_signatures = [
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+    (b'\x00\x00\x01\x00', 'image/x-icon'),
+    (b'BM', 'image/bmp'),
+    (b'wOFF', 'application/font-woff'),
+    (b'wOF2', 'application/font-woff2'),
+    (b'OTTO', 'application/x-font-opentype'),
+    (b'\x00\x01\x00\x00\x00', 'application/x-font-ttf'),
+]
+_svg_re = re.compile(rb'^\s*(<\?xml[^>]*>\s*)?(<!--.*?-->\s*)*(<!DOCTYPE svg[^>]*>\s*)?<svg[\s>]', re.I | re.S)
+_srcset_candidate_re = re.compile(r'\s*([^\s,][^\s]*[^\s,]|[^\s,])(?:\s+([^,]*))?\s*(?:,|$)')
+# sizes の 1 つの値．メディア条件は (min-width: Npx) と (max-width: Npx) だけを評価する
+_sizes_entry_re = re.compile(r'^\s*(?:\((.*)\)\s*)?([0-9.]+)(px|vw)\s*$')
+_media_width_re = re.compile(r'^\s*(min|max)-width\s*:\s*([0-9.]+)px\s*$')
+
+
+def load_pillow():
+    """
+    Pillow の Image モジュールを読み込む．Pillow がなければ，画像の再圧縮と縮小は行わないので None．
+    """
+    global _pil_image
+
+    if _pil_image is False:
+        try:
+            from PIL import Image
+        except ImportError:
+            Image = None
+        _pil_image = Image
+    return _pil_image
+
+
+def sniff_mime_type(data: bytes):
+    """
+    先頭のバイト列（マジックナンバー）から MIME タイプを調べる
+
+    Returns:
+        str: MIME タイプ．分からない場合は None
+    """
+    if not isinstance(data, bytes):
+        return None
+    for signature, mime in _signatures:
+        if data.startswith(signature):
+            return mime
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'image/webp'
+    if data[4:8] == b'ftyp' and data[8:12] in (b'avif', b'avis'):
+        return 'image/avif'
+    if _svg_re.match(data[:1024]):
+        return 'image/svg+xml'
+    return None
+
+
+def parse_srcset(srcset: str) -> list:
+    """
+    srcset 属性を解析する
+
+    Returns:
+        list: (URL, 'w' | 'x', 値) のリスト．記述子がない場合は 1x とする
+    """
+    candidates = []
+    for m in _srcset_candidate_re.finditer(srcset or ''):
+        if not m.group(1):
+            continue
+        src, descriptor = m.group(1), (m.group(2) or '').strip().lower()
+        try:
+            if descriptor.endswith('w'):
+                candidates.append((src, 'w', float(descriptor[:-1])))
+            elif descriptor.endswith('x'):
+                candidates.append((src, 'x', float(descriptor[:-1])))
+            elif not descriptor:
+                candidates.append((src, 'x', 1.0))
+        except ValueError:
+            continue
+    return candidates
+
+
+def slot_width(sizes: str, viewport_width: int) -> float:
+    """
+    sizes 属性から画像の表示幅（px）を求める．条件を満たす最初の値を使い，満たすものがなければ最後の値を使う．
+    評価できないメディア条件は満たさないものとする．
+    """
+    entries = []
+    for entry in (sizes or '').split(','):
+        m = _sizes_entry_re.match(entry)
+        if m:
+            value = float(m.group(2))
+            entries.append((m.group(1), value if m.group(3) == 'px' else viewport_width * value / 100))
+    for condition, width in entries:
+        if condition is None:
+            return width
+        m = _media_width_re.match(condition)
+        if not m:
+            continue
+        limit = float(m.group(2))
+        if (viewport_width >= limit) if m.group(1) == 'min' else (viewport_width <= limit):
+            return width
+    return entries[-1][1] if entries else viewport_width
+
+
+def choose_srcset_candidate(src: str, srcset: str, viewport_width: int, sizes: str = None,
+                            pixel_ratio: float = 1.0) -> str:
+    """
+    srcset の候補から，指定したビューポートで必要な解像度を満たす最小の画像を選ぶ．
+    満たすものがなければ最大のものを選ぶ．
+
+    Args:
+        src (str): src 属性（1x の候補として扱う）
+        srcset (str): srcset 属性
+        viewport_width (int): ビューポートの幅（px）
+        sizes (str): sizes 属性
+        pixel_ratio (float): デバイスピクセル比
+
+    Returns:
+        str: 選んだ画像の URL
+    """
+    candidates = parse_srcset(srcset)
+    if any(kind == 'w' for _, kind, _ in candidates):
+        width = slot_width(sizes, viewport_width)
+        # 幅の記述子は，表示幅に対する密度に換算する
+        densities = [(value / width if kind == 'w' else value, url) for url, kind, value in candidates]
+    else:
+        densities = [(value, url) for url, _, value in candidates]
+        if src and not any(value == 1.0 for value, _ in densities):
+            densities.append((1.0, src))
+    if not densities:
+        return src
+    densities.sort(key=lambda d: d[0])
+    for density, url in densities:
+        if density >= pixel_ratio:
+            return url
+    return densities[-1][1]
+
+
+class ImageOptimizer(object):
+    """
+    埋め込む前にラスタ画像を縮小・再圧縮する（Pillow が必要）
+
+    max_width / max_height を超える画像は縮小し，JPEG と WebP は quality で再圧縮する．
+    max_bytes を超える場合は min_quality まで品質を下げ，それでも超える場合は縮小を繰り返す．
+    元より小さくならなかった場合は元の画像をそのまま使う．アニメーション画像と SVG は変更しない．
+    """
+
+    formats = {'image/jpeg': 'JPEG', 'image/png': 'PNG', 'image/webp': 'WEBP'}
+
+    def __init__(self, max_width: int = None, max_height: int = None, quality: int = None,
+                 min_quality: int = None, max_bytes: int = None):
+        self.max_width = max_width or max_image_width
+        self.max_height = max_height or max_image_height
+        self.quality = quality or image_quality
+        self.min_quality = min_quality or min_image_quality
+        self.max_bytes = max_bytes or max_image_bytes
+        self.stats = Counter()
+
+    @staticmethod
+    def available() -> bool:
+        return load_pillow() is not None
+
+    def _encode(self, image, fmt: str, quality: int, icc_profile: bytes = None) -> bytes:
+        out = io.BytesIO()
+        params = {'optimize': True}
+        if fmt != 'PNG':
+            params['quality'] = quality
+        if icc_profile:
+            params['icc_profile'] = icc_profile
+        image.save(out, fmt, **params)
+        return out.getvalue()
+
+    def optimize(self, data: bytes, mime: str) -> tuple:
+        """
+        画像を縮小・再圧縮する
+
+        Args:
+            data (bytes): 画像
+            mime (str): MIME タイプ
+
+        Returns:
+            tuple: (画像, MIME タイプ)
+        """
+        fmt = self.formats.get(mime)
+        Image = load_pillow()
+        if Image is None or fmt is None or not isinstance(data, bytes):
+            return data, mime
+        try:
+            image = Image.open(io.BytesIO(data))
+            if getattr(image, 'is_animated', False):
+                return data, mime
+            image.load()
+            # 再エンコードで EXIF は残らないので，向きは画素に反映し，カラープロファイルは引き継ぐ
+            from PIL import ImageOps
+            icc_profile = image.info.get('icc_profile')
+            image = ImageOps.exif_transpose(image)
+            if fmt == 'JPEG' and image.mode not in ('RGB', 'L', 'CMYK'):
+                image = image.convert('RGB')
+            if image.width > self.max_width or image.height > self.max_height:
+                image.thumbnail((self.max_width, self.max_height), Image.LANCZOS)
+            quality = self.quality
+            result = self._encode(image, fmt, quality, icc_profile)
+            while len(result) > self.max_bytes:
+                if fmt != 'PNG' and quality > self.min_quality:
+                    quality = max(self.min_quality, quality - 10)
+                elif min(image.width, image.height) > 64:
+                    image = image.resize((image.width * 3 // 4, image.height * 3 // 4), Image.LANCZOS)
+                else:
+                    break
+                result = self._encode(image, fmt, quality, icc_profile)
+        except (OSError, ValueError, Image.DecompressionBombError):
+            return data, mime
+        self.stats['images'] += 1
+        self.stats['bytes_in'] += len(data)
+        if len(result) >= len(data):
+            self.stats['bytes_out'] += len(data)
+            return data, mime
+        self.stats['bytes_out'] += len(result)
+        return result, mime
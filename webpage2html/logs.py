@@ -0,0 +1,116 @@
+import contextvars
+import json
+import sys
+import threading
+import time
+
+DEBUG = 10
+INFO = 20
+WARN = 30
+ERROR = 40
+level_names = {DEBUG: 'DEBUG', INFO: 'INFO', WARN: 'WARN', ERROR: 'ERROR'}
+
+# これより低いレベルのイベントは，メッセージを組み立てずに捨てる
+log_level = INFO
+# 'text'（[ タグ ] メッセージ key=value）または 'json'（1 行に 1 つの JSON）
+log_format = 'text'
+# 出力先．None は標準エラー出力
+stream = None
+
+_write_lock = threading.Lock()
+# bind() で設定した，現在のスレッド（またはタスク）のイベントに付ける値
+_bound = contextvars.ContextVar('webpage2html_log_fields', default={})
+
+
+def configure(level=None, fmt: str = None) -> None:
+    """
+    出力するレベルと形式を設定する
+
+    Args:
+        level: DEBUG などの値，または 'debug'，'info'，'warn'，'error'
+        fmt (str): 'text' または 'json'
+    """
+    global log_level, log_format
+
+    if level is not None:
+        if isinstance(level, str):
+            names = {name.lower(): value for value, name in level_names.items()}
+            names['warning'] = WARN
+            if level.lower() not in names:
+                raise ValueError(f'unknown log level: {level}')
+            level = names[level.lower()]
+        log_level = level
+    if fmt is not None:
+        if fmt not in ('text', 'json'):
+            raise ValueError(f'unknown log format: {fmt}')
+        log_format = fmt
+
+
+def enabled(level: int) -> bool:
+    """
+    level のイベントを出力するかどうか．高価な値を用意する前に確かめる．
+    """
+    return level >= log_level
+
+
+def bind(**fields):
+    """
+    以降のイベント（json の場合）に fields を付ける
+
+    Returns:
+        unbind() に渡すトークン
+    """
+    return _bound.set({**_bound.get(), **fields})
+
+
+def unbind(token) -> None:
+    _bound.reset(token)
+
+
+def write(line: str, end: str = '\n') -> None:
+    """
+    1 行を出力する．複数のスレッドの行が混ざらないよう，まとめて書き込む．
+    """
+    out = stream or sys.stderr
+    with _write_lock:
+        out.write(line + end)
+
+
+def event(level: int, tag: str, msg: str = '', *args, **fields) -> None:
+    """
+    イベントを出力する．level が log_level より低い場合は，msg % args の書式化もしない．
+
+    Args:
+        level (int): DEBUG，INFO，WARN，ERROR
+        tag (str): イベントの種類（'GET'，'CACHE HIT' など）
+        msg (str): メッセージ．args がある場合は % で書式化する
+        fields: 付加する値．text では key=value，json ではキーとして出力する
+    """
+    if level < log_level:
+        return
+    if args:
+        msg = msg % args
+    if log_format == 'json':
+        record = {'time': round(time.time(), 3), 'level': level_names.get(level, str(level)), 'tag': tag, 'msg': msg}
+        record.update(_bound.get())
+        record.update(fields)
+        write(json.dumps(record, ensure_ascii=False, default=str))
+    else:
+        extra = ''.join(f' {key}={value}' for key, value in fields.items())
+        write(f'[ {tag} ] {msg}{extra}')
+
+
+def debug(tag: str, msg: str = '', *args, **fields) -> None:
+    event(DEBUG, tag, msg, *args, **fields)
+
+
+def info(tag: str, msg: str = '', *args, **fields) -> None:
+    event(INFO, tag, msg, *args, **fields)
+
+
+def warn(tag: str, msg: str = '', *args, **fields) -> None:
+    event(WARN, tag, msg, *args, **fields)
+
+
+def error(tag: str, msg: str = '', *args, **fields) -> None:
+    event(ERROR, tag, msg, *args, **fields)
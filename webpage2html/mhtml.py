@@ -0,0 +1,99 @@
+import io
+import shutil
+import tempfile
+import threading
+import uuid
+from collections import Counter
+from email.header import Header
+from email.utils import formatdate
+
+output_formats = ('html', 'mhtml')
+
+
+class MHTMLWriter(object):
+    """
+    1 ページを MHTML（multipart/related）で書き出す
+
+    ページのアセットは data URI にせず，add_part() で元の URL（Content-Location）ごとのパートにする．
+    パートは受け取った順に一時ファイルへ書き出し，write() でルートの HTML の後に続けるので，
+    大きなページでもアセットをメモリに持たない．本体は base64 にせず，Content-Transfer-Encoding: binary で保存する．
+    """
+
+    def __init__(self, tmp_dir: str = None):
+        """
+        Args:
+            tmp_dir (str): パートを書き出す一時ファイルのディレクトリ
+        """
+        self.boundary = f'----=_webpage2html_{uuid.uuid4().hex}'
+        self._boundary_bytes = f'--{self.boundary}'.encode('ascii')
+        self._spool = tempfile.TemporaryFile(dir=tmp_dir)
+        self._locations = {}
+        self._lock = threading.Lock()
+        # parts: パートの数，bytes: パートの本体のバイト数
+        self.stats = Counter(parts=0, bytes=0)
+
+    def _part_header(self, content_type: str, location: str) -> bytes:
+        return (f'{self._boundary_bytes.decode("ascii")}\r\n'
+                f'Content-Type: {content_type}\r\n'
+                f'Content-Transfer-Encoding: binary\r\n'
+                f'Content-Location: {location}\r\n\r\n').encode('utf-8')
+
+    def add_part(self, location: str, content_type: str, data: bytes) -> str:
+        """
+        アセットをパートとして追加する．同じ URL のパートは一度だけ書く．
+
+        Returns:
+            str: HTML から参照する URL（location）
+
+        Raises:
+            ValueError: 本体に区切りの文字列が含まれている場合
+        """
+        with self._lock:
+            if location in self._locations:
+                return location
+            if self._boundary_bytes in data:
+                raise ValueError(f'MIME boundary found in {location}')
+            self._spool.write(self._part_header(content_type, location))
+            self._spool.write(data)
+            self._spool.write(b'\r\n')
+            self._locations[location] = content_type
+            self.stats['parts'] += 1
+            self.stats['bytes'] += len(data)
+        return location
+
+    def __contains__(self, location: str) -> bool:
+        return location in self._locations
+
+    def write(self, out, location: str, write_html, title: str = '') -> None:
+        """
+        MHTML 全体を書く
+
+        Args:
+            out: バイナリのファイル
+            location (str): ページの URL
+            write_html: write_html(f)．テキストのファイル f にルートの HTML を書く関数
+            title (str): ページのタイトル（Subject）
+        """
+        header = (f'From: <Saved by webpage2html>\r\n'
+                  f'Snapshot-Content-Location: {location}\r\n'
+                  f'Subject: {Header(title or "").encode()}\r\n'
+                  f'Date: {formatdate(localtime=True)}\r\n'
+                  f'MIME-Version: 1.0\r\n'
+                  f'Content-Type: multipart/related;\r\n'
+                  f'\ttype="text/html";\r\n'
+                  f'\tboundary="{self.boundary}"\r\n\r\n')
+        out.write(header.encode('utf-8'))
+        out.write(self._part_header('text/html; charset="utf-8"', location))
+        text = io.TextIOWrapper(out, encoding='utf-8', newline='', write_through=True)
+        try:
+            write_html(text)
+            text.flush()
+        finally:
+            text.detach()
+        out.write(b'\r\n')
+        self._spool.seek(0)
+        shutil.copyfileobj(self._spool, out, 1024 * 1024)
+        out.write(self._boundary_bytes + b'--\r\n')
+
+    def close(self) -> None:
+        self._spool.close()
@@ -0,0 +1,51 @@
+import re
+
+render_modes = ('always-browser', 'never-browser', 'auto')
+# 本文の文字数がこれより少なく，script がある場合は，JavaScript で描画するページとみなす
+min_text_chars = 200
+
+script_re = re.compile(r'<script\b', re.I)
+# 本文の文字数を数える前に取り除く部分
+invisible_re = re.compile(r'<(script|style|noscript|template)\b.*?</\1\s*>|<!--.*?-->', re.I | re.S)
+tag_re = re.compile(r'<[^>]*>')
+body_re = re.compile(r'<body\b[^>]*>(.*)', re.I | re.S)
+# SPA のフレームワークが描画する，空のルート要素
+spa_root_re = re.compile(r'<(div|main)\b[^>]*\bid=["\']?(root|app|__next|__nuxt|___gatsby|svelte)["\']?[^>]*>'
+                         r'\s*</\1\s*>|<app-root\b[^>]*>\s*</app-root\s*>', re.I)
+# テンプレートをブラウザで展開する AngularJS
+spa_marker_re = re.compile(r'<[^>]+\bng-app\b', re.I)
+noscript_re = re.compile(r'<noscript\b[^>]*>(.*?)</noscript\s*>', re.I | re.S)
+# noscript の中の「JavaScript を有効にしてください」のような案内
+noscript_gate_re = re.compile(r'(enable|turn on|requires?|need)\b.{0,40}javascript|javascript\b.{0,40}'
+                              r'(enable|required|disabled)|javascript\s*を?有効|javascript\s*が?必要', re.I | re.S)
+
+
+def visible_text_length(html_doc: str) -> int:
+    """
+    body の中の，script，style，noscript とタグを除いた文字数
+    """
+    m = body_re.search(html_doc)
+    text = invisible_re.sub(' ', m.group(1) if m else html_doc)
+    return len(''.join(tag_re.sub(' ', text).split()))
+
+
+def needs_browser(html_doc: str):
+    """
+    HTTP で取得した HTML が，ブラウザで JavaScript を実行しないと中身が揃わないページかどうかを推測する
+
+    Returns:
+        str: ブラウザが必要な理由（'empty_document'，'spa_root'，'noscript_gate'，'little_text'）．
+             静的な HTML で足りる場合は None
+    """
+    if not html_doc or not html_doc.strip():
+        return 'empty_document'
+    if not script_re.search(html_doc):
+        return None
+    if spa_root_re.search(html_doc) or spa_marker_re.search(html_doc):
+        return 'spa_root'
+    for content in noscript_re.findall(html_doc):
+        if noscript_gate_re.search(tag_re.sub(' ', content)):
+            return 'noscript_gate'
+    if visible_text_length(html_doc) < min_text_chars:
+        return 'little_text'
+    return None
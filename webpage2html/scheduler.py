@@ -0,0 +1,223 @@
+import heapq
+import json
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, wait
+from urllib.parse import urlparse
+
+# ホストごとに同時に取得するページの数
+max_per_host = 2
+# 同じホストのページを取り始める間隔（秒）
+host_delay = 1.0
+# 失敗したページを取り直す回数（最初の 1 回を含む）
+max_attempts = 2
+# 進捗を出力する間隔（秒）
+progress_interval = 30.0
+
+
+class CrawlScheduler(object):
+    """
+    ページの取得を，優先度の順に，全体とホストごとの同時実行数を守って executor に投入する
+
+    状態（未処理，完了，失敗）は state_path の JSON にページごとに書き出すので，
+    途中で止まった場合も，同じ state_path で実行し直せば残りのページから再開できる．
+    """
+
+    def __init__(self, executor, task, workers: int, per_host: int = None, delay: float = None,
+                 state_path: str = None, log=None, attempts: int = None):
+        """
+        Args:
+            executor: concurrent.futures の Executor
+            task: task(url) -> 結果．executor で実行する関数．False を返した場合は取得を省略したとみなす
+            workers (int): 同時に実行するページの数
+            per_host (int): ホストごとに同時に実行するページの数
+            delay (float): 同じホストのページを取り始める間隔（秒）
+            state_path (str): 状態を保存する JSON のパス
+            log: log(str)．進捗を出力する
+            attempts (int): 失敗したページを取り直す回数（最初の 1 回を含む）
+        """
+        self.executor = executor
+        self.task = task
+        self.workers = workers
+        self.per_host = per_host or max_per_host
+        self.delay = host_delay if delay is None else delay
+        self.state_path = state_path
+        self.log = log
+        self.attempts = attempts or max_attempts
+        self._queue = []
+        self._seq = 0
+        self._priorities = {}
+        self._tries = {}
+        self._running = {}
+        self._host_running = {}
+        self._host_started = {}
+        self.done = []
+        self.skipped = []
+        self.failed = []
+        self.started_at = None
+        self._finished_in_run = 0
+        if state_path and os.path.exists(state_path):
+            self._load()
+
+    @staticmethod
+    def host(url: str) -> str:
+        return urlparse(url).netloc.lower()
+
+    def add(self, url: str, priority: int = 0) -> None:
+        """
+        ページを追加する．priority が大きいものから取得する．完了，省略，失敗したページは追加しない．
+        """
+        if url in self._priorities or url in self.done or url in self.skipped \
+                or any(entry['url'] == url for entry in self.failed):
+            return
+        self._priorities[url] = priority
+        self._push(url, priority)
+
+    def _push(self, url: str, priority: int) -> None:
+        heapq.heappush(self._queue, (-priority, self._seq, url))
+        self._seq += 1
+
+    def _load(self) -> None:
+        with open(self.state_path) as f:
+            state = json.load(f)
+        self.done = state.get('done', [])
+        self.skipped = state.get('skipped', [])
+        # 取り直す回数を使い切ったページは，再開しても取り直さない
+        self.failed = state.get('failed', [])
+        # 実行中だったページも，もう一度取得する
+        for entry in state.get('pending', []):
+            self.add(entry['url'], entry.get('priority', 0))
+        if self.log:
+            self.log(f"[ INFO ] resume: {len(self.done)} done, {len(self.failed)} failed, "
+                     f"{len(self._priorities)} pending - {self.state_path}")
+
+    def save(self) -> None:
+        """
+        状態を JSON に書き出す．書きかけのファイルが残らないよう，一時ファイルから置き換える．
+        """
+        if not self.state_path:
+            return
+        state = {
+            'pending': [{'url': url, 'priority': priority} for url, priority in self._priorities.items()],
+            'done': self.done,
+            'skipped': self.skipped,
+            'failed': self.failed,
+            'stats': self.stats(),
+        }
+        tmp_path = f'{self.state_path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.state_path)
+
+    def stats(self) -> dict:
+        """
+        Returns:
+            dict: done，skipped，failed，pending（ページ数），elapsed（秒），pages_per_min（この実行での取得の速さ）
+        """
+        elapsed = time.monotonic() - self.started_at if self.started_at else 0.0
+        finished = self._finished_in_run
+        return {
+            'done': len(self.done),
+            'skipped': len(self.skipped),
+            'failed': len(self.failed),
+            'pending': len(self._priorities),
+            'elapsed': round(elapsed, 1),
+            'pages_per_min': round(finished / elapsed * 60, 2) if elapsed > 0 else 0.0,
+        }
+
+    def _wait_time(self, url: str, now: float):
+        """
+        Returns:
+            float: ページを投入できるまでの秒数（0 は今すぐ）．ホストの同時実行数が上限の場合は None
+        """
+        host = self.host(url)
+        if self._host_running.get(host, 0) >= self.per_host:
+            return None
+        return max(0.0, self._host_started.get(host, -self.delay) + self.delay - now)
+
+    def _start_ready(self) -> float:
+        """
+        投入できるページを優先度の順に投入する
+
+        Returns:
+            float: ホストの間隔を待っているページがある場合，次に投入できるまでの秒数
+        """
+        now = time.monotonic()
+        waiting = []
+        next_start = None
+        while self._queue and len(self._running) < self.workers:
+            entry = heapq.heappop(self._queue)
+            url = entry[2]
+            wait_time = self._wait_time(url, now)
+            if wait_time is None or wait_time > 0:
+                waiting.append(entry)
+                if wait_time is not None:
+                    next_start = wait_time if next_start is None else min(next_start, wait_time)
+                continue
+            host = self.host(url)
+            self._host_running[host] = self._host_running.get(host, 0) + 1
+            self._host_started[host] = now
+            self._tries[url] = self._tries.get(url, 0) + 1
+            self._running[self.executor.submit(self.task, url)] = url
+        for entry in waiting:
+            heapq.heappush(self._queue, entry)
+        return next_start
+
+    def _finish(self, future) -> None:
+        url = self._running.pop(future)
+        host = self.host(url)
+        self._host_running[host] -= 1
+        try:
+            result = future.result()
+        except Exception as ex:
+            if self._tries[url] < self.attempts:
+                if self.log:
+                    self.log(f"[ WARN ] failed ({ex}), will retry - {url}")
+                # 取り直すページは，同じ優先度の他のページの後に回す
+                self._push(url, self._priorities[url])
+                return
+            if self.log:
+                self.log(f"[ ERROR ] failed ({ex}) - {url}")
+            self.failed.append({'url': url, 'error': str(ex)})
+        else:
+            (self.skipped if result is False else self.done).append(url)
+            self._finished_in_run += 1
+        del self._priorities[url]
+        self.save()
+
+    def _progress(self) -> None:
+        if not self.log:
+            return
+        stats = self.stats()
+        total = stats['done'] + stats['skipped'] + stats['failed'] + stats['pending']
+        self.log(f"[ PROGRESS ] {total - stats['pending']}/{total} pages "
+                 f"(failed {stats['failed']}, running {len(self._running)}), "
+                 f"{stats['pages_per_min']} pages/min")
+
+    def run(self) -> dict:
+        """
+        すべてのページを取得する
+
+        Returns:
+            dict: stats() の値
+        """
+        self.started_at = time.monotonic()
+        self._finished_in_run = 0
+        last_progress = self.started_at
+        while self._queue or self._running:
+            next_start = self._start_ready()
+            if not self._running:
+                # ホストの間隔を待っているページしかない
+                time.sleep(next_start or 0)
+                continue
+            # 長いページの間も，progress_interval ごとに進捗を出力する
+            done, _ = wait(list(self._running), timeout=min(next_start or progress_interval, progress_interval),
+                           return_when=FIRST_COMPLETED)
+            for future in done:
+                self._finish(future)
+            if time.monotonic() - last_progress >= progress_interval:
+                self._progress()
+                last_progress = time.monotonic()
+        self._progress()
+        self.save()
+        return self.stats()
@@ -0,0 +1,84 @@
+import re
+
+from bs4.element import AttributeValueWithCharsetSubstitution, NavigableString, Tag
+from bs4.formatter import HTMLFormatter
+
+data_url_re = re.compile(r'url\s*\((data:.+?)\)')
+
+
+def fix_data_urls(text: str) -> str:
+    """
+    CSS の url(data:...) を補正する
+
+    MIME image/jpeg が image/jpg になるので置換し，URL（STR）をクオートで囲む．
+    """
+    if 'url' not in text:
+        return text
+    # MIME image/jpeg が image/jpg になるので置換する
+    text = text.replace("url(data:image/jpg;base64,", "url(data:image/jpeg;base64,")
+    # CSS の URL（STR） をクオートで囲む
+    return data_url_re.sub(r'url("\1")', text)
+
+
+def start_tag(tag: Tag, formatter: HTMLFormatter) -> str:
+    """
+    開始タグを文字列にする．属性の値は，書き出す時に fix_data_urls で補正する．
+    """
+    attrs = []
+    for key, val in formatter.attributes(tag):
+        if val is None:
+            attrs.append(key)
+            continue
+        if isinstance(val, (list, tuple)):
+            val = ' '.join(val)
+        elif not isinstance(val, str):
+            val = str(val)
+        elif isinstance(val, AttributeValueWithCharsetSubstitution):
+            # <meta charset> などは出力の文字コード（UTF-8）に置き換える
+            if hasattr(val, 'substitute_encoding'):
+                val = val.substitute_encoding('utf-8')
+            else:
+                val = val.encode('utf-8')
+        text = formatter.attribute_value(fix_data_urls(val))
+        attrs.append(f'{key}={formatter.quoted_attribute_value(text)}')
+    prefix = f'{tag.prefix}:' if tag.prefix else ''
+    attribute_string = ' ' + ' '.join(attrs) if attrs else ''
+    close = (formatter.void_element_close_prefix or '') if tag.is_empty_element else ''
+    return f'<{prefix}{tag.name}{attribute_string}{close}>'
+
+
+def end_tag(tag: Tag) -> str:
+    prefix = f'{tag.prefix}:' if tag.prefix else ''
+    return f'</{prefix}{tag.name}>'
+
+
+def write_document(soup, out, formatter: str = 'html5') -> None:
+    """
+    DOM をファイルに少しずつ書き出す
+
+    soup.decode() と同じ HTML を，文書全体の文字列を作らずに out.write() する．
+    書き出すたびに url(data:...) の補正を行うので，文書全体への置換も不要になる．
+
+    Args:
+        soup: BeautifulSoup または Tag
+        out: write() を持つテキストのストリーム
+        formatter (str): BeautifulSoup のフォーマッタの名前
+    """
+    formatter = HTMLFormatter.REGISTRY[formatter]
+    # 再帰を避けるため，（要素，閉じタグかどうか）のスタックで辿る
+    stack = [(soup, False)]
+    while stack:
+        node, closing = stack.pop()
+        if closing:
+            out.write(end_tag(node))
+        elif isinstance(node, Tag):
+            if node.hidden:
+                stack.extend((child, False) for child in reversed(node.contents))
+            elif node.is_empty_element:
+                out.write(start_tag(node, formatter))
+            else:
+                out.write(start_tag(node, formatter))
+                stack.append((node, True))
+                stack.extend((child, False) for child in reversed(node.contents))
+        elif isinstance(node, NavigableString):
+            out.write(fix_data_urls(node.output_ready(formatter)))
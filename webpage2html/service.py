@@ -1,21 +1,74 @@
-from joblib import Parallel, delayed
-from random import sample
-from .webpage2html import short_cut
+import hashlib
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
 
+from .browser import configure_browser_pool
+from .scheduler import CrawlScheduler
+from .session import configure_session
+from .webpage2html import download_dir, log, short_cut
 
-def get_urls(urls):
+
+def _configure_worker(browsers_per_worker: int, pages_per_browser: int, connections_per_host: int = None) -> None:
+    configure_browser_pool(size=browsers_per_worker, max_pages=pages_per_browser)
+    configure_session(maxsize=connections_per_host)
+
+
+def get_urls(urls, n_jobs: int = -1, browsers_per_worker: int = 1, pages_per_browser: int = 50,
+             per_host: int = None, state_path: str = None, threads: bool = False,
+             render_mode: str = 'always-browser', storage: str = None, output_format: str = 'html',
+             connections_per_host: int = None):
     """
     並列処理
 
+    ワーカのプロセスは使い回されるので，各ワーカのブラウザプールもすべての URL で共有される．
+    threads の場合は，1 つのプロセスのスレッドでページを処理し，キャッシュやブラウザプールを全体で共有する．
+    ページは CrawlScheduler が優先度の順に，同じホストへの同時アクセスを制限しながら投入する．
+    状態は state_path に保存されるので，中断しても同じ引数で実行し直せば続きから再開する．
+    すべてのページを処理し終えたら，状態のファイルは削除する．
+
     Args:
-        urls:
+        urls: URL のリスト，(URL, 優先度) のリスト，または URL をキーとし優先度を値とする辞書．
+              優先度が大きいものから取得する
+        n_jobs: ワーカのプロセス（threads の場合はスレッド）の数．-1 は CPU の数
+        browsers_per_worker: ワーカごとに起動しておくブラウザの数
+        pages_per_browser: ブラウザを起動し直すまでのページ数
+        per_host: ホストごとに同時に取得するページの数
+        state_path: 状態を保存する JSON のパス．省略時は URL の集合ごとに download/scheduler/ に作る
+        threads: プロセスではなくスレッドで並列に処理する
+        render_mode: 'always-browser'，'never-browser'，'auto'（webpage2html.get_page_html を参照）
+        storage: スナップショットの保存形式．'plain'，'gzip'，'zstd'，'pack'（storage.open_storage を参照）
+        output_format: 'html' または 'mhtml'（webpage2html.generate を参照）
+        connections_per_host: ワーカごとの，アセットを取得するホストごとの同時接続数（session.pool_maxsize）
 
     Returns:
-
+        dict: 完了・失敗したページ数と，取得の速さ（pages_per_min）
     """
+    workers = os.cpu_count() if n_jobs is None or n_jobs < 1 else n_jobs
+    if isinstance(urls, dict):
+        urls = list(urls.items())
+    urls = [entry if isinstance(entry, (tuple, list)) else (entry, 0) for entry in urls]
+    if state_path is None:
+        batch_id = hashlib.sha1('\n'.join(sorted(url for url, _ in urls)).encode()).hexdigest()[:16]
+        os.makedirs(f"{download_dir}/scheduler", exist_ok=True)
+        state_path = f"{download_dir}/scheduler/{batch_id}.json"
 
-    def _process(url):
-        return short_cut(url)
-
-    target_urls = sample(urls, len(urls))
-    r = Parallel(n_jobs=-1)([delayed(_process)(url) for url in target_urls])
+    if threads:
+        # ブラウザプールはプロセスで 1 つなので，すべてのスレッドの分を起動できるようにする
+        _configure_worker(workers * browsers_per_worker, pages_per_browser, connections_per_host)
+        executor = ThreadPoolExecutor(max_workers=workers)
+    else:
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=_configure_worker,
+                                       initargs=(browsers_per_worker, pages_per_browser, connections_per_host))
+    with executor:
+        scheduler = CrawlScheduler(executor, partial(short_cut, render_mode=render_mode, storage=storage,
+                                                     output_format=output_format), workers=workers,
+                                   per_host=per_host, state_path=state_path, log=log)
+        for url, priority in urls:
+            scheduler.add(url, priority)
+        stats = scheduler.run()
+    if stats['pending'] == 0 and os.path.exists(state_path):
+        os.remove(state_path)
+    log(f"[ INFO ] {stats['done']} pages done, {stats['skipped']} skipped, {stats['failed']} failed "
+        f"in {stats['elapsed']}s ({stats['pages_per_min']} pages/min)")
+    return stats
@@ -0,0 +1,71 @@
+import threading
+
+# 接続を保持するホストの数
+pool_connections = 32
+# ホストごとの同時接続数の上限（ブラウザと同じく 6）
+pool_maxsize = 6
+default_headers = {
+    "accept": "image/webp,image/*,*/*;q=0.8",
+    "accept-language": "ja,en-US;q=0.9,en;q=0.8",
+}
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def configure_session(connections: int = None, maxsize: int = None, headers: dict = None) -> None:
+    """
+    共有セッションの設定を変更する．次の get_session() から反映される．
+    認証情報はすべてのホストに送られてしまうので，セッションには設定しない（get_contents の username / password）．
+
+    Args:
+        connections (int): 接続を保持するホストの数
+        maxsize (int): ホストごとの同時接続数の上限
+        headers (dict): すべてのリクエストに付けるヘッダ
+    """
+    global pool_connections
+    global pool_maxsize
+
+    if connections:
+        pool_connections = connections
+    if maxsize:
+        pool_maxsize = maxsize
+    if headers:
+        default_headers.update(headers)
+    close_session()
+
+
+def get_session():
+    """
+    keep-alive で接続を使い回す共有セッション（requests.Session）を取得する
+
+    ホストごとの接続数が pool_maxsize に達すると，空くまで待つ．
+    requests は最初に呼んだ時に読み込む．
+    """
+    global _session
+
+    with _session_lock:
+        if _session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize,
+                                  pool_block=True)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            session.headers.update(default_headers)
+            _session = session
+        return _session
+
+
+def close_session() -> None:
+    """
+    共有セッションを閉じ，保持している接続を解放する
+    """
+    global _session
+
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+            _session = None
@@ -0,0 +1,284 @@
+import base64
+import gzip
+import hashlib
+import io
+import os
+import re
+import shutil
+import tempfile
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+
+storage_formats = ('plain', 'gzip', 'zstd', 'pack')
+gzip_level = 6
+zstd_level = 10
+# pack で，これより短い data URI（base64 の文字数）は HTML に残す
+min_object_chars = 1024
+
+# data URI のメディアタイプ（;charset=utf-8 などのパラメータを含む）
+_media_type = r'[^;,"\'\s()<>]*(?:;[^;,"\'\s()<>=]+=[^;,"\'\s()<>]*)*'
+data_uri_re = re.compile(rf'data:({_media_type});base64,([A-Za-z0-9+/]+={{0,2}})')
+# pack の HTML で，objects/ に保存したアセットを指す参照
+object_ref_re = re.compile(rf'data:({_media_type});webpage2html-object,([0-9a-f]{{64}})')
+# 圧縮して保存するアセットの MIME タイプ（画像やフォントは圧縮済みなので，そのまま保存する）
+textual_mime_re = re.compile(r'^(text/|image/svg|application/(javascript|json|xml|x-javascript))', re.I)
+
+# zstandard モジュール．load_zstandard() が最初に使う時に読み込む
+_zstandard = False
+
+
+def load_zstandard():
+    """
+    zstandard を読み込む．インストールされていなければ None．
+    """
+    global _zstandard
+
+    if _zstandard is False:
+        try:
+            import zstandard
+        except ImportError:
+            zstandard = None
+        _zstandard = zstandard
+    return _zstandard
+
+
+def compress(data: bytes, codec: str) -> bytes:
+    """
+    codec（''，'gz'，'zst'）で圧縮する
+    """
+    if codec == 'gz':
+        return gzip.compress(data, compresslevel=gzip_level)
+    if codec == 'zst':
+        return load_zstandard().ZstdCompressor(level=zstd_level).compress(data)
+    return data
+
+
+def decompress(data: bytes, codec: str) -> bytes:
+    if codec == 'gz':
+        return gzip.decompress(data)
+    if codec == 'zst':
+        return load_zstandard().ZstdDecompressor().decompressobj().decompress(data)
+    return data
+
+
+def codec_of(path) -> str:
+    """
+    ファイル名の拡張子から codec を求める
+    """
+    suffix = Path(path).suffix
+    return {'.gz': 'gz', '.zst': 'zst'}.get(suffix, '')
+
+
+class SnapshotStorage(object):
+    """
+    スナップショットの HTML を root/html に保存する（format='plain' は従来通りの非圧縮の .html）
+
+    codec を指定したサブクラスは，HTML を少しずつ圧縮しながら書き出す．
+    書き込みは一時ファイルからの rename で行うので，書きかけのファイルは残らない．
+    """
+
+    format = 'plain'
+    suffix = '.html'
+    codec = ''
+
+    def __init__(self, root: str):
+        self.root = Path(root)
+        self.html_dir = self.root / 'html'
+        self.tmp_dir = self.root / 'tmp'
+        for path in (self.html_dir, self.tmp_dir):
+            path.mkdir(parents=True, exist_ok=True)
+        self.stats = Counter()
+
+    def path(self, name: str) -> Path:
+        return self.html_dir / f'{name}{self.suffix}'
+
+    @contextmanager
+    def _atomic(self, path: Path):
+        """
+        一時ファイルのパスを渡し，with を抜けたら path に置き換える
+        """
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=str(self.tmp_dir))
+        os.close(fd)
+        try:
+            yield tmp
+            os.replace(tmp, str(path))
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+    def _open_text(self, path: str):
+        if self.codec == 'gz':
+            return gzip.open(path, 'wt', encoding='utf-8', compresslevel=gzip_level)
+        if self.codec == 'zst':
+            writer = load_zstandard().ZstdCompressor(level=zstd_level).stream_writer(open(path, 'wb'))
+            return io.TextIOWrapper(writer, encoding='utf-8')
+        return open(path, 'w', encoding='utf-8', buffering=1024 * 1024)
+
+    def save(self, name: str, write) -> dict:
+        """
+        write(f) が f に書いた HTML を保存する
+
+        Args:
+            name (str): スナップショットの名前（{site_id}_{取得時刻}）
+            write: write(f)．テキストのファイルに HTML を書く関数
+
+        Returns:
+            dict: format，path（保存したファイル），bytes（ファイルのバイト数）
+        """
+        path = self.path(name)
+        with self._atomic(path) as tmp:
+            with self._open_text(tmp) as f:
+                write(f)
+        size = path.stat().st_size
+        self.stats['bytes_written'] += size
+        return {'format': self.format, 'path': str(path), 'bytes': size}
+
+
+class GzipStorage(SnapshotStorage):
+    format = 'gzip'
+    suffix = '.html.gz'
+    codec = 'gz'
+
+
+class ZstdStorage(SnapshotStorage):
+    """
+    zstandard で圧縮する．zstandard のインストールが必要
+    """
+
+    format = 'zstd'
+    suffix = '.html.zst'
+    codec = 'zst'
+
+
+class PackStorage(SnapshotStorage):
+    """
+    埋め込んだアセットを，スナップショットをまたいで一度だけ保存する
+
+    HTML の data URI（base64）の本体を root/objects に SHA-256 の名前で保存し，HTML には参照だけを残す．
+    同じサイトを繰り返し取得しても，変わらないフォントや画像は書き込まない．
+    HTML（と文字のアセット）は zstandard があれば zstd で，なければ gzip で圧縮する．
+    load_snapshot() は参照を data URI に戻して元の HTML を返す．
+    data URI を置き換えるため，他の形式と違って HTML 全体（と置き換えた後の HTML）をメモリに持つ．
+    """
+
+    format = 'pack'
+
+    def __init__(self, root: str):
+        super().__init__(root)
+        self.codec = 'zst' if load_zstandard() is not None else 'gz'
+        self.suffix = f'.pack.{self.codec}'
+        self.objects_dir = self.root / 'objects'
+        self.objects_dir.mkdir(parents=True, exist_ok=True)
+
+    def _object_path(self, digest: str, mime: str) -> Path:
+        codec = self.codec if textual_mime_re.match(mime) else ''
+        return self.objects_dir / digest[:2] / (f'{digest}.{codec}' if codec else digest)
+
+    def _store(self, match, counts: Counter) -> str:
+        mime, payload = match.groups()
+        if len(payload) < min_object_chars:
+            return match.group(0)
+        data = base64.b64decode(payload)
+        # 元の文字列に戻せない（正規形でない）base64 はそのまま残す
+        if base64.b64encode(data).decode('ascii') != payload:
+            return match.group(0)
+        digest = hashlib.sha256(data).hexdigest()
+        counts['objects'] += 1
+        if find_object(self.objects_dir, digest) is None:
+            path = self._object_path(digest, mime)
+            body = compress(data, codec_of(path))
+            with self._atomic(path) as tmp:
+                with open(tmp, 'wb') as f:
+                    f.write(body)
+            counts['objects_written'] += 1
+            counts['bytes'] += len(body)
+        return f'data:{mime};webpage2html-object,{digest}'
+
+    def save(self, name: str, write) -> dict:
+        """
+        Returns:
+            dict: format，path，bytes（HTML と新しく書いたアセットのバイト数），
+                  objects（参照にしたアセットの数），objects_written（そのうち新しく書いたもの）
+        """
+        buffer = io.StringIO()
+        write(buffer)
+        counts = Counter()
+        skeleton = data_uri_re.sub(lambda m: self._store(m, counts), buffer.getvalue())
+        path = self.path(name)
+        with self._atomic(path) as tmp:
+            with open(tmp, 'wb') as f:
+                f.write(compress(skeleton.encode('utf-8'), self.codec))
+        size = path.stat().st_size + counts['bytes']
+        self.stats['bytes_written'] += size
+        self.stats['objects'] += counts['objects']
+        self.stats['objects_written'] += counts['objects_written']
+        return {'format': self.format, 'path': str(path), 'bytes': size, 'objects': counts['objects'],
+                'objects_written': counts['objects_written']}
+
+
+def open_storage(root: str, fmt: str = 'plain') -> SnapshotStorage:
+    """
+    Args:
+        root (str): ダウンロードのディレクトリ
+        fmt (str): 'plain'，'gzip'，'zstd'，'pack'
+    """
+    storages = {'plain': SnapshotStorage, 'gzip': GzipStorage, 'zstd': ZstdStorage, 'pack': PackStorage}
+    if fmt not in storages:
+        raise ValueError(f'unknown storage format: {fmt}')
+    if fmt == 'zstd' and load_zstandard() is None:
+        raise ImportError('zstandard is not installed')
+    return storages[fmt](root)
+
+
+def find_object(objects_dir: Path, digest: str):
+    """
+    objects/ のアセットのパス（圧縮の有無によらない）．ない場合は None
+    """
+    for name in (digest, f'{digest}.gz', f'{digest}.zst'):
+        path = objects_dir / digest[:2] / name
+        if path.exists():
+            return path
+    return None
+
+
+def load_snapshot(path: str) -> str:
+    """
+    保存したスナップショットを，形式（拡張子で判断する）によらず元の HTML にして返す
+
+    Raises:
+        FileNotFoundError: pack が参照するアセットがない場合
+    """
+    path = Path(path)
+    text = decompress(path.read_bytes(), codec_of(path)).decode('utf-8')
+    if '.pack' not in path.suffixes:
+        return text
+    objects_dir = path.parent.parent / 'objects'
+
+    def inline(match) -> str:
+        mime, digest = match.groups()
+        object_path = find_object(objects_dir, digest)
+        if object_path is None:
+            raise FileNotFoundError(f'missing object {digest} for {path}')
+        data = decompress(object_path.read_bytes(), codec_of(object_path))
+        return f'data:{mime};base64,{base64.b64encode(data).decode("ascii")}'
+
+    return object_ref_re.sub(inline, text)
+
+
+def export_snapshot(path: str, output: str) -> str:
+    """
+    スナップショットを，1 つの（非圧縮の）HTML ファイルとして書き出す．MHTML（.mhtml）はそのままコピーする
+
+    Returns:
+        str: output
+    """
+    if Path(path).suffix == '.mhtml':
+        shutil.copyfile(path, output)
+        return output
+    html = load_snapshot(path)
+    with open(output, 'w', encoding='utf-8') as f:
+        f.write(html)
+    return output
@@ -1,43 +1,77 @@
 import base64
+import contextvars
 import datetime
 import hashlib
+import io
 import os
 from datetime import timezone, timedelta, datetime
 import re
-import sys
+import tempfile
+import threading
 import time
 import json
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from pathlib import Path
 from urllib.parse import urlparse, urlunsplit, urljoin, quote
 
-import chromedriver_binary
-import fire
-import requests
-from bs4 import BeautifulSoup
-from selenium import webdriver
-from selenium.common.exceptions import TimeoutException
+from . import browser, health, logs, render
+from .browser import get_browser_pool
+from .cache import DiskCache, DEFAULT_MAX_BYTES
+from .catalog import Catalog
+from .css import CSSEngine, iter_urls
+from .dedupe import dedupe_assets
+from .health import get_host_registry
+from .images import ImageOptimizer, choose_srcset_candidate, sniff_mime_type
+from .mhtml import MHTMLWriter, output_formats
+from .session import get_session
+from .storage import SnapshotStorage, export_snapshot, load_zstandard, open_storage
 
 re_css_url = re.compile(r'(url\(.*?\))')
-webpage2html_cache = {}
-getting_time = 0
+asset_cache = None
+cache_max_bytes = DEFAULT_MAX_BYTES
+# ブラウザで描画したページには鮮度の情報がないので，この秒数だけキャッシュを有効にする
+rendered_page_ttl = 10 * 60
+css_engine = None
+catalog = None
+# スナップショットの保存形式．'plain'，'gzip'，'zstd'，'pack'（storage.open_storage を参照）
+storage_format = 'plain'
+storage = None
+_shared_lock = threading.Lock()
+url_safe_chars = "%/:=&?~#+!$,;'@()*[]"
+# 1 つのアセットの最大のバイト数．超えるものはダウンロードを打ち切り，絶対 URL のまま残す
+max_asset_bytes = 20 * 1024 * 1024
+# 1 ページ（フレームを含む）に埋め込む data URI の合計の最大のバイト数．None は無制限
+max_page_bytes = 100 * 1024 * 1024
+# 1 ページ（ブラウザでの読み込みと，すべてのアセットの取得）にかける最大の秒数．None は無制限
+page_timeout = 180
+# ブラウザでの読み込みと描画の待ち時間に使う，残り時間の割合（残りはアセットの取得に使う）
+browser_time_share = 0.5
+# 1 回のリクエストの接続と読み込みのタイムアウト（秒）の上限
+connect_timeout = 10
+read_timeout = 30
+JST = timezone(timedelta(hours=+9), 'JST')
 
 
 def log(s, new_line=True):
     """
-    log を標準出力する
+    log を標準エラー出力する．レベルに関係なく出力する．
+    レベルで絞り込むイベントは logs.debug，logs.info などを使う．
     """
-    print(str(s), end=' ', file=sys.stderr)
-    if new_line:
-        sys.stderr.write('\n')
-    sys.stderr.flush()
+    logs.write(str(s), end='\n' if new_line else ' ')
 
 
 def prepare_download() -> str:
     """
     ダウンロードのディレクトリの準備
+
+    import 時には作らず，ページの取得を始める時（generate() など）に作る．
     """
-    download_dir_name = 'download'
-    download_dir_path = Path(download_dir_name)
+    global _download_prepared
+
+    if _download_prepared:
+        return download_dir
+    download_dir_path = Path(download_dir)
     download_dir_path.mkdir(parents=True, exist_ok=True)
 
     download_dir_path_html = download_dir_path / "html"
@@ -46,9 +80,13 @@ def prepare_download() -> str:
     download_dir_path_image.mkdir(parents=True, exist_ok=True)
     download_dir_path_link = download_dir_path / "link"
     download_dir_path_link.mkdir(parents=True, exist_ok=True)
+    download_dir_path_cache = download_dir_path / "cache"
+    download_dir_path_cache.mkdir(parents=True, exist_ok=True)
+    download_dir_path_report = download_dir_path / "report"
+    download_dir_path_report.mkdir(parents=True, exist_ok=True)
 
-    download_dir_str = str(download_dir_path.resolve())
-    return download_dir_str
+    _download_prepared = True
+    return download_dir
 
 
 def make_site_id(url: str = "") -> str:
@@ -65,14 +103,262 @@ def make_site_id(url: str = "") -> str:
     return hash_str
 
 
-download_dir = prepare_download()
-site_id = ""
-external_links = []
-internal_links = []
-base_url = ""
+# ダウンロードのディレクトリ．import した時のカレントディレクトリの download
+download_dir = str(Path('download').resolve())
+_download_prepared = False
 user_agent = "Mozilla/5.0 (Macintosh; Intel Mac OS X 10.14; rv:75.0) Gecko/20100101 Firefox/75.0"
 
 
+class ArchiveJob(object):
+    """
+    1 ページ（とそのフレーム）を取得する間の状態
+
+    generate() はページごとに ArchiveJob を作って current_job に設定するので，
+    同じプロセスの複数のスレッドで別々のページを同時に処理できる．
+    ディスクキャッシュ，CSS の書き換えエンジン，HTTP セッション，ブラウザプール，ホストの状態は
+    ジョブの間で共有する．
+    """
+
+    def __init__(self, url: str = "", getting_time: str = None):
+        """
+        Args:
+            url (str): ページの URL
+            getting_time (str): 取得時刻（%Y%m%dT%H%M%SJST）．省略時は現在時刻
+        """
+        self.base_url = url
+        self.site_id = make_site_id(url)
+        self.getting_time = getting_time or datetime.now(JST).strftime('%Y%m%dT%H%M%SJST')
+        self.external_links = []
+        self.internal_links = []
+        self.user_agent = user_agent
+        # generate() が先読みし，まだ使っていないアセット．キーは get_contents が使う完全な URL．
+        # get_contents が一度返したら取り除くので，2 回目以降はディスクキャッシュから読む
+        self.prefetched = {}
+        # 埋め込んだ data URI のバイト数と，埋め込まなかったアセット
+        self.page_bytes = 0
+        self.skipped_assets = []
+        # ページの締め切り（time.monotonic() の値）
+        self.deadline = None
+        # 保存したスナップショット（SnapshotStorage.save の値）
+        self.storage = None
+        # dedupe_assets の結果（フレームを含む合計）．dedupe しなかった場合は None
+        self.dedupe = None
+        # output_format='mhtml' の場合に，アセットをパートとして書き出す MHTMLWriter
+        self.parts = None
+        # ページを取得した方法．{'mode': render_mode, 'path': 'browser' または 'static', 'reason': 理由}
+        self.render = None
+        # 処理の段階ごとの所要時間．{段階: [秒, 回数]}
+        self.timings = {}
+        self.started_at = time.monotonic()
+        self._timings_lock = threading.Lock()
+
+    def start(self, timeout: float = None) -> None:
+        """
+        timeout 秒の締め切りを設定する．None の場合は締め切りなし．
+        """
+        self.started_at = time.monotonic()
+        self.deadline = None if timeout is None else self.started_at + timeout
+
+    def add_timing(self, phase: str, seconds: float) -> None:
+        """
+        段階の所要時間を加える．先読みのスレッドからも呼ばれる．
+        """
+        with self._timings_lock:
+            entry = self.timings.setdefault(phase, [0.0, 0])
+            entry[0] += seconds
+            entry[1] += 1
+
+    def timing_report(self) -> dict:
+        """
+        Returns:
+            dict: {'elapsed': 開始からの秒数, 'phases': {段階: {'seconds', 'count'}}}．
+                  段階は入れ子になり（rewrite は css，encode，fetch を含むなど），fetch はスレッドの合計なので，
+                  合計は elapsed と一致しない
+        """
+        with self._timings_lock:
+            phases = {phase: {'seconds': round(seconds, 3), 'count': count}
+                      for phase, (seconds, count) in sorted(self.timings.items())}
+        return {'elapsed': round(time.monotonic() - self.started_at, 3), 'phases': phases}
+
+
+# 現在のスレッド（またはタスク）が処理しているページ
+current_job = contextvars.ContextVar('webpage2html_job', default=None)
+# generate() の外から get_contents などを呼んだ場合に使うジョブ
+_default_job = None
+
+
+def get_job() -> ArchiveJob:
+    """
+    現在のジョブを取得する
+    """
+    global _default_job
+
+    job = current_job.get()
+    if job is None:
+        if _default_job is None:
+            _default_job = ArchiveJob()
+        job = _default_job
+    return job
+
+
+@contextmanager
+def timed(phase: str):
+    """
+    with の中の処理にかかった時間を，現在のジョブの phase に加える
+    """
+    job = get_job()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        job.add_timing(phase, time.perf_counter() - start)
+
+
+def get_asset_cache() -> DiskCache:
+    """
+    プロセス間で共有するディスクキャッシュを取得する
+    """
+    global asset_cache
+
+    with _shared_lock:
+        if asset_cache is None:
+            prepare_download()
+            asset_cache = DiskCache(f"{download_dir}/cache", max_bytes=cache_max_bytes)
+        return asset_cache
+
+
+def get_catalog() -> Catalog:
+    """
+    取得したページの索引を取得する．初めて開く場合は，既存のダウンロードのディレクトリを取り込む．
+    """
+    global catalog
+
+    with _shared_lock:
+        if catalog is None:
+            prepare_download()
+            catalog = Catalog(f"{download_dir}/catalog.sqlite3")
+            imported = catalog.import_download_dir(download_dir)
+            if imported:
+                logs.info('INFO', 'catalog: imported %d snapshots from %s', imported, download_dir)
+        return catalog
+
+
+def get_storage() -> SnapshotStorage:
+    """
+    storage_format の保存先を取得する．zstandard がない場合，zstd は gzip にする．
+    """
+    global storage
+
+    with _shared_lock:
+        fmt = storage_format
+        if fmt == 'zstd' and load_zstandard() is None:
+            logs.warn('WARN', 'zstandard is not installed. Snapshots are saved with gzip.')
+            fmt = 'gzip'
+        if storage is None or storage.format != fmt:
+            prepare_download()
+            storage = open_storage(download_dir, fmt)
+        return storage
+
+
+def decode_cached(data: bytes, meta: dict):
+    """
+    キャッシュの本体を get_contents と同じ型（text/* は str，それ以外は bytes）に戻す
+    """
+    if (meta.get('content-type') or '').lower().startswith('text/'):
+        return data.decode(meta.get('encoding') or 'utf-8', errors='replace')
+    return data
+
+
+class DeadlineExceeded(Exception):
+    """
+    ページの締め切りを過ぎた
+    """
+
+
+def remaining_time(share: float = 1.0):
+    """
+    ページの締め切りまでの残りの秒数に share を掛けた値．締め切りがない場合は None．
+    """
+    deadline = get_job().deadline
+    if deadline is None:
+        return None
+    return max(0.0, deadline - time.monotonic()) * share
+
+
+def request_timeout() -> tuple:
+    """
+    残り時間から，requests に渡す (接続，読み込み) のタイムアウトを求める
+
+    Raises:
+        DeadlineExceeded: 締め切りを過ぎている場合
+    """
+    remaining = remaining_time()
+    if remaining is None:
+        return connect_timeout, read_timeout
+    if remaining <= 0:
+        raise DeadlineExceeded()
+    return min(connect_timeout, remaining), min(read_timeout, remaining)
+
+
+def read_limited(response, limit: int = None):
+    """
+    レスポンスの本体を少しずつ読み込む
+
+    Args:
+        response: stream=True で取得したレスポンス
+        limit (int): 最大のバイト数
+
+    Returns:
+        tuple: (本体，サイズ)．limit を超える場合は本体が None で，サイズは分かった範囲の値
+
+    Raises:
+        DeadlineExceeded: 読み込みの途中でページの締め切りを過ぎた場合
+    """
+    length = response.headers.get('content-length', '')
+    if limit and length.isdigit() and int(length) > limit:
+        return None, int(length)
+    deadline = get_job().deadline
+    chunks = []
+    size = 0
+    for chunk in response.iter_content(chunk_size=16 * 1024):
+        size += len(chunk)
+        if limit and size > limit:
+            return None, size
+        # 読み込みのタイムアウトは受信ごとなので，少しずつ届き続ける場合は締め切りで打ち切る．
+        # チャンクが埋まるまで確認できないため，小さめのチャンクで読む．
+        if deadline is not None and time.monotonic() > deadline:
+            raise DeadlineExceeded()
+        chunks.append(chunk)
+    return b''.join(chunks), size
+
+
+def charge_page_bytes(size: int) -> bool:
+    """
+    ページのバイト数の予算から size を使う．予算が足りない場合は使わずに False を返す．
+    """
+    job = get_job()
+    if max_page_bytes is not None and job.page_bytes + size > max_page_bytes:
+        return False
+    job.page_bytes += size
+    return True
+
+
+def skip_asset(url: str, reason: str, size: int = None, verbose: bool = True) -> None:
+    """
+    埋め込まなかったアセットを記録する
+
+    Args:
+        url (str): アセットの URL
+        reason (str): 'max_asset_bytes'，'max_page_bytes'，'deadline' または 'circuit_open'
+        size (int): アセットのバイト数
+        verbose (bool): ログを出すかどうか
+    """
+    get_job().skipped_assets.append({'url': url, 'reason': reason, 'size': size})
+    if verbose:
+        logs.warn('WARN', 'not embedded (%s%s), left as URL - %s', reason,
+                  '' if size is None else f', {size} bytes', url)
+
+
 def add_links(url: str = "") -> None:
     """
     リンクを外部と内部を分けて，リストにURLを追加する
@@ -80,19 +366,17 @@ def add_links(url: str = "") -> None:
     Args:
         url (str): target URL
     """
-    global external_links
-    global internal_links
-    global base_url
-
+    job = get_job()
+    base_url = job.base_url
     if url.lower().startswith('http'):
         if url.count("/") < 3 and base_url.startswith(url.split("?")[0]):
-            internal_links.append(url)
+            job.internal_links.append(url)
         elif url.count("/") < 3:
-            external_links.append(url)
+            job.external_links.append(url)
         elif url.split("/")[2] == base_url.split("/")[2]:
-            internal_links.append(url)
+            job.internal_links.append(url)
         else:
-            external_links.append(url)
+            job.external_links.append(url)
 
 
 def absurl(index, relpath: str = None, normpath: str = None):
@@ -129,54 +413,105 @@ def get_contents(url: str = None, relpath: str = None, verbose: bool = True, use
 
     """
 
-    global webpage2html_cache
-    global site_id
-    global download_dir
-    global user_agent
+    job = get_job()
 
     if url.startswith('http') or (relpath and relpath.startswith('http')):
         full_path = absurl(url, relpath)
         if not full_path:
             if verbose:
-                log(f'[ WARN ] invalid path, {url} {relpath}')
+                logs.warn('WARN', 'invalid path, %s %s', url, relpath)
             return '', None
         # urllib2 only accepts valid url, the following code is taken from urllib
         # http://svn.python.org/view/python/trunk/Lib/urllib.py?r1=71780&r2=71779&pathrev=71780
-        full_path = quote(full_path, safe="%/:=&?~#+!$,;'@()*[]")
+        full_path = quote(full_path, safe=url_safe_chars)
+        prefetched = job.prefetched.pop(full_path, None)
+        if prefetched is not None:
+            return prefetched
+        cached, meta = None, None
         if usecache:
-            if full_path in webpage2html_cache:
+            cache = get_asset_cache()
+            cached, meta = cache.get(full_path)
+            if cached is not None and DiskCache.is_fresh(meta):
+                cache.stats['hit'] += 1
                 if verbose:
-                    log(f'[ CACHE HIT ] - {full_path}')
-                return webpage2html_cache[full_path], None
+                    logs.debug('CACHE HIT', '- %s', full_path)
+                return decode_cached(cached, meta), {'url': meta.get('response-url', full_path),
+                                                     'content-type': meta.get('content-type')}
+        # accept などの共通ヘッダはセッションに設定済み
         headers = {
-            "accept": "image/webp,image/*,*/*;q=0.8",
-            "accept-language": "ja,en-US;q=0.9,en;q=0.8",
-            "user-agent": user_agent
+            "user-agent": job.user_agent
         }
         if referer_url is not None and referer_url != "":
             headers.update({"referer": referer_url})
+        # 期限切れのエントリは，本体を取り直さずに ETag / Last-Modified で再検証する
+        if cached is not None:
+            headers.update(DiskCache.conditional_headers(meta))
+
+        import requests
 
         auth = None
         if username and password:
             auth = requests.auth.HTTPBasicAuth(username, password)
-        try:
-            response = requests.get(full_path, headers=headers, verify=verify, auth=auth)
+        # 失敗が続いているホストには接続しない
+        host = urlparse(full_path).netloc
+        registry = get_host_registry()
+        if not registry.allow(host):
             if verbose:
-                log('[ GET ] %d - %s' % (response.status_code, response.url))
-            if not ignore_error and (response.status_code >= 400 or response.status_code < 200):
-                content = ''
-            elif response.headers.get('content-type', '').lower().startswith('text/'):
-                content = response.text
-            else:
-                content = response.content
-            if usecache:
-                webpage2html_cache[response.url] = content
-            return content, {'url': response.url,
-                             'content-type': response.headers.get('content-type')}
-        except Exception as ex:
+                logs.warn('SKIP', 'circuit open for %s - %s', host, full_path)
+            return '', {'url': full_path, 'skipped': 'circuit_open'}
+        attempt = 0
+        while True:
+            retry_after = None
+            started = time.monotonic()
+            try:
+                # 本体は少しずつ読み込み，max_asset_bytes を超えたら打ち切る
+                with get_session().get(full_path, headers=headers, verify=verify, auth=auth,
+                                       stream=True, timeout=request_timeout()) as response:
+                    if verbose:
+                        logs.debug('GET', '%d - %s', response.status_code, response.url)
+                    if response.status_code in health.retry_statuses:
+                        error = f'HTTP {response.status_code}'
+                        registry.record_failure(host, error)
+                        retry_after = response.headers.get('retry-after')
+                    else:
+                        error = None
+                        registry.record_success(host, time.monotonic() - started)
+                    if error is None or attempt >= health.max_retries:
+                        return read_response(response, full_path, cached, meta, usecache=usecache,
+                                             ignore_error=ignore_error)
+            except DeadlineExceeded:
+                return '', {'url': full_path, 'skipped': 'deadline'}
+            except (requests.Timeout, requests.ConnectionError) as ex:
+                # 締め切りを過ぎたら，取得済みのものだけでページを仕上げる
+                if remaining_time() == 0:
+                    return '', {'url': full_path, 'skipped': 'deadline'}
+                error = ex
+                registry.record_failure(host, ex)
+                if not health.is_transient(ex):
+                    if verbose:
+                        logs.warn('WARN', '??? - %s: %s', full_path, ex)
+                    return '', None
+            except Exception as ex:
+                if verbose:
+                    logs.warn('WARN', '??? - %s: %s', full_path, ex)
+                return '', None
+            finally:
+                # 再試行ごとの，接続から本体の読み込みまで
+                job.add_timing('fetch', time.monotonic() - started)
+
+            # 一時的なエラーは，締め切りまでに間に合う範囲で，間隔を広げながら再試行する
+            delay = health.backoff_delay(attempt, retry_after)
+            remaining = remaining_time()
+            if attempt >= health.max_retries or (remaining is not None and delay >= remaining) \
+                    or not registry.allow(host):
+                if verbose:
+                    logs.warn('WARN', '??? - %s: %s', full_path, error)
+                return '', None
+            registry.record_retry(host)
             if verbose:
-                log(f'[ WARN ] ??? - {full_path}: {ex}')
-            return '', None
+                logs.info('RETRY', '%d/%d in %.1fs (%s) - %s', attempt + 1, health.max_retries, delay, error, full_path)
+            time.sleep(delay)
+            attempt += 1
     elif os.path.exists(url):
         if relpath:
             relpath = relpath.split('#')[0].split('?')[0]
@@ -187,30 +522,77 @@ def get_contents(url: str = None, relpath: str = None, verbose: bool = True, use
             try:
                 ret = open(full_path, 'rb').read()
                 if verbose:
-                    log(f'[ LOCAL ] found - {full_path}')
+                    logs.debug('LOCAL', 'found - %s', full_path)
                 return ret, None
             except IOError as ex:
                 if verbose:
-                    msg = str(ex)
-                    log(f'[ WARN ] file not found - {full_path} {msg}')
+                    logs.warn('WARN', 'file not found - %s %s', full_path, ex)
                 return '', None
         else:
             try:
                 ret = open(url, 'rb').read()
                 if verbose:
-                    log(f'[ LOCAL ] found - {url}')
+                    logs.debug('LOCAL', 'found - %s', url)
                 return ret, None
             except IOError as err:
                 if verbose:
-                    msg = str(err)
-                    log(f'[ WARN ] file not found - {url} {msg}')
+                    logs.warn('WARN', 'file not found - %s %s', url, err)
                 return '', None
     else:
         if verbose:
-            log(f'[ ERROR ] invalid index - {url}')
+            logs.error('ERROR', 'invalid index - %s', url)
         return '', None
 
 
+def read_response(response, full_path: str, cached: bytes = None, meta: dict = None, usecache: bool = True,
+                  ignore_error: bool = False) -> tuple:
+    """
+    get_contents のレスポンスを読み込み，キャッシュに保存する
+
+    Args:
+        response: stream=True で取得したレスポンス
+        full_path (str): 要求した URL
+        cached (bytes): 期限切れのキャッシュの本体（304 の場合に使う）
+        meta (dict): 期限切れのキャッシュのメタデータ
+        usecache (bool): キャッシュを使うかどうか
+        ignore_error (bool): エラーのステータスでも本体を返すかどうか
+
+    Returns:
+        tuple: (本体, extra_data)
+    """
+    if response.status_code == 304 and cached is not None:
+        cache = get_asset_cache()
+        meta = cache.refresh(full_path, meta, response.headers)
+        cache.stats['revalidated'] += 1
+        cache.stats['revalidated_bytes'] += len(cached)
+        return decode_cached(cached, meta), {'url': meta.get('response-url', full_path),
+                                             'content-type': meta.get('content-type')}
+    if usecache:
+        get_asset_cache().stats['fetched'] += 1
+    extra_data = {'url': response.url, 'content-type': response.headers.get('content-type')}
+    if not ignore_error and (response.status_code >= 400 or response.status_code < 200):
+        return '', extra_data
+    body, size = read_limited(response, max_asset_bytes)
+    if body is None:
+        extra_data.update({'skipped': 'max_asset_bytes', 'size': size})
+        return '', extra_data
+    # requests と同じく，text/* は Content-Type の charset（なければ ISO-8859-1）で復号する
+    encoding = response.encoding or 'utf-8'
+    if response.headers.get('content-type', '').lower().startswith('text/'):
+        try:
+            content = str(body, encoding, errors='replace')
+        except LookupError:
+            content = str(body, errors='replace')
+    else:
+        content = body
+    if usecache and content and 200 <= response.status_code < 300:
+        get_asset_cache().put(full_path, body, response.headers,
+                              **{'response-url': response.url,
+                                 'content-type': response.headers.get('content-type'),
+                                 'encoding': encoding})
+    return content, extra_data
+
+
 def get_contents_by_selenium(url: str = None,
                              relpath: str = None,
                              verbose: bool = True,
@@ -220,7 +602,8 @@ def get_contents_by_selenium(url: str = None,
                              username: str = None,
                              password: str = None,
                              flg_screen_shot: bool = False,
-                             referer_url: str = "") -> tuple:
+                             referer_url: str = "",
+                             frame_depth: int = 0) -> tuple:
     """
     Selenium を利用して，Webコンテンツを取得する
 
@@ -235,52 +618,60 @@ def get_contents_by_selenium(url: str = None,
         password:
         flg_screen_shot:
         referer_url:
+        frame_depth: この深さまで iframe / frame の DOM をブラウザから取得し，extra_data['frames'] に入れる
 
     Returns:
 
     """
 
-    global site_id
-    global download_dir
-    global webpage2html_cache
-    global user_agent
-    global getting_time
-
-    url = absurl(url, base_url)
-    full_path = quote(url, safe="%/:=&?~#+!$,;'@()*[]")
-    if usecache:
-        if full_path in webpage2html_cache:
+    job = get_job()
+    url = absurl(url, job.base_url)
+    full_path = quote(url, safe=url_safe_chars)
+    # スクリーンショットを撮る場合は，必ずブラウザで描画し直す
+    if usecache and not flg_screen_shot and url.startswith("http"):
+        cached, meta = get_asset_cache().get(full_path)
+        if cached is not None and DiskCache.is_fresh(meta):
             if verbose:
-                log(f'[ CACHE HIT ] - {full_path}')
-            return webpage2html_cache[full_path], {'url': url, 'content-type': "text/html"}
+                logs.debug('CACHE HIT', '- %s', full_path)
+            return decode_cached(cached, meta), {'url': url, 'content-type': "text/html"}
 
     if not url.startswith("http"):
         if usecache:
             contents = "<!DOCTYPE html><html lang='en'>" \
                        "<head><meta charset='utf-8'><title>No title</title></head>" \
                        "<body><!-- No content --></body></html>"
-            webpage2html_cache[full_path] = contents
             return contents, {'url': url, 'content-type': "text/html"}
 
-    log(f"[DEBUG] - Get by selenium: {url} as {site_id}")
-    options = webdriver.ChromeOptions()
-    options.add_argument('--headless')
-    options.add_argument("--incognito")
-    options.add_argument("--hide-scrollbars")
-    options.add_argument("--test-type")
+    if verbose:
+        logs.debug('DEBUG', 'Get by selenium: %s as %s', url, job.site_id)
 
-    if not chromedriver_binary:
-        return get_contents(url, referer_url=referer_url)
+    from selenium.common.exceptions import TimeoutException
+
+    frames = {}
+    # 描画できなかった場合の仮の文書はキャッシュしない
+    rendered = True
     try:
-        with webdriver.Chrome(options=options) as driver:
+        # 起動済みのブラウザを借りる．Cookie とウィンドウの大きさは貸し出し時に初期化される．
+        with get_browser_pool().lease() as driver:
             try:
-                user_agent = driver.execute_script("return navigator.userAgent;")
-                driver.set_window_size(1920, 1080)
-                driver.get(url)
+                job.user_agent = driver.execute_script("return navigator.userAgent;")
+                # 読み込みと描画の待ち時間は，ページの残り時間の browser_time_share まで
+                budget = remaining_time(browser_time_share)
+                load_timeout = browser.page_load_timeout if budget is None else min(browser.page_load_timeout, budget)
+                deadline = time.monotonic() + load_timeout
+                driver.set_page_load_timeout(max(1, load_timeout))
+                try:
+                    driver.get(url)
+                except TimeoutException:
+                    # 読み込みきれなくても，そこまでの DOM を使う
+                    logs.warn('WARN', 'page load timeout (%.1fs), using the partial page - %s', load_timeout, url)
+                    driver.execute_script("window.stop();")
                 if flg_screen_shot:
+                    # 決め打ちの sleep ではなく，ページが落ち着くのを待つ（最大 ready_timeout 秒）
+                    deadline = min(deadline, time.monotonic() + browser.ready_timeout)
+                    browser.wait_for_page_ready(driver, timeout=max(0, deadline - time.monotonic()))
                     width = driver.execute_script("return document.body.clientWidth;")
                     driver.set_window_size(max(width, 1920), 1080)
-                    time.sleep(1)
                     height = driver.execute_script("""
                         var maxHeight = document.body.clientHeight;
                         var childrenNodes = document.body.children;
@@ -293,40 +684,119 @@ def get_contents_by_selenium(url: str = None,
                         return maxHeight;""")
                     # log(height)
                     driver.set_window_size(max(width, 1920), max(height, 1080))
-                    time.sleep(1)
-                    driver.execute_script(f"window.scrollTo(0, {height})")
-                    time.sleep(12)
+                    browser.scroll_through_page(driver, timeout=max(0, deadline - time.monotonic()))
                     driver.execute_script("window.scrollTo(0, 0)")
-                    time.sleep(1)
+                    browser.wait_for_page_ready(driver, timeout=max(0, deadline - time.monotonic()))
                     html_text = driver.page_source
-                    driver.save_screenshot(f'{download_dir}/image/{site_id}_{getting_time}.png')
+                    driver.save_screenshot(f'{download_dir}/image/{job.site_id}_{job.getting_time}.png')
+                else:
+                    html_text = driver.page_source
+                if frame_depth > 0:
+                    frames = browser.capture_frames(driver, max_depth=frame_depth)
             except TimeoutException as ex:
-                log(f"[ERROR]\tTimeoutException: '{ex}'")
+                logs.error('ERROR', "TimeoutException: '%s'", ex)
+                rendered = False
                 html_text = "<!DOCTYPE html><html lang='en'>" \
                             "<head><meta charset='utf-8'><title>No title</title></head>" \
                             "<body><!-- No content --></body></html>"
-            else:
-                driver.quit()
     except Exception as ex:
-        log(f"[ERROR]\twebdriver Chrome: '{ex}'")
-        log(f"[WARN]\tGet web page by request without screenshot")
-        return get_contents(url, referer_url=referer_url)
+        logs.error('ERROR', "webdriver Chrome: '%s'", ex)
+        logs.warn('WARN', 'Get web page by request without screenshot')
+        html_text, extra_data = get_contents(url, referer_url=referer_url)
+        # ブラウザで描画していないことを get_page_html に伝える
+        return html_text, {**(extra_data or {}), 'browser_failed': True}
 
     # キャッシュが有効な場合，キャッシュに追加．
-    if usecache:
-        webpage2html_cache[full_path] = html_text
+    if usecache and rendered:
+        get_asset_cache().put(full_path, html_text.encode('utf-8'), default_ttl=rendered_page_ttl,
+                              **{'content-type': 'text/html', 'encoding': 'utf-8'})
 
-    return html_text, {'url': url, 'content-type': "text/html"}
+    return html_text, {'url': url, 'content-type': "text/html", 'frames': frames}
 
 
-def data_to_base64(index, src, verbose: bool = True, referer_url: str = None):
-    # doc here: http://en.wikipedia.org/wiki/Data_URI_scheme
-    sp = urlparse(src).path.lower()
-    if src.strip().startswith('data:'):
-        return src
-    elif src.strip().startswith('javascript:'):
-        return src
+def decode_page(html_doc, content_type: str) -> str:
+    """
+    HTTP で取得したページを文字列にする
+
+    Content-Type に charset がない場合，get_contents は text/* を ISO-8859-1 で復号しているので，
+    バイト列に戻し，<meta charset> や BOM（なければ内容から推測した文字コード）で復号し直す．
+
+    Args:
+        html_doc (str | bytes): get_contents の本体
+        content_type (str): Content-Type（小文字）
+    """
+    from bs4.dammit import UnicodeDammit
+
+    if isinstance(html_doc, str):
+        if not html_doc or 'charset' in content_type or not content_type.startswith('text/'):
+            return html_doc
+        html_doc = html_doc.encode('iso-8859-1', errors='replace')
+    dammit = UnicodeDammit(html_doc, is_html=True)
+    if dammit.unicode_markup is None:
+        return html_doc.decode('utf-8', errors='replace')
+    return dammit.unicode_markup
+
+
+def get_page_html(url: str, render_mode: str = 'always-browser', verbose: bool = True,
+                  flg_screen_shot: bool = False, frame_depth: int = 0) -> tuple:
+    """
+    ページの HTML を，render_mode に従ってブラウザか HTTP で取得する
+
+    Args:
+        url (str): ページの URL
+        render_mode (str): 'always-browser' は常にブラウザで描画する．'never-browser' は HTTP で取得した HTML を使う．
+                           'auto' は HTTP で取得し，render.needs_browser が JavaScript が必要と判断した場合だけブラウザで描画する
+        verbose (bool): ログを出すかどうか
+        flg_screen_shot (bool): ブラウザで描画する場合にスクリーンショットを撮るかどうか
+        frame_depth (int): ブラウザで描画する場合に，この深さまで iframe / frame の DOM を取得する
+
+    Returns:
+        tuple: (HTML, extra_data)．extra_data['render'] は 'browser' または 'static'，
+               extra_data['render_reason'] はブラウザで描画した理由
+    """
+    if render_mode not in render.render_modes:
+        raise ValueError(f'unknown render_mode: {render_mode}')
+    reason = render_mode
+    if render_mode != 'always-browser':
+        # HTTP で取得する場合はスクリーンショットを撮らない
+        with timed('static'):
+            html_doc, extra_data = get_contents(url, verbose=verbose)
+        content_type = ((extra_data or {}).get('content-type') or '').lower()
+        html_doc = decode_page(html_doc, content_type)
+        if render_mode == 'never-browser':
+            reason = None
+        elif not html_doc:
+            reason = 'fetch_failed'
+        elif content_type and 'html' not in content_type:
+            reason = 'not_html'
+        else:
+            reason = render.needs_browser(html_doc)
+        if reason is None:
+            return html_doc, {**(extra_data or {}), 'frames': {}, 'render': 'static', 'render_reason': None}
+        if verbose:
+            logs.info('RENDER', 'escalating to the browser (%s) - %s', reason, url)
+    with timed('browser'):
+        html_doc, extra_data = get_contents_by_selenium(url, verbose=verbose, flg_screen_shot=flg_screen_shot,
+                                                        frame_depth=frame_depth)
+    extra_data = extra_data or {}
+    if extra_data.get('browser_failed'):
+        # ブラウザを起動できず HTTP で取得した
+        html_doc = decode_page(html_doc, (extra_data.get('content-type') or '').lower())
+        return html_doc, {**extra_data, 'frames': {}, 'render': 'static', 'render_reason': reason}
+    return html_doc, {**extra_data, 'render': 'browser', 'render_reason': reason}
+
+
+def guess_mime_type(src: str) -> str:
+    """
+    URL の拡張子から MIME タイプを推測する
+
+    Args:
+        src (str): URL
 
+    Returns:
+        str: MIME タイプ．不明な場合は image/png
+    """
+    sp = urlparse(src).path.lower()
     if sp.endswith('.png'):
         fmt = 'image/png'
     elif sp.endswith('.gif'):
@@ -363,6 +833,21 @@ def data_to_base64(index, src, verbose: bool = True, referer_url: str = None):
         fmt = "application/json"
     else:
         fmt = 'image/png'
+    return fmt
+
+
+# 中身を見て MIME タイプを判断する Content-Type
+generic_mime_types = {'', 'application/octet-stream', 'binary/octet-stream', 'text/plain'}
+
+
+def data_to_base64(index, src, verbose: bool = True, referer_url: str = None, optimizer: ImageOptimizer = None):
+    # doc here: http://en.wikipedia.org/wiki/Data_URI_scheme
+    if src.strip().startswith('data:'):
+        return src
+    elif src.strip().startswith('javascript:'):
+        return src
+
+    fmt = guess_mime_type(src)
 
     # html ファイルの場合 Selenium を利用して取得する．それ以外は，referer をつけて Requestsを利用する．
     if fmt == "text/html":
@@ -371,50 +856,527 @@ def data_to_base64(index, src, verbose: bool = True, referer_url: str = None):
         # log(f"{index} , {sp} <- {src} as {fmt}")
         data, extra_data = get_contents(index, src, verbose=verbose, referer_url=referer_url)
 
+    if extra_data and extra_data.get('skipped'):
+        skip_asset(absurl(index, src), extra_data['skipped'], extra_data.get('size'), verbose=verbose)
+        return absurl(index, src)
+
     if extra_data and extra_data.get('content-type'):
         fmt = extra_data.get('content-type').strip().replace(' ', '')
 
-    if data:
+    if isinstance(data, bytes):
+        # 拡張子や Content-Type が画像，または不明な場合は，先頭のバイト列で判断する
+        sniffed = sniff_mime_type(data)
+        if sniffed and (fmt.startswith('image/') or fmt.split(';')[0] in generic_mime_types):
+            fmt = sniffed
+        if optimizer is not None:
+            with timed('image'):
+                data, fmt = optimizer.optimize(data, fmt)
+
+    if data and get_job().parts is not None:
+        # MHTML では base64 にせず，元の URL のパートとして保存する．同じ URL のパートは一度だけ数える
+        parts = get_job().parts
+        if absurl(index, src) in parts:
+            return absurl(index, src)
+        body = data if isinstance(data, bytes) else data.encode('utf-8')
+        if not isinstance(data, bytes):
+            fmt = fmt.split(';')[0] + ';charset=utf-8'
+        if not charge_page_bytes(len(body)):
+            skip_asset(absurl(index, src), 'max_page_bytes', len(body), verbose=verbose)
+            return absurl(index, src)
+        with timed('encode'):
+            return parts.add_part(absurl(index, src), fmt, body)
+    elif data:
         # log(f"{index}, {fmt}, {type(data)}")
-        if isinstance(data, bytes):
-            # return f'data:{fmt};base64,' + bytes.decode(base64.b64encode(data))
-            return f'data:{fmt};base64,{base64.b64encode(data).decode("utf-8")}'
-        else:
-            return f'data:{fmt};base64,{base64.b64encode(str.encode(data)).decode("utf-8")}'
+        with timed('encode'):
+            if isinstance(data, bytes):
+                # return f'data:{fmt};base64,' + bytes.decode(base64.b64encode(data))
+                data_uri = f'data:{fmt};base64,{base64.b64encode(data).decode("utf-8")}'
+            else:
+                data_uri = f'data:{fmt};base64,{base64.b64encode(str.encode(data)).decode("utf-8")}'
+        # ページの予算を使い切った後のアセットは埋め込まない
+        if not charge_page_bytes(len(data_uri)):
+            skip_asset(absurl(index, src), 'max_page_bytes', len(data), verbose=verbose)
+            return absurl(index, src)
+        return data_uri
     else:
         return absurl(index, src)
 
 
-css_encoding_re = re.compile(r'''@charset\s+["']([-_a-zA-Z0-9]+)["'];''', re.I)
+def get_css_engine() -> CSSEngine:
+    """
+    プロセスで共有する CSS の書き換えエンジンを取得する
+    """
+    global css_engine
+
+    with _shared_lock:
+        if css_engine is None:
+            css_engine = CSSEngine(fetch=get_contents, embed=data_to_base64, resolve=absurl, log=logs.event,
+                                   charge=charge_page_bytes, variant=embed_variant)
+        return css_engine
+
+
+def embed_variant() -> str:
+    """
+    現在のジョブのアセットの埋め込み方．'data'（data URI）または 'mhtml'（MHTML のパート）
+    """
+    return 'data' if get_job().parts is None else 'mhtml'
+
+
+def handle_css_content(index, css, verbose=True, referer_url: str = None, name: str = None):
+    """
+    CSS の url() を data URI に，@import を書き換えたスタイルシートの data URI にする
+
+    Args:
+        index: 相対 URL の基準になる URL
+        css: CSS
+        verbose:
+        referer_url:
+        name: スタイルシートの URL．指定した場合は処理時間を記録し，このスタイルシートへの @import を循環として止める
+    """
+    with timed('css'):
+        return get_css_engine().rewrite(index, css, name=name, verbose=verbose, referer_url=referer_url)
+
 
+def is_icon_link(link) -> bool:
+    rel = link.get('rel') or []
+    return 'mask-icon' in rel or 'icon' in rel or \
+        'apple-touch-icon' in rel or 'apple-touch-icon-precomposed' in rel
 
-def handle_css_content(index, css, verbose=True, referer_url: str = None):
-    if not css:
+
+def is_stylesheet_link(link) -> bool:
+    return link.get('type') == 'text/css' or \
+        link['href'].lower().endswith('.css') or \
+        'stylesheet' in (link.get('rel') or [])
+
+
+def asset_key(index, relpath: str = None):
+    """
+    get_contents がネットワークから取得するときの完全な URL を求める．ローカルファイルなどは None．
+    """
+    if index.startswith('http') or (relpath and relpath.startswith('http')):
+        full_path = absurl(index, relpath)
+        if full_path:
+            return quote(full_path, safe=url_safe_chars)
+    return None
+
+
+def is_embeddable(src: str) -> bool:
+    """
+    data_to_base64 が get_contents で取得する URL かどうか
+    """
+    src = src.strip()
+    return not (src.startswith('data:') or src.startswith('javascript:')) and guess_mime_type(src) != "text/html"
+
+
+def img_source(img, viewport_width: int = None) -> str:
+    """
+    img の埋め込む画像の URL．viewport_width を指定した場合は srcset から選ぶ．
+    """
+    if viewport_width and img.get('srcset'):
+        return choose_srcset_candidate(img.get('src'), img['srcset'], viewport_width, sizes=img.get('sizes'))
+    return img.get('src')
+
+
+def css_assets(index, css) -> list:
+    """
+    CSS の url() と @import で参照されているアセットを集める
+    """
+    return [(index, src) for src, _ in iter_urls(css or '') if is_embeddable(src)]
+
+
+def css_imports(index, css) -> list:
+    """
+    CSS が @import しているスタイルシートを集める
+    """
+    return [(index, src) for src, is_import in iter_urls(css or '') if is_import and is_embeddable(src)]
+
+
+def collect_assets(soup, url, keep_script: bool = False, viewport_width: int = None) -> tuple:
+    """
+    DOM から generate() が取得するアセットを集める
+
+    Args:
+        soup: BeautifulSoup
+        url: ページの URL
+        keep_script: script を残すかどうか
+        viewport_width: srcset から画像を選ぶビューポートの幅
+
+    Returns:
+        tuple: (アセットの (index, relpath) のリスト, スタイルシートの (index, relpath) のリスト)
+    """
+    assets = []
+    stylesheets = []
+    for link in soup('link'):
+        if not link.get('href'):
+            continue
+        if is_icon_link(link):
+            if is_embeddable(link['href']):
+                assets.append((url, link['href']))
+        elif is_stylesheet_link(link):
+            stylesheets.append((url, link['href']))
+    if keep_script:
+        for js in soup('script'):
+            if js.get('src'):
+                assets.append((url, js['src']))
+    for img in soup('img'):
+        src = img_source(img, viewport_width)
+        if src and is_embeddable(src):
+            assets.append((url, src))
+    for tag in soup(True):
+        if tag.get('style'):
+            assets.extend(css_assets(url, tag['style']))
+        elif tag.name == 'style' and tag.string:
+            assets.extend(css_assets(url, tag.string))
+            stylesheets.extend(css_imports(url, tag.string))
+    return assets, stylesheets
+
+
+def fetch_all(executor, targets, verbose: bool = True, referer_url: str = None) -> None:
+    """
+    まだ先読みしていないアセットを並列に取得し，ジョブの prefetched に格納する
+    """
+    prefetched = get_job().prefetched
+    futures = {}
+    for index, relpath in targets:
+        key = asset_key(index, relpath)
+        if key is None or key in prefetched or key in futures:
+            continue
+        # 取得するスレッドでも，同じジョブ（締め切りなど）を参照する
+        futures[key] = executor.submit(contextvars.copy_context().run, get_contents, index, relpath,
+                                       verbose=verbose, referer_url=referer_url)
+    for key, future in futures.items():
+        prefetched[key] = future.result()
+
+
+def prefetch_assets(soup, url, keep_script: bool = False, workers: int = 8, verbose: bool = True,
+                    referer_url: str = None, viewport_width: int = None) -> None:
+    """
+    ページのアセットを先に並列で取得する．
+
+    DOM のアセットとスタイルシートを取得した後，スタイルシートの url() と @import を，
+    @import をたどりながら深さごとに取得する．
+    書き換えは従来通り順番に行い，get_contents がジョブの prefetched を返すので，出力は逐次取得と同じになる．
+    get_contents は返したアセットを prefetched から取り除くので，本体を持っておくのは使うまでの間だけ．
+
+    Args:
+        soup: BeautifulSoup
+        url: ページの URL
+        keep_script: script を残すかどうか
+        workers: 同時に取得する数
+        verbose: ログを出すかどうか
+        referer_url: referer
+        viewport_width: srcset から画像を選ぶビューポートの幅
+    """
+    prefetched = get_job().prefetched
+    assets, stylesheets = collect_assets(soup, url, keep_script=keep_script, viewport_width=viewport_width)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        fetch_all(executor, stylesheets + assets, verbose=verbose, referer_url=referer_url)
+        scanned = set()
+        while stylesheets:
+            nested = []
+            imports = []
+            for index, relpath in stylesheets:
+                key = asset_key(index, relpath)
+                if key is None or key in scanned:
+                    continue
+                scanned.add(key)
+                css_data, _ = prefetched.get(key, ('', None))
+                nested.extend(css_assets(absurl(index, relpath), css_data))
+                imports.extend(css_imports(absurl(index, relpath), css_data))
+            fetch_all(executor, nested, verbose=verbose, referer_url=referer_url)
+            stylesheets = imports
+    if verbose:
+        logs.info('INFO', 'prefetched %d assets with %d workers', len(prefetched), workers)
+
+
+class RewriteContext(object):
+    """
+    DOM の書き換えで共有する値
+    """
+
+    def __init__(self, soup, url, verbose: bool = True, keep_script: bool = False, full_url: bool = True,
+                 referer_url: str = None, frame_document=None, viewport_width: int = None,
+                 image_optimizer: ImageOptimizer = None):
+        self.soup = soup
+        self.url = url
+        self.verbose = verbose
+        self.keep_script = keep_script
+        self.full_url = full_url
+        self.referer_url = referer_url
+        # フレームの src を受け取り，埋め込む HTML を返す関数
+        self.frame_document = frame_document
+        # srcset から画像を選ぶビューポートの幅．None の場合は src を使う
+        self.viewport_width = viewport_width
+        # 埋め込む前に画像を縮小・再圧縮する場合の ImageOptimizer
+        self.image_optimizer = image_optimizer
+
+
+def rewrite_link(ctx: RewriteContext, link):
+    """
+    アイコンを埋め込み，スタイルシートを style タグに置き換える
+
+    Returns:
+        書き換え後のタグ（置き換えた場合は新しいタグ）
+    """
+    url = ctx.url
+    if not link.get('href'):
+        return link
+    # add_links(absurl(url, link['href']))
+    if is_icon_link(link):
+        link['data-href'] = link['href']
+        link['href'] = data_to_base64(url, link['href'], verbose=ctx.verbose)
+    elif is_stylesheet_link(link):
+        new_type = 'text/css' if not link.get('type') else link['type']
+        css = ctx.soup.new_tag('style', type=new_type)
+        css['data-href'] = link['href']
+        for attr in link.attrs:
+            if attr in ['href']:
+                continue
+            css[attr] = link[attr]
+
+        css_data, extra_data = get_contents(url,
+                                            relpath=link['href'],
+                                            verbose=ctx.verbose,
+                                            referer_url=ctx.referer_url)
+        skipped = (extra_data or {}).get('skipped')
+        size = extra_data.get('size') if skipped else len(css_data or '')
+        # スタイルシートの本文もページの予算から使う（中で埋め込む url() などは別に数える）
+        if not skipped and not charge_page_bytes(size):
+            skipped = 'max_page_bytes'
+        if skipped:
+            # 大きすぎるスタイルシートは，リンクのまま残す
+            skip_asset(absurl(url, link['href']), skipped, size, verbose=ctx.verbose)
+            link['data-href'] = link['href']
+            link['href'] = absurl(url, link['href'])
+            return link
+
+        new_css_content = handle_css_content(absurl(url, link['href']),
+                                             css_data,
+                                             verbose=ctx.verbose,
+                                             referer_url=ctx.referer_url,
+                                             name=absurl(url, link['href']))
+        # if "stylesheet/less" in '\n'.join(link.get('rel') or []).lower():
+        # fix browser side less: http://lesscss.org/#client-side-usage
+        #     # link['href'] = 'data:text/less;base64,' + base64.b64encode(css_data)
+        #     link['data-href'] = link['href']
+        #     link['href'] = absurl(index, link['href'])
+        css.string = new_css_content
+        link.replace_with(css)
         return css
-    if not isinstance(css, str):
-        css = bytes.decode(css)
-        mo = css_encoding_re.search(css)
-        if mo:
-            try:
-                css = css.decode(mo.group(1))
-            except Exception as ex:
-                log(f'[WARN]\tfailed to convert css to encoding {mo.group(1)}: {ex}')
-    # Watch out! how to handle urls which contain parentheses inside? Oh god, css does not support such kind of urls
-    # I tested such url in css, and, unfortunately, the css rule is broken. LOL!
-    # I have to say that, CSS is awesome!
-    reg = re.compile(r'url\s*\((.+?)\)')
+    elif ctx.full_url:
+        link['data-href'] = link['href']
+        link['href'] = absurl(url, link['href'])
+    return link
+
+
+def rewrite_script(ctx: RewriteContext, js):
+    """
+    Javascript を抜き出す．keep_script でなければ削除する．
+
+    Returns:
+        書き換え後のタグ．削除した場合は None
+    """
+    if not ctx.keep_script:
+        js.replace_with('')
+        return None
+    if not js.get('src'):
+        return js
+    js_str, extra_data = get_contents(ctx.url, relpath=js['src'], verbose=ctx.verbose, referer_url=ctx.referer_url)
+    skipped = (extra_data or {}).get('skipped')
+    size = extra_data.get('size') if skipped else len(js_str or '')
+    # 埋め込むスクリプトもページの予算から使う
+    if not skipped and not charge_page_bytes(size):
+        skipped = 'max_page_bytes'
+    if skipped:
+        # 大きすぎるスクリプトは，絶対 URL で参照する
+        skip_asset(absurl(ctx.url, js['src']), skipped, size, verbose=ctx.verbose)
+        js['data-src'] = js['src']
+        js['src'] = absurl(ctx.url, js['src'])
+        return js
+    new_type = 'text/javascript' if not js.has_attr('type') or not js['type'] else js['type']
+    code = ctx.soup.new_tag('script', type=new_type)
+    code['data-src'] = js['src']
+    if type(js_str) == bytes:
+        js_str = js_str.decode('utf-8')
+    try:
+        if js_str.find('</script>') > -1 and get_job().parts is not None:
+            code['src'] = get_job().parts.add_part(absurl(ctx.url, js['src']), 'text/javascript;charset=utf-8',
+                                                   js_str.encode())
+        elif js_str.find('</script>') > -1:
+            code['src'] = 'data:text/javascript;base64,' + base64.b64encode(js_str.encode()).decode()
+        elif js_str.find(']]>') < 0:
+            code.string = '<!--//--><![CDATA[//><!--\n' + js_str + '\n//--><!]]>'
+        else:
+            # replace ]]> does not work at all for chrome, do not believe
+            # http://en.wikipedia.org/wiki/CDATA
+            # code.string = '<![CDATA[\n' + js_str.replace(']]>', ']]]]><![CDATA[>') + '\n]]>'
+            code.string = js_str
+    except Exception as ex:
+        if ctx.verbose:
+            logs.error('ERROR', '%r: %s', js_str, ex)
+        raise
+    js.replace_with(code)
+    return code
+
+
+def rewrite_frame(ctx: RewriteContext, frame):
+    """
+    iframe / frame の内容を取得し，data URI（MHTML では text/html のパート）に埋め込む
+    """
+    if frame.get('src') and ctx.frame_document is not None:
+        if ctx.verbose:
+            logs.debug('DEBUG', 'found %s %s', frame.name, frame['src'])
+        frame['data-src'] = frame['src']
+        frame_html = ctx.frame_document(frame['src'])
+        parts = get_job().parts
+        if parts is not None:
+            frame['src'] = parts.add_part(absurl(ctx.url, frame['data-src']), 'text/html;charset=utf-8',
+                                          frame_html.encode())
+        else:
+            frame['src'] = 'data:text/html;base64,' + base64.b64encode(frame_html.encode()).decode()
+    return frame
+
+
+def rewrite_img(ctx: RewriteContext, img):
+    """
+    画像を data URI に埋め込む
+    """
+    verbose = ctx.verbose
+    src = img_source(img, ctx.viewport_width)
+    if not src:
+        return img
+    img['data-src'] = img.get('src') or src
+    img['src'] = data_to_base64(ctx.url, src, verbose=verbose, optimizer=ctx.image_optimizer)
+
+    # `img` elements may have `srcset` attributes with multiple sets of images.
+    # To get a lighter document it will be cleared, and used only the standard `src` attribute.
+    # With viewport_width, the candidate that fits the viewport is embedded as `src` instead.
+
+    if img.get('srcset'):
+        img['data-srcset'] = img['srcset']
+        del img['srcset']
+        if verbose and ctx.viewport_width:
+            logs.debug('INFO', 'srcset candidate for %dpx => %s', ctx.viewport_width, src)
+        elif verbose:
+            logs.warn('WARN', 'srcset found in img tag. Attribute will be cleared. File src => %s', img['data-src'])
+
+    def check_alt(attr):
+        if img.has_attr(attr) and img[attr].startswith('this.src='):
+            # we do not handle this situation yet, just warn the user
+            if verbose:
+                logs.warn('WARN', '%s found in img tag and unhandled, which may break page', attr)
+
+    check_alt('onerror')
+    check_alt('onmouseover')
+    check_alt('onmouseout')
+    return img
 
-    def repl(matchobj) -> str:
-        src = matchobj.group(1).strip(' \'"')
-        # if src.lower().endswith('woff') or src.lower().endswith('ttf') \
-        # or src.lower().endswith('otf') or src.lower().endswith('eot'):
-        #     # dont handle font data uri currently
-        #     return 'url(' + src + ')'
-        base64_str = data_to_base64(index, src, verbose=verbose, referer_url=referer_url)
-        return f'url("{base64_str}")'
 
-    css = reg.sub(repl, css)
-    return css
+def rewrite_common(ctx: RewriteContext, tag) -> None:
+    """
+    すべてのタグに対する書き換え（文字コード，リンク，スタイルシート）
+    """
+    url = ctx.url
+    # HTMLの文字コードにUTF-8を設定する
+    if tag.name == "meta" and tag.has_attr('charset') and tag['charset'].lower() != "uft-8":
+        tag["charset"] = "UTF-8"
+    elif tag.name == "meta" and tag.has_attr('http-equiv') and tag['http-equiv'].lower() == "content-type" \
+            and tag.has_attr('content'):
+        tag["content"] = "text/html; charset=UTF-8"
+
+    # リンクを抜き出し
+    if ctx.full_url and tag.name == 'a' and tag.has_attr('href') and not tag['href'].startswith('#'):
+        tag['data-href'] = tag['href']
+        tag['href'] = absurl(url, tag['href'])
+        add_links(tag['href'])
+
+    # スタイルシートを抜き出し
+    if tag.has_attr('style'):
+        if tag['style']:
+            tag['style'] = handle_css_content(url, tag['style'], verbose=ctx.verbose)
+    elif tag.name == 'link' and tag.has_attr('type') and tag['type'] == 'text/css':
+        if tag.string:
+            tag.string = handle_css_content(url, tag.string, verbose=ctx.verbose)
+    elif tag.name == 'style':
+        if tag.string:
+            tag.string = handle_css_content(url, tag.string, verbose=ctx.verbose)
+
+
+# タグ名ごとの書き換え処理．rewrite_common より先に，この順番で適用する．
+tag_handlers = {
+    'link': rewrite_link,
+    'script': rewrite_script,
+    'iframe': rewrite_frame,
+    'frame': rewrite_frame,
+    'img': rewrite_img,
+}
+
+
+def rewrite_document(ctx: RewriteContext, traversal: str = 'single') -> None:
+    """
+    DOM を書き換える
+
+    Args:
+        ctx (RewriteContext): 書き換えで共有する値
+        traversal (str): 'single' は一度の走査で各タグに tag_handlers と rewrite_common を適用する．
+                         'multi' はタグの種類ごとに走査する従来の方法で，比較のために残している．
+    """
+    job = get_job()
+    start = time.perf_counter()
+    if traversal == 'multi':
+        for name, handler in tag_handlers.items():
+            for tag in ctx.soup(name):
+                handler(ctx, tag)
+        for tag in ctx.soup(True):
+            rewrite_common(ctx, tag)
+    elif traversal == 'single':
+        for tag in ctx.soup.find_all(True):
+            # 置き換えられたタグの子孫は処理しない
+            if tag.parent is None:
+                continue
+            handler = tag_handlers.get(tag.name)
+            if handler is not None:
+                tag = handler(ctx, tag)
+            if tag is not None:
+                rewrite_common(ctx, tag)
+    else:
+        raise ValueError(f'unknown traversal: {traversal}')
+    elapsed = time.perf_counter() - start
+    job.add_timing('rewrite', elapsed)
+    if ctx.verbose:
+        logs.info('INFO', 'rewrite (%s): %.3fs', traversal, elapsed)
+
+
+def choose_parser(parser: str = 'auto', rendered: bool = False) -> str:
+    """
+    HTML パーサを選ぶ
+
+    Args:
+        parser (str): 'auto'，または BeautifulSoup のパーサ名（'lxml'，'html5lib'，'html.parser'）
+        rendered (bool): ブラウザが描画した DOM（page_source やフレームの DOM）かどうか
+
+    Returns:
+        str: 'auto' の場合，ブラウザで描画した（正規化済みの）ページには高速な lxml を，
+             HTTP で取得したままのページやローカルファイルにはエラー回復の強い html5lib を返す
+    """
+    if parser != 'auto':
+        return parser
+    return 'lxml' if rendered else 'html5lib'
+
+
+def parse_html(html_doc, parser: str = 'html5lib', verbose: bool = True):
+    """
+    HTML を解析して DOM を作る．解析にかかった時間はジョブの parse に加え，verbose の場合は出力する．
+    """
+    from bs4 import BeautifulSoup
+
+    start = time.perf_counter()
+    soup = BeautifulSoup(html_doc, parser)
+    elapsed = time.perf_counter() - start
+    get_job().add_timing('parse', elapsed)
+    if verbose:
+        logs.info('INFO', 'parse (%s): %.3fs', parser, elapsed)
+    return soup
 
 
 def generate(url,
@@ -427,269 +1389,317 @@ def generate(url,
              errorpage=False,
              username=None, password=None,
              level: int = 1,
+             fetch_workers: int = 8,
+             max_frame_depth: int = 3,
+             html_doc: str = None,
+             frames: dict = None,
+             traversal: str = 'single',
+             parser: str = 'auto',
+             dedupe: bool = False,
+             viewport_width: int = None,
+             optimize_images: bool = False,
+             render_mode: str = 'always-browser',
+             output_format: str = 'html',
              **kwargs):
     """
     given a index url such as http://www.google.com, http://custom.domain/index.html
     return generated single html
-    """
 
-    global site_id
-    global base_url
-    global getting_time
+    fetch_workers: アセットを並列に先読みする数．1 以下なら逐次取得する．
+    max_frame_depth: 親のブラウザから DOM を取得する iframe / frame の深さ
+    html_doc, frames: 親のブラウザから取得済みのフレームの DOM と，その子フレーム
+    traversal: DOM の書き換え方．'single'（一度の走査）または 'multi'（タグの種類ごとに走査，比較用）
+    parser: HTML パーサ．'auto' は choose_parser を参照
+    dedupe: 複数回使われるアセットを一度だけ埋め込む（dedupe.dedupe_assets）
+    viewport_width: img の srcset から，この幅のビューポートに合う画像を選んで埋め込む
+    optimize_images: 埋め込む前に画像を縮小・再圧縮する（images.ImageOptimizer，Pillow が必要）
+    render_mode: 'always-browser'，'never-browser'，'auto'（get_page_html を参照）．
+                 ブラウザを使わずに取得したページには，スクリーンショットがない
+    output_format: 'html'（アセットを data URI で埋め込んだ HTML，storage_format で保存する）または
+                   'mhtml'（アセットを base64 にせずパートにした MHTML，download/html/*.mhtml）
+    """
 
+    token = None
+    log_token = None
     if level <= 1:
-        base_url = url
-        site_id = make_site_id(url)
+        # ページごとに新しいジョブを作る．フレームを含めて，ページ全体で page_timeout 秒の締め切りを共有する
+        prepare_download()
+        # 既存のダウンロードのディレクトリの取り込みは，このページを保存する前に済ませる
+        get_catalog()
+        job = ArchiveJob(url)
+        job.start(page_timeout)
+        if output_format == 'mhtml':
+            job.parts = MHTMLWriter(tmp_dir=prepare_download())
+        elif output_format not in output_formats:
+            raise ValueError(f'unknown output format: {output_format}')
+        token = current_job.set(job)
+        log_token = logs.bind(site_id=job.site_id)
+    else:
+        job = get_job()
+    try:
+        # html_doc, extra_data = get(index, verbose=verbose, verify=verify, ignore_error=errorpage,
+        #                            username=username, password=password)
+        #
+        # if extra_data and extra_data.get('url'):
+        #     index = extra_data['url']
+
+        # 親のブラウザから取得したフレームの DOM は描画済み
+        rendered = html_doc is not None
+        if html_doc is None:
+            html_doc, extra_data = get_page_html(url, render_mode=render_mode, verbose=verbose,
+                                                 flg_screen_shot=level <= 1, frame_depth=max_frame_depth)
+            frames = extra_data.get('frames')
+            rendered = extra_data['render'] == 'browser'
+            if level <= 1:
+                job.render = {'mode': render_mode, 'path': extra_data['render'], 'reason': extra_data['render_reason']}
+        referer_url = url
 
-    # html_doc, extra_data = get(index, verbose=verbose, verify=verify, ignore_error=errorpage,
-    #                            username=username, password=password)
-    #
-    # if extra_data and extra_data.get('url'):
-    #     index = extra_data['url']
+        # now build the dom tree
+        soup = parse_html(html_doc, choose_parser(parser, rendered=rendered), verbose=verbose)
+        if verbose:
+            logs.info('INFO', 'get %s', soup.title.string if soup.title else '')
 
-    html_doc, _ = get_contents_by_selenium(url, flg_screen_shot=True)
-    referer_url = url
+        image_optimizer = None
+        if optimize_images:
+            if ImageOptimizer.available():
+                image_optimizer = ImageOptimizer()
+            else:
+                logs.warn('WARN', 'Pillow is not installed. Images are embedded without optimization.')
+
+        if fetch_workers > 1:
+            with timed('prefetch'):
+                prefetch_assets(soup, url, keep_script=keep_script, workers=fetch_workers, verbose=verbose,
+                                referer_url=referer_url, viewport_width=viewport_width)
+
+        def frame_document(src: str) -> str:
+            """
+            フレームの HTML を生成する．親のブラウザで取得済みの場合はその DOM を使う．
+            """
+            captured = (frames or {}).get(src)
+            # 取得済みかどうかに関わらず，フレームはページと同じ設定で生成する
+            options = dict(level=level + 1, referer_url=referer_url, fetch_workers=fetch_workers,
+                           max_frame_depth=max_frame_depth, traversal=traversal, parser=parser, dedupe=dedupe,
+                           viewport_width=viewport_width, optimize_images=optimize_images,
+                           render_mode=render_mode, verbose=verbose)
+            if captured is not None:
+                add_links(captured['url'])
+                return generate(captured['url'], html_doc=captured['html'], frames=captured['frames'], **options)
+            elif level <= 1:
+                frame_html = generate(absurl(url, src), **options)
+                add_links(absurl(url, src))
+                return frame_html
+            else:
+                return "<!DOCTYPE html>" \
+                       "<html lang='en'><head><meta charset='utf-8'>" \
+                       "<title>Grandchild title</title></head>" \
+                       "<body><!-- Grandchild content --></body></html>"
+
+        rewrite_document(RewriteContext(soup, url, verbose=verbose, keep_script=keep_script, full_url=full_url,
+                                        referer_url=referer_url, frame_document=frame_document,
+                                        viewport_width=viewport_width, image_optimizer=image_optimizer),
+                         traversal=traversal)
+
+        if image_optimizer is not None and verbose:
+            stats = image_optimizer.stats
+            logs.info('INFO', 'images: %d optimized, %d -> %d bytes', stats['images'], stats['bytes_in'],
+                      stats['bytes_out'])
+
+        if dedupe and job.parts is None:
+            dedupe_report = dedupe_assets(soup, keep_script=keep_script)
+            # フレームの分も合わせて，ページのレポートに記録する
+            job.dedupe = {key: (job.dedupe or {}).get(key, 0) + value for key, value in dedupe_report.items()}
+            if verbose:
+                logs.info('INFO', 'dedupe: %d assets shared by %d references, %d bytes saved',
+                          dedupe_report['assets'], dedupe_report['references'], dedupe_report['bytes_saved'])
 
-    # now build the dom tree
-    # soup = BeautifulSoup(html_doc, 'lxml')
-    soup = BeautifulSoup(html_doc, 'html5lib')
-    soup_title = soup.title.string if soup.title else ''
-    log(f"[ INFO ] get {soup_title}")
+        # 出力データの生成
+        # prettify しない場合は，文書全体の文字列を作らずにファイルへ少しずつ書き出す
+        def write_result(f):
+            from .serializer import fix_data_urls, write_document
 
-    for link in soup('link'):
-        if link.get('href'):
-            # add_links(absurl(url, link['href']))
-            if 'mask-icon' in (link.get('rel') or []) or \
-                    'icon' in (link.get('rel') or []) or \
-                    'apple-touch-icon' in (link.get('rel') or []) or \
-                    'apple-touch-icon-precomposed' in (link.get('rel') or []):
-                link['data-href'] = link['href']
-                link['href'] = data_to_base64(url, link['href'], verbose=verbose)
-            elif link.get('type') == 'text/css' or \
-                    link['href'].lower().endswith('.css') or \
-                    'stylesheet' in (link.get('rel') or []):
-                new_type = 'text/css' if not link.get('type') else link['type']
-                css = soup.new_tag('style', type=new_type)
-                css['data-href'] = link['href']
-                for attr in link.attrs:
-                    if attr in ['href']:
-                        continue
-                    css[attr] = link[attr]
-
-                css_data, _ = get_contents(url,
-                                           relpath=link['href'],
-                                           verbose=verbose,
-                                           referer_url=referer_url)
-
-                new_css_content = handle_css_content(absurl(url, link['href']),
-                                                     css_data,
-                                                     verbose=verbose,
-                                                     referer_url=referer_url)
-                # if "stylesheet/less" in '\n'.join(link.get('rel') or []).lower():
-                # fix browser side less: http://lesscss.org/#client-side-usage
-                #     # link['href'] = 'data:text/less;base64,' + base64.b64encode(css_data)
-                #     link['data-href'] = link['href']
-                #     link['href'] = absurl(index, link['href'])
-                if False:  # new_css_content.find('@font-face') > -1 or new_css_content.find('@FONT-FACE') > -1:
-                    link['href'] = 'data:text/css;base64,' + base64.b64encode(new_css_content)
+            with timed('serialize'):
+                if prettify:
+                    f.write(fix_data_urls(soup.prettify(formatter='html5')))
                 else:
-                    css.string = new_css_content
-                    link.replace_with(css)
-            elif full_url:
-                link['data-href'] = link['href']
-                link['href'] = absurl(url, link['href'])
-
-    # Javascript を抜き出す
-    for js in soup('script'):
-        if not keep_script:
-            js.replace_with('')
-            continue
-        if not js.get('src'):
-            continue
-        new_type = 'text/javascript' if not js.has_attr('type') or not js['type'] else js['type']
-        code = soup.new_tag('script', type=new_type)
-        code['data-src'] = js['src']
-        js_str, _ = get_contents(url, relpath=js['src'], verbose=verbose, referer_url=referer_url)
-        if type(js_str) == bytes:
-            js_str = js_str.decode('utf-8')
-        try:
-            if js_str.find('</script>') > -1:
-                code['src'] = 'data:text/javascript;base64,' + base64.b64encode(js_str.encode()).decode()
-            elif js_str.find(']]>') < 0:
-                code.string = '<!--//--><![CDATA[//><!--\n' + js_str + '\n//--><!]]>'
-            else:
-                # replace ]]> does not work at all for chrome, do not believe
-                # http://en.wikipedia.org/wiki/CDATA
-                # code.string = '<![CDATA[\n' + js_str.replace(']]>', ']]]]><![CDATA[>') + '\n]]>'
-                code.string = js_str
-        except Exception as ex:
-            if verbose:
-                log(f"[ERROR]\t{repr(js_str)}: {ex}")
-            raise
-        js.replace_with(code)
-
-    # iframe の内容を取得
-    for i_frame in soup("iframe"):
-        if i_frame.get('src'):
-            log(f"[ DEBUG ] found iframe {i_frame['src']}")
-            # log(absurl(url, i_frame['src']))
-            i_frame['data-src'] = i_frame['src']
-            if level <= 1:
-                i_frame_html = generate(i_frame['src'], level=level + 1, referer_url=referer_url)
-                add_links(absurl(url, i_frame['data-src']))
-            else:
-                i_frame_html = "<!DOCTYPE html>" \
-                               "<html lang='en'><head><meta charset='utf-8'>" \
-                               "<title>Grandchild title</title></head>" \
-                               "<body><!-- Grandchild content --></body></html>"
-            i_frame['src'] = 'data:text/html;base64,' + base64.b64encode(i_frame_html.encode()).decode()
-
-    # iframe の内容を取得
-    for frame in soup("frame"):
-        if frame.get('src'):
-            log(f"[ DEBUG ] found frames {frame['src']}")
-            frame['data-src'] = frame['src']
-            if level <= 1:
-                frame_html = generate(frame['src'], level=level + 1, referer_url=referer_url)
-                add_links(absurl(url, frame['data-src']))
+                    write_document(soup, f, formatter='html5')
+
+        if level > 1:
+            buffer = io.StringIO()
+            write_result(buffer)
+            return buffer.getvalue()
+        else:
+            if job.parts is not None:
+                job.storage = save_mhtml(f"{job.site_id}_{job.getting_time}", soup, write_result)
             else:
-                frame_html = "<!DOCTYPE html><html lang='en'><head><meta charset='utf-8'>" \
-                             "<title>Grandchild title</title></head>" \
-                             "<body><!-- Grandchild content --></body></html>"
-            frame['src'] = 'data:text/html;base64,' + base64.b64encode(frame_html.encode()).decode()
-    for img in soup('img'):
-        if not img.get('src'):
-            continue
-        img['data-src'] = img['src']
-        img['src'] = data_to_base64(url, img['src'], verbose=verbose)
-
-        # `img` elements may have `srcset` attributes with multiple sets of images.
-        # To get a lighter document it will be cleared, and used only the standard `src` attribute
-        # Maybe add a flag to enable the base64 conversion of each `srcset`?
-        # For now a simple warning is displayed informing that image has multiple sources
-        # that are stripped.
-
-        if img.get('srcset'):
-            img['data-srcset'] = img['srcset']
-            del img['srcset']
+                job.storage = get_storage().save(f"{job.site_id}_{job.getting_time}", write_result)
+            html_file_path = job.storage['path']
+
+            save_links()
+            save_url_id_list()
+            save_report(verbose=verbose)
+            get_catalog().add(job.site_id, job.base_url, job.getting_time, html_path=html_file_path)
             if verbose:
-                log(f"[ WARN ] srcset found in img tag. Attribute will be cleared. File src => {img['data-src']}")
+                log_cache_stats()
+    finally:
+        if token is not None:
+            if job.parts is not None:
+                job.parts.close()
+            logs.unbind(log_token)
+            current_job.reset(token)
 
-        def check_alt(attr):
-            if img.has_attr(attr) and img[attr].startswith('this.src='):
-                # we do not handle this situation yet, just warn the user
-                if verbose:
-                    log(f'[ WARN ] {attr} found in img tag and unhandled, which may break page')
 
-        check_alt('onerror')
-        check_alt('onmouseover')
-        check_alt('onmouseout')
+def save_mhtml(name: str, soup, write_result) -> dict:
+    """
+    現在のジョブのページを MHTML で download/html/{name}.mhtml に保存する．
+    ルートの HTML は書き出しながら，パートは一時ファイルからコピーする．
 
-    for tag in soup(True):
-        # HTMLの文字コードにUTF-8を設定する
-        if tag.name == "meta" and tag.has_attr('charset') and tag['charset'].lower() != "uft-8":
-            tag["charset"] = "UTF-8"
-        elif tag.name == "meta" and tag.has_attr('http-equiv') and tag['http-equiv'].lower() == "content-type" \
-                and tag.has_attr('content'):
-            tag["content"] = "text/html; charset=UTF-8"
-
-        # リンクを抜き出し
-        if full_url and tag.name == 'a' and tag.has_attr('href') and not tag['href'].startswith('#'):
-            tag['data-href'] = tag['href']
-            tag['href'] = absurl(url, tag['href'])
-            add_links(tag['href'])
-
-        # スタイルシートを抜き出し
-        if tag.has_attr('style'):
-            if tag['style']:
-                tag['style'] = handle_css_content(url, tag['style'], verbose=verbose)
-        elif tag.name == 'link' and tag.has_attr('type') and tag['type'] == 'text/css':
-            if tag.string:
-                tag.string = handle_css_content(url, tag.string, verbose=verbose)
-        elif tag.name == 'style':
-            if tag.string:
-                tag.string = handle_css_content(url, tag.string, verbose=verbose)
-
-    # 出力データの生成
-    result = soup.prettify(formatter='html5')
-
-    # MIME image/jpeg が image/jpg になるので置換する
-    result = result.replace("url(data:image/jpg;base64,", "url(data:image/jpeg;base64,")
-
-    # CSS の URL（STR） をクオートで囲む
-    result = re.sub(r'url\s*\((data:.+?)\)', r'url("\1")', result)
-
-    if level > 1:
-        return soup.prettify(formatter='html5')
-    else:
-        html_file_path = f"{download_dir}/html/{site_id}_{getting_time}.html"
-        with open(html_file_path, 'w') as f:
-            f.write(result)
+    Returns:
+        dict: format，path，bytes（ファイルのバイト数），parts（パートの数）
+    """
+    job = get_job()
+    path = Path(download_dir) / 'html' / f'{name}.mhtml'
+    fd, tmp = tempfile.mkstemp(dir=str(path.parent))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            job.parts.write(f, job.base_url, write_result, title=soup.title.string if soup.title else '')
+        os.replace(tmp, str(path))
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    return {'format': 'mhtml', 'path': str(path), 'bytes': path.stat().st_size, 'parts': job.parts.stats['parts']}
 
-        save_links()
-        save_url_id_list()
+
+def log_cache_stats():
+    """
+    キャッシュの利用状況（ヒット，再検証，取得）をログに出す
+    """
+    stats = get_asset_cache().stats
+    logs.info('INFO', 'cache hit: %d, revalidated: %d (%d bytes reused), fetched: %d', stats['hit'],
+              stats['revalidated'], stats['revalidated_bytes'], stats['fetched'])
 
 
 def save_links():
-    global external_links
-    global internal_links
-    global base_url
-    global getting_time
-
-    links = [base_url]
-    internal_links.sort()
-    for url in sorted(set(internal_links)):
+    job = get_job()
+
+    links = [job.base_url]
+    job.internal_links.sort()
+    for url in sorted(set(job.internal_links)):
         if url not in links:
             links.append(url)
-    for url in sorted(set(external_links)):
+    for url in sorted(set(job.external_links)):
         if url not in links:
             links.append(url)
 
-    link_file_path = f"{download_dir}/link/{site_id}_{getting_time}.txt"
+    link_file_path = f"{download_dir}/link/{job.site_id}_{job.getting_time}.txt"
     with open(link_file_path, 'w') as f:
         f.write("\n".join(links))
 
 
+def save_report(verbose: bool = True):
+    """
+    ページの埋め込みの結果（使ったバイト数，埋め込まなかったアセット，dedupe の結果，段階ごとの所要時間）を JSON で保存する
+    """
+    job = get_job()
+    report = {
+        'url': job.base_url,
+        'site_id': job.site_id,
+        'getting_time': job.getting_time,
+        'page_bytes': job.page_bytes,
+        'max_page_bytes': max_page_bytes,
+        'max_asset_bytes': max_asset_bytes,
+        'page_timeout': page_timeout,
+        'deadline_exceeded': remaining_time() == 0,
+        'skipped': job.skipped_assets,
+        # プロセスで共有しているので，それまでのページの分も含む
+        'hosts': get_host_registry().report(),
+        'render': job.render,
+        'storage': job.storage,
+        'dedupe': job.dedupe,
+        'timings': job.timing_report(),
+    }
+    report_file_path = f"{download_dir}/report/{job.site_id}_{job.getting_time}.json"
+    with open(report_file_path, 'w') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    if not verbose:
+        return
+    if job.skipped_assets:
+        logs.info('INFO', '%d assets were not embedded, see %s', len(job.skipped_assets), report_file_path)
+    failing = [host for host, entry in report['hosts'].items() if entry['state'] != 'closed']
+    if failing:
+        logs.info('INFO', 'circuit open for %d hosts: %s', len(failing), ', '.join(failing))
+    if logs.enabled(logs.INFO):
+        timings = report['timings']
+        logs.info('TIME', '%.3fs total, %s', timings['elapsed'],
+                  ', '.join(f"{phase} {entry['seconds']:.3f}s" for phase, entry in timings['phases'].items()))
+
+
 def save_url_id_list():
-    global site_id
-    global base_url
-    global getting_time
+    job = get_job()
 
     link_file_path = f"{download_dir}/url_id_list.txt"
-    text = f"{site_id}\t{base_url}\t{getting_time}\n"
+    text = f"{job.site_id}\t{job.base_url}\t{job.getting_time}\n"
     with open(link_file_path, 'a') as f:
         f.write(text)
 
 
 def check_within_one_day(url):
-    global download_dir
-    global site_id
-    site_id = make_site_id(url)
-    files = Path(download_dir).glob(f"**/{site_id}_*JST.*")
-    now = datetime.now(timezone(timedelta(hours=+9), 'JST'))
-    for file in files:
-        m = re.search(r'(\d{8}T\d{6}JST)\.(.+)$', str(file))
-        if m:
-            get_time = datetime.strptime(f"{m.group(1)}".replace("JST", '+0900'), '%Y%m%dT%H%M%S%z')
-            td = now - get_time
-            if td.days < 1:
-                return True
-            else:
-                continue
-    return False
+    """
+    24 時間以内に取得したスナップショットがあるかどうかを，索引で調べる
+    """
+    return get_catalog().captured_within(make_site_id(url), 24 * 60 * 60)
 
-def short_cut(url):
-    global getting_time
 
+def export(url: str, getting_time: str = None, output: str = None) -> str:
+    """
+    保存したスナップショットを，保存形式によらず 1 つの HTML ファイルに書き出す
+
+    Args:
+        url (str): ページの URL
+        getting_time (str): 取得時刻（%Y%m%dT%H%M%SJST）．省略時は最新のスナップショット
+        output (str): 書き出すパス．省略時は {download_dir}/export/{site_id}_{取得時刻}.html（MHTML は .mhtml）
+
+    Returns:
+        str: 書き出したパス
+    """
+    site_id = make_site_id(url)
+    snapshots = [snapshot for snapshot in get_catalog().list_site(site_id)
+                 if snapshot['html_path'] and getting_time in (None, snapshot['getting_time'])]
+    if not snapshots:
+        raise FileNotFoundError(f'no snapshot for {url} {getting_time or ""}')
+    snapshot = snapshots[0]
+    if output is None:
+        os.makedirs(f"{download_dir}/export", exist_ok=True)
+        suffix = '.mhtml' if snapshot['html_path'].endswith('.mhtml') else '.html'
+        output = f"{download_dir}/export/{site_id}_{snapshot['getting_time']}{suffix}"
+    return export_snapshot(snapshot['html_path'], output)
+
+
+def short_cut(url, log_level: str = None, log_format: str = None, render_mode: str = 'always-browser',
+              storage: str = None, output_format: str = 'html'):
+    """
+    render_mode: 'always-browser'，'never-browser'，'auto'．auto は JavaScript が必要なページだけブラウザで描画する
+    storage: スナップショットの保存形式．'plain'，'gzip'，'zstd'，'pack'（埋め込んだアセットをスナップショット間で共有する）
+    output_format: 'html' または 'mhtml'（アセットを base64 にせずパートにする．storage は使わない）
+    log_level: 'debug'，'info'，'warn'，'error'．debug ではアセットごとの取得も出力する
+    log_format: 'text' または 'json'（1 行に 1 つの JSON）
+    """
+    global storage_format
+
+    logs.configure(log_level, log_format)
+    if storage:
+        storage_format = storage
     # 24時間以内に取得していたらパスする．
     if check_within_one_day(url):
         print("24時間以内に取得したデータがあります．")
         return False
 
-    generate(url)
+    generate(url, render_mode=render_mode, output_format=output_format)
 
 
 def main():
+    import fire
+
     fire.Fire(short_cut)
 
 